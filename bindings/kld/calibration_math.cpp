@@ -338,4 +338,20 @@ float kl_diversity(float *data, long long count, long long num_bins) {
 float kl_diversity_hist(int *data, float width, long long num_bins) {
   return real_multi_thread_kl_diversity_hist(data, width, num_bins);
 }
+
+// hist[i] += count of nonzero data with floor(|data| / width + 0.5) == i,
+// values out of [0, num_bins) are dropped
+void histogram_accumulate(float *data, long long count, float width,
+                          long long num_bins, long long *hist) {
+  for (long long i = 0; i < count; i++) {
+    float abs_data = fabsf(data[i]);
+    if (abs_data == 0) {
+      continue;
+    }
+    float index = floorf(abs_data / width + 0.5f);
+    if (index >= 0 && index < num_bins) {
+      hist[(long long)index] += 1;
+    }
+  }
+}
 }
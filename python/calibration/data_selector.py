@@ -10,6 +10,10 @@
 
 import random
 import pathlib
+import threading
+import queue
+import numpy as np
+from utils.npz_mmap import load_npz
 
 # input may be these cases
 # case 0: one input, and jpg
@@ -29,6 +33,142 @@ import pathlib
 # c.jpg,d.jpg
 
 
+# copy on write maps, callers may still modify the loaded data in place
+def load_npy(filename: str):
+    return np.load(filename, mmap_mode='c')
+
+
+class CalibrationDataset:
+    """
+    Lazily yield {input name: data} batches of a DataSelector, the same batches
+    calibration builds when loading all inputs at once. npy and uncompressed npz
+    inputs are memory mapped and the next batch is prepared by a background thread.
+    """
+
+    def __init__(self,
+                 ds,
+                 input_names: list,
+                 batch_size: int,
+                 input_batch_sizes: list = None,
+                 ppa_list: list = None,
+                 prefetch: int = 1):
+        self.ds = ds
+        self.input_names = input_names
+        self.batch_size = batch_size
+        self.input_batch_sizes = input_batch_sizes if input_batch_sizes else [batch_size] * len(
+            input_names)
+        self.ppa_list = ppa_list
+        self.prefetch = prefetch
+        self._len = None
+
+    def _concat(self, files, name, batch_size):
+        # batch 1 samples concatenated into one batch
+        data = np.concatenate([x[name].astype(np.float32) for x in files], axis=0)
+        return data[:batch_size]
+
+    def _npz_batches(self, load=True):
+        pending = {}
+        batch = {}
+        only_one = len(self.input_names) == 1
+        for data in self.ds.data_list:
+            x = load_npz(data)
+            if only_one:
+                assert (len(x.files) == 1)
+                n0 = self.input_names[0]
+                n1 = x.files[0]
+                if x.shape(n1)[0] > 1:
+                    batch[n0] = x[n1] if load else None
+                else:
+                    pending.setdefault(n1, []).append(x)
+                    if len(pending[n1]) < self.batch_size:
+                        continue
+                    files = pending.pop(n1)
+                    batch[n0] = self._concat(files, n1, self.batch_size) if load else None
+            else:
+                for i, input in enumerate(self.input_names):
+                    assert (input in x)
+                    if x.shape(input)[0] > 1:
+                        batch[input] = x[input] if load else None
+                        batch_size = self.batch_size
+                    else:
+                        pending.setdefault(input, []).append(x)
+                        batch_size = len(pending[input])
+                        if batch_size >= self.batch_size:
+                            files = pending.pop(input)
+                            batch[input] = self._concat(files, input, self.input_batch_sizes[i]) \
+                                if load else None
+                if batch_size < self.batch_size:
+                    continue
+            yield batch
+            batch = {}
+
+    def _batches(self, load=True):
+        if self.ds.all_npz:
+            yield from self._npz_batches(load)
+        elif self.ds.all_image:
+            for start in range(0, len(self.ds.data_list) - self.batch_size + 1, self.batch_size):
+                rows = [[s.strip() for s in data.split(',')]
+                        for data in self.ds.data_list[start:start + self.batch_size]]
+                yield {
+                    ppa.input_name: ppa.run(','.join(row[i] for row in rows))
+                    for i, ppa in enumerate(self.ppa_list)
+                }
+        else:
+            for data in self.ds.data_list:
+                inputs = [s.strip() for s in data.split(',')]
+                assert (len(self.input_names) == len(inputs))
+                yield {name: load_npy(input) for name, input in zip(self.input_names, inputs)}
+
+    def __len__(self):
+        if self._len is None:
+            if self.ds.all_npz:
+                self._len = sum(1 for _ in self._npz_batches(load=False))
+            elif self.ds.all_image:
+                self._len = len(self.ds.data_list) // self.batch_size
+            else:
+                self._len = len(self.ds.data_list)
+        return self._len
+
+    def __iter__(self):
+        if self.prefetch <= 0:
+            yield from self._batches()
+            return
+        batches = queue.Queue(self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def producer():
+            try:
+                for batch in self._batches():
+                    if not put((batch, None)):
+                        return
+                put((None, None))
+            except BaseException as e:
+                put((None, e))
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch, error = batches.get()
+                if error is not None:
+                    raise error
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+
 class DataSelector:
 
     def __init__(self, dataset: str, num: int = 0, data_list_file: str = None):
@@ -94,6 +234,10 @@ class DataSelector:
         for i, img in enumerate(self.image_list):
             print(" <{}> {}".format(i, img))
 
+    def dataset(self, input_names, batch_size, input_batch_sizes=None, ppa_list=None, prefetch=1):
+        return CalibrationDataset(self, input_names, batch_size, input_batch_sizes, ppa_list,
+                                  prefetch)
+
     def dump(self, file):
         with open(file, 'w') as f:
             for input in self.data_list:
@@ -17,47 +17,198 @@ import numpy as np
 import pymlir
 from ctypes import *
 from tqdm import tqdm
+import multiprocessing
+from itertools import islice
 import datetime
-from utils.preprocess import preprocess
+from utils.preprocess import preprocess, preprocess_image_batches
 from utils.mlir_parser import *
 from utils.log_setting import setup_logger
 from utils.misc import *
 #import graphviz as gz
 from math import *
 from scipy import spatial
-from calibration.data_selector import DataSelector
+from calibration.data_selector import DataSelector, load_npy
+from utils.npz_mmap import load_npz
 
 cur_dir_path = os.path.join(os.path.dirname(__file__))
 calibration_math_path = os.path.join("/".join(cur_dir_path.split("/")[:-2]), "lib/calibration_math.so")
 if not os.path.exists(calibration_math_path):
     calibration_math_path = "calibration_math.so"
 
+KLD_BINS = 128
+
+
+def kl_diversity_hist_batch(hists, widths):
+    # numpy version of kl_diversity_hist in calibration_math, all tensors at once
+    # hists: [num_tensors, bin_num] counts, widths: [num_tensors]
+    hists = np.asarray(hists, dtype=np.float64)
+    widths = np.asarray(widths, dtype=np.float32).reshape(-1)
+    num, bin_num = hists.shape
+    count = hists.sum(axis=1, keepdims=True)
+    kl = np.zeros([num, bin_num // KLD_BINS])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for m, i in enumerate(range(KLD_BINS, bin_num + 1, KLD_BINS)):
+            # P distribution, outliers are clipped into the last bin
+            p = hists[:, :i].copy()
+            p[:, i - 1] = hists[:, i - 1:].sum(axis=1)
+            p /= count
+            # Q distribution, i bins merged into KLD_BINS bins then expanded back
+            group = hists[:, :i].reshape(num, KLD_BINS, i // KLD_BINS)
+            positive_cnt = np.maximum(np.count_nonzero(group, axis=2), 1)
+            q_base = group.sum(axis=2) / positive_cnt / hists[:, :i].sum(axis=1, keepdims=True)
+            q = np.where(group != 0, q_base[:, :, None], 0).reshape(num, i)
+            kl[:, m] = np.sum(p * (np.log10(p + 1e-30) - np.log10(q + 1e-30)), axis=1)
+    # first minimum like the_min_index; nan (empty histogram) falls back to index 0
+    m_min = np.argmin(np.where(np.isnan(kl), np.inf, kl), axis=1)
+    m_min[np.isnan(kl).any(axis=1)] = 0
+    return widths * (m_min + 1).astype(np.float32) * np.float32(KLD_BINS)
+
+
+_pool_calib_lib = None
+KLD_POOL_MAX_WORKERS = 8
+
+
+def _kld_pool_init(math_lib_path):
+    global _pool_calib_lib
+    _pool_calib_lib = CDLL(math_lib_path)
+    _pool_calib_lib.kl_diversity_hist.restype = c_float
+
+
+def _kld_pool_run(job):
+    hist, width, bin_num = job
+    hist = np.ascontiguousarray(hist, dtype=np.int32)
+    return _pool_calib_lib.kl_diversity_hist(hist.ctypes.data_as(POINTER(c_int)),
+                                             c_float(width), c_longlong(bin_num))
+
+
+class HistogramAccumulator:
+    """
+    Accumulate the |x| histogram of one tensor over samples without per-sample copies.
+    Bin i counts nonzero x with floor(|x| / width + 0.5) == i, same as BaseKldCalibrator.histogram.
+    If abs_max is not given, width follows the abs max seen so far; the range grows by odd
+    factors so that old bins merge exactly into new ones.
+    """
+    chunk_size = 1 << 20
+
+    def __init__(self, bin_num, abs_max=None, calib_lib=None):
+        self.bin_num = bin_num
+        self.counts = np.zeros(bin_num, dtype=np.int64)
+        self.fixed = abs_max is not None
+        self.width = abs_max / (bin_num - 1) if self.fixed else None
+        self.calib_lib = calib_lib if hasattr(calib_lib, 'histogram_accumulate') else None
+        if self.calib_lib is not None:
+            self.calib_lib.histogram_accumulate.restype = None
+            self.calib_lib.histogram_accumulate.argtypes = [
+                POINTER(c_float), c_longlong, c_float, c_longlong, POINTER(c_longlong)
+            ]
+        self._buf = None
+
+    @property
+    def hist(self):
+        return self.counts.astype(np.int32)
+
+    def rebin(self, abs_max):
+        if self.width is None:
+            if abs_max > 0:
+                self.width = abs_max / (self.bin_num - 1)
+            return
+        factor = int(ceil(abs_max / (self.width * (self.bin_num - 1))))
+        if factor <= 1:
+            return
+        factor += 1 - factor % 2
+        # old bin k covers [(k - 0.5) * width, (k + 0.5) * width)
+        new_idx = (np.arange(self.bin_num) + factor // 2) // factor
+        counts = np.zeros(self.bin_num, dtype=np.int64)
+        np.add.at(counts, new_idx, self.counts)
+        self.counts = counts
+        self.width *= factor
+
+    def update(self, activation):
+        data = np.asarray(activation).reshape(-1)
+        if data.size == 0:
+            return
+        if not self.fixed:
+            self.rebin(max(abs(np.min(data)), abs(np.max(data))))
+        if self.width is None:
+            return
+        dtype = np.result_type(data, self.width)
+        if self.calib_lib is not None and data.dtype == np.float32 and dtype == np.float32:
+            data = np.ascontiguousarray(data)
+            self.calib_lib.histogram_accumulate(data.ctypes.data_as(POINTER(c_float)),
+                                                c_longlong(data.size), c_float(self.width),
+                                                c_longlong(self.bin_num),
+                                                self.counts.ctypes.data_as(POINTER(c_longlong)))
+            return
+        if self._buf is None or self._buf.dtype != dtype:
+            self._buf = np.empty(min(data.size, self.chunk_size), dtype=dtype)
+        for start in range(0, data.size, self.chunk_size):
+            chunk = data[start:start + self.chunk_size]
+            if chunk.size > self._buf.size:
+                self._buf = np.empty(chunk.size, dtype=dtype)
+            buf = self._buf[:chunk.size]
+            np.abs(chunk, out=buf)
+            np.divide(buf, self.width, out=buf)
+            np.add(buf, 0.5, out=buf)
+            np.floor(buf, out=buf)
+            # out of range values go to the extra bin and are dropped
+            np.clip(buf, 0, self.bin_num, out=buf)
+            count = np.bincount(buf.astype(np.int64), minlength=self.bin_num + 1)
+            self.counts += count[:self.bin_num]
+            # zeros are not counted
+            self.counts[0] -= chunk.size - np.count_nonzero(chunk)
+
+
 class BaseKldCalibrator:
 
     def __init__(self, math_lib_path=calibration_math_path):
+        self.math_lib_path = math_lib_path
         self.calib_lib = CDLL(math_lib_path)
         self.calib_lib.kl_diversity.restype = c_float
         self.calib_lib.kl_diversity_hist.restype = c_float
 
     def histogram(self, ndarray, abs_max, bin_num):
-        t = np.abs(ndarray.flatten())
-        t = t[t != 0]
-        width = abs_max / (bin_num - 1)
-        if t.size > 0:
-            hist, _ = np.histogram(np.floor(t / width + 0.5),
-                                   bins=bin_num,
-                                   range=(0, bin_num - 1),
-                                   density=False)
-        else:
-            hist = np.zeros(bin_num)
-        hist = hist.astype(np.int32)
-        return hist, width
+        acc = HistogramAccumulator(bin_num, abs_max, self.calib_lib)
+        acc.update(ndarray)
+        return acc.hist, acc.width
 
     def kld_threshold(self, hist, width, bin_num):
         threshold = self.calib_lib.kl_diversity_hist(hist.ctypes.data_as(POINTER(c_int)),
                                                      c_float(width), c_longlong(bin_num))
         return threshold
 
+    def kld_threshold_batch(self, hist_maps, engine='serial', processes=None):
+        """
+        hist_maps: {bin_num: (hists, widths)}, hists is [num_tensors, bin_num]
+        engine: 'numpy' evaluates every tensor of a bin_num at once,
+                'pool' spreads calibration_math calls of all bin_nums over spawned
+                processes, at most `processes` (default KLD_POOL_MAX_WORKERS),
+                'serial' calls calibration_math one tensor at a time
+        return: {bin_num: thresholds}
+        """
+        if engine == 'numpy':
+            return {
+                bin_num: kl_diversity_hist_batch(hists, widths)
+                for bin_num, (hists, widths) in hist_maps.items()
+            }
+        jobs = [(hist, width, bin_num) for bin_num, (hists, widths) in hist_maps.items()
+                for hist, width in zip(hists, widths)]
+        if engine == 'pool' and len(jobs) > 1:
+            processes = min(processes or KLD_POOL_MAX_WORKERS, os.cpu_count() or 1, len(jobs))
+            with multiprocessing.get_context("spawn").Pool(processes, initializer=_kld_pool_init,
+                                                           initargs=(self.math_lib_path, )) as pool:
+                results = pool.map(_kld_pool_run, jobs, chunksize=max(1, len(jobs) // (4 * processes)))
+        elif engine in ['pool', 'serial']:
+            results = [self.kld_threshold(np.ascontiguousarray(hist, dtype=np.int32), width, bin_num)
+                       for hist, width, bin_num in jobs]
+        else:
+            raise ValueError("unknown kld engine: {}".format(engine))
+        thresholds = {}
+        start = 0
+        for bin_num, (hists, _) in hist_maps.items():
+            thresholds[bin_num] = np.array(results[start:start + len(hists)], dtype=np.float32)
+            start += len(hists)
+        return thresholds
+
 
 class CalibrationTable:
 
@@ -195,6 +346,10 @@ class SimpleTuner:
 
         if self.ds.all_image:
             batched_inputs = self.input_num * ['']
+            # batches after tune_num + 1 are not used
+            image_inputs = preprocess_image_batches(
+                self.ppa_list, self.data_list[:(self.args.tune_num + 1) * self.batch_size],
+                self.batch_size)
         else:
             batched_inputs = {}
 
@@ -207,7 +362,7 @@ class SimpleTuner:
             if len(self.ref_activations) > self.args.tune_num + 1:
                 break
             if self.ds.all_npz:
-                x = np.load(data)
+                x = load_npz(data)
                 if only_one:
                     assert (len(x.files) == 1)
                     n0 = self.module.input_names[0]
@@ -261,7 +416,7 @@ class SimpleTuner:
                 for i in range(self.input_num):
                     batched_inputs[i] += '{},'.format(inputs[i])
                     if idx == self.batch_size:
-                        x = self.ppa_list[i].run(batched_inputs[i][:-1])
+                        x = image_inputs[i][batched_inputs[i][:-1]]
                         name = self.ppa_list[i].input_name
                         self.dq_activations[tune_idx][name] = [x, inp_ref_dict[name]]
                         self.ref_activations[tune_idx][name] = [x, inp_ref_dict[name]]
@@ -277,7 +432,7 @@ class SimpleTuner:
                 inputs = [s.strip() for s in inputs]
                 assert (self.input_num == len(inputs))
                 for name, input in zip(self.module.input_names, inputs):
-                    x = np.load(input)
+                    x = load_npy(input)
                     self.dq_activations[tune_idx][name] = [x, inp_ref_dict[name]]
                     self.ref_activations[tune_idx][name] = [x, inp_ref_dict[name]]
             tune_idx += 1
@@ -687,7 +842,16 @@ class ActivationCalibrator2(BaseKldCalibrator):
         self.num_samples = self.args.input_num
         if 'tune_steps' in self.debug_cmd:
             self.tune_steps = int(self.debug_cmd['tune_steps'])
-        self.load_net_input()
+        if 'stream_collect' in self.debug_cmd:
+            # inputs are loaded batch by batch while collecting
+            input_names = list(self.module.input_names)
+            self.dataset = ds.dataset(input_names, self.batch_size,
+                                      [self.parser.get_op_by_op_name(n).shape[0] for n in input_names],
+                                      self.ppa_list)
+            self.args.input_num = min(self.args.input_num, len(self.dataset))
+            assert self.args.input_num > 0
+        else:
+            self.load_net_input()
 
     def _clean_resource(self):
         del self.module
@@ -702,6 +866,7 @@ class ActivationCalibrator2(BaseKldCalibrator):
 
         if self.ds.all_image:
             batched_inputs = self.input_num * ['']
+            image_inputs = preprocess_image_batches(self.ppa_list, self.data_list, self.batch_size)
         else:
             batched_inputs = {}
         idx, tune_idx = 0, 0
@@ -710,7 +875,7 @@ class ActivationCalibrator2(BaseKldCalibrator):
         only_one = len(self.module.input_names) == 1
         for data in self.data_list:
             if self.ds.all_npz:
-                x = np.load(data)
+                x = load_npz(data)
                 if only_one:
                     assert (len(x.files) == 1)
                     n0 = self.module.input_names[0]
@@ -765,7 +930,7 @@ class ActivationCalibrator2(BaseKldCalibrator):
                 for i in range(self.input_num):
                     batched_inputs[i] += '{},'.format(inputs[i])
                     if idx == self.batch_size:
-                        x = self.ppa_list[i].run(batched_inputs[i][:-1])
+                        x = image_inputs[i][batched_inputs[i][:-1]]
                         name = self.ppa_list[i].input_name
                         self.dq_activations[tune_idx][name] = [x, inp_ref_dict[name]]
                         self.ref_activations[tune_idx][name] = [x, inp_ref_dict[name]]
@@ -781,7 +946,7 @@ class ActivationCalibrator2(BaseKldCalibrator):
                 inputs = [s.strip() for s in inputs]
                 assert (self.input_num == len(inputs))
                 for name, input in zip(self.module.input_names, inputs):
-                    x = np.load(input)
+                    x = load_npy(input)
                     self.dq_activations[tune_idx][name] = [x, inp_ref_dict[name]]
                     self.ref_activations[tune_idx][name] = [x, inp_ref_dict[name]]
             tune_idx += 1
@@ -841,9 +1006,163 @@ class ActivationCalibrator2(BaseKldCalibrator):
         if len(self.parser.get_pre_op_by_op_name(op_name)) > 0:
             value = self.module.invoke_at(op_name)
         self.module.clear_hooks()
+
+    def percentile_abs_value(self, all_data_test, res_length, total_size, per):
+        res = np.sort(all_data_test)[-res_length:]
+        inter = total_size - 1
+        idx = int((per / 100) * inter)
+        ratio = (per / 100) * inter - idx
+        return res[0] + ratio * (res[1] - res[0]) if res_length != 1 else res[0]
+
+    def check_zero_activation(self, out, min_value, max_value, abs_value):
+        if abs_value != None and abs_value <= 1e-5:
+            # if op's outputs are all close to zero, change it to 1e-5 for them.
+            min_value = -1e-5 if min_value < 0 else 0
+            max_value = 1e-5
+            abs_value = 1e-5
+            print("WARNING: layer {} is all zeros. Please check the "
+                  "input data correctness.".format(out))
+        return min_value, max_value, abs_value
+
+    def stream_tensor_map(self):
+        # layer name -> [(tensor name, op index)] collected when the layer is invoked,
+        # mirrors the tensors gen_ref_tensor keeps for each op
+        tensor_map = {}
+        for i, op_name in enumerate(self.parser.get_op_name_list()):
+            if self.parser.get_op_type_by_op_name(op_name) == 'top.Input':
+                tensor_map[op_name] = [(op_name, i)]
+                continue
+            if len(self.parser.get_pre_op_by_op_name(op_name)) == 0:
+                continue
+            outputs = self.parser.get_outputs_by_op_name(op_name)
+            if outputs is None:
+                continue
+            tensor_map[op_name] = [(out, i) for out in outputs
+                                   if out == op_name or self.parser.get_use_count_by_op_name(out) > 0]
+        return tensor_map
+
+    def stream_invoke(self, inputs, tensor_map, fold):
+        # run one sample through the whole net, fold each tensor as soon as it is produced
+        for name, data in inputs.items():
+            for out, i in tensor_map.get(name, []):
+                fold(out, i, data)
+            self.module.set_tensor(name, data)
+
+        def get_func(layer_name):
+            if layer_name in inputs:
+                return
+            for out, i in tensor_map.get(layer_name, []):
+                fold(out, i, self.module.get_tensor(out))
+
+        self.module.after_invoke(get_func)
+        self.module.invoke()
+        self.module.clear_hooks()
+
+    def stream_collect(self, th_maps):
+        # one forward per sample for min/max/abs_max, plus one more for histograms when
+        # kld is used, as the histogram width depends on the final abs_max of all samples
+        all_tensors = self.parser.get_op_name_list()
+        step = (99.999999 - 99.99) / len(all_tensors)
+        num = self.args.input_num
+        tensor_map = self.stream_tensor_map()
+        stats = {}
+
+        def fold_stats(out, i, activation):
+            if out not in stats:
+                stats[out] = {'min': inf, 'max': -inf, 'abs_max': -inf, 'size': activation.size,
+                              'top': np.zeros(0, dtype=np.float32)}
+            s = stats[out]
+            if 'use_torch_observer_for_cali' in self.debug_cmd:
+                from torch import Tensor
+                self.torchObserver_dict[out](Tensor(activation.astype(np.float32)))
+                return
+            s['min'] = min(np.min(activation), s['min'])
+            s['max'] = max(np.max(activation), s['max'])
+            if 'use_percentile9999' in self.debug_cmd:
+                per = 99.99 + i * step
+                res_length = int(num * s['size'] * (1 - per / 100)) + 1
+                # only the largest res_length values over all samples are needed
+                top = sort_distr(np.abs(activation.flatten()), res_length)
+                s['top'] = sort_distr(np.concatenate([s['top'], top]), res_length)
+            elif 'use_max' in self.debug_cmd:
+                s['abs_max'] = max(np.max(np.abs(activation)), s['abs_max'])
+
+        pbar = tqdm(range(num), total=num, position=0, leave=True)
+        for idx, inputs in enumerate(islice(self.dataset, num)):
+            pbar.set_description("activation_collect_and_calc_th for sample: {}".format(idx))
+            pbar.update(1)
+            self.stream_invoke(inputs, tensor_map, fold_stats)
+        pbar.close()
+
+        for i, evaled_op in enumerate(all_tensors):
+            min_value = inf
+            max_value = -inf
+            abs_value = None
+            max_abs_value = -inf
+            for out in self.parser.get_outputs_by_op_name(evaled_op):
+                if out not in stats:
+                    continue
+                s = stats[out]
+                if 'use_torch_observer_for_cali' in self.debug_cmd:
+                    self.activations_statistics[out] = (min_value, max_value, abs_value)
+                    self.observer_thresholds(out, th_maps)
+                    continue
+                min_value = min(s['min'], min_value)
+                max_value = max(s['max'], max_value)
+                abs_value = max(abs(min_value), abs(max_value))
+                if 'use_percentile9999' in self.debug_cmd:
+                    per = 99.99 + i * step
+                    res_length = int(num * s['size'] * (1 - per / 100)) + 1
+                    abs_value = self.percentile_abs_value(s['top'], res_length,
+                                                          num * s['size'], per)
+                elif 'use_max' in self.debug_cmd:
+                    max_abs_value = max(s['abs_max'], max_abs_value)
+                    abs_value = max_abs_value
+                min_value, max_value, abs_value = self.check_zero_activation(
+                    out, min_value, max_value, abs_value)
+                self.activations_statistics[out] = (min_value, max_value, abs_value)
+        stats.clear()
+
+        histogram_data_map = {}
+        histogram_width_map = {}
+        if 'use_torch_observer_for_cali' in self.debug_cmd or 'use_percentile9999' in self.debug_cmd \
+                or 'use_max' in self.debug_cmd:
+            return histogram_data_map, histogram_width_map
+
+        hist_accs = {}
+
+        def fold_hist(out, i, activation):
+            if out not in hist_accs:
+                _, _, abs_value = self.activations_statistics[out]
+                hist_accs[out] = HistogramAccumulator(self.histogram_bin_num, abs_value,
+                                                      self.calib_lib)
+            hist_accs[out].update(activation)
+
+        pbar = tqdm(range(num), total=num, position=0, leave=True)
+        for idx, inputs in enumerate(islice(self.dataset, num)):
+            pbar.set_description("histogram collect for sample: {}".format(idx))
+            pbar.update(1)
+            self.stream_invoke(inputs, tensor_map, fold_hist)
+        pbar.close()
+        for out, acc in hist_accs.items():
+            histogram_data_map[out] = acc.hist
+            histogram_width_map[out] = acc.width
+        return histogram_data_map, histogram_width_map
+
     def find_threshold(self, histogram_data_map, histogram_width_map):
         thresholds = {}
         num = len(histogram_data_map)
+        engine = self.debug_cmd.get('kld_engine', 'serial')
+        if engine in ['numpy', 'pool'] and num > 0:
+            names = list(histogram_data_map.keys())
+            hists = np.stack([histogram_data_map[name] for name in names])
+            widths = np.array([histogram_width_map[name] for name in names])
+            print("[{}] threshold of {} tensors by {}".format(self.histogram_bin_num, num, engine))
+            ths = self.kld_threshold_batch({self.histogram_bin_num: (hists, widths)},
+                                           engine)[self.histogram_bin_num]
+            for name, th in zip(names, ths):
+                thresholds[name] = float(th)
+            return thresholds
         pbar = tqdm(range(num), total=num, position=0, leave=True)
         for item in histogram_data_map:
             pbar.set_description("[{}] threshold: {}".format(self.histogram_bin_num, item))
@@ -865,6 +1184,11 @@ class ActivationCalibrator2(BaseKldCalibrator):
         thresholds_map_absmax4 = {}
         thresholds_map_scale4 = {}
         thresholds_map_zp4 = {}
+        th_maps = (thresholds_map, thresholds_map_absmax, thresholds_map_scale, thresholds_map_zp,
+                   thresholds_map4, thresholds_map_absmax4, thresholds_map_scale4, thresholds_map_zp4)
+        if 'stream_collect' in self.debug_cmd:
+            histogram_data_map, histogram_width_map = self.stream_collect(th_maps)
+            return self.calc_th(histogram_data_map, histogram_width_map, th_maps)
 
         all_tensors = self.parser.get_op_name_list()
         step = (99.999999 - 99.99) / len(all_tensors)
@@ -915,11 +1239,8 @@ class ActivationCalibrator2(BaseKldCalibrator):
                     # time1 = time.time()
                     # abs_value = np.percentile(np.abs(all_data), 99.99 + i * step)
                     # time2 = time.time()
-                    res = np.sort(all_data_test)[-res_length:]
-                    inter = num * tensor_size - 1
-                    idx = int((per / 100) * inter)
-                    ratio = (per / 100) * inter - idx
-                    abs_value = res[0] + ratio * (res[1] - res[0]) if res_length != 1 else res[0]
+                    abs_value = self.percentile_abs_value(all_data_test, res_length,
+                                                          num * tensor_size, per)
                     # time3 = time.time()
                     # print(abs_value)
                     # print(abs_value_test)
@@ -928,63 +1249,65 @@ class ActivationCalibrator2(BaseKldCalibrator):
                 elif 'use_max' in self.debug_cmd:
                     #t0 = time.time()
                     abs_value = max_abs_value
-                if abs_value != None and abs_value <= 1e-5:
-                    # if op's outputs are all close to zero, change it to 1e-5 for them.
-                    min_value = -1e-5 if min_value < 0 else 0
-                    max_value = 1e-5
-                    abs_value = 1e-5
-                    print("WARNING: layer {} is all zeros. Please check the "
-                          "input data correctness.".format(out))
+                min_value, max_value, abs_value = self.check_zero_activation(
+                    out, min_value, max_value, abs_value)
                 self.activations_statistics[out] = (min_value, max_value, abs_value)
 
                 if 'use_torch_observer_for_cali' not in self.debug_cmd:
+                    _, _, abs_value = self.activations_statistics[out]
+                    acc = HistogramAccumulator(self.histogram_bin_num, abs_value, self.calib_lib)
                     for idx in range(self.args.input_num):
-                        activation = self.get_ref_tensor(idx, out)
-                        _, _, abs_value = self.activations_statistics[out]
-                        hist, width = self.histogram(activation, abs_value, self.histogram_bin_num)
-                        if out not in histogram_data_map:
-                            histogram_data_map[out] = hist
-                            histogram_width_map[out] = width
-                        else:
-                            histogram_data_map[out] += hist
+                        acc.update(self.get_ref_tensor(idx, out))
+                    histogram_data_map[out] = acc.hist
+                    histogram_width_map[out] = acc.width
                 else:
-                    qmin, qmax = -128, 127
-                    scale, zp = self.torchObserver_dict[out].calculate_qparams()
-                    threshold = float(scale * max(-(qmin-zp), (qmax-zp)))
-                    threshold = 1e-5 if (threshold <= 1e-5) else threshold  # fix me
-                    thresholds_map[out] = threshold
-                    thresholds_map_absmax[out] = threshold
-                    thresholds_map_scale[out] = scale.numpy()[0]
-                    thresholds_map_zp[out] = zp.numpy()[0]
-                    if 'int4' in self.debug_cmd: # give when int4 selected, give symeetric value like in qat, both for int4 and int8
-                        qmin, qmax = -128, 127
-                        scale, zp = self.torchObserver_dict[out].calculate_qparams()
-                        threshold = float(scale * max(-(qmin-zp), (qmax-zp)))
-                        threshold = 1e-5 if (threshold <= 1e-5) else threshold  # fix me
-                        thresholds_map[out] = threshold
-                        thresholds_map_absmax[out] = threshold
-                        thresholds_map_scale[out] = threshold/127.5
-                        thresholds_map_zp[out] = 0
-                        qmin, qmax = -8, 7
-                        scale, zp = self.torchObserver_dict[out].calculate_qparams()
-                        threshold = float(scale * max(-(qmin-zp), (qmax-zp)))
-                        threshold = 1e-5 if (threshold <= 1e-5) else threshold
-                        thresholds_map4[out] = threshold
-                        thresholds_map_absmax4[out] = threshold
-                        thresholds_map_scale4[out] = threshold/127.5
-                        thresholds_map_zp4[out] = 0
+                    self.observer_thresholds(out, th_maps)
 
                 for idx in range(self.args.input_num):
                     self.clear_ref_tensor(idx, out)
         pbar.close()
-
+        return self.calc_th(histogram_data_map, histogram_width_map, th_maps)
+
+    def observer_thresholds(self, out, th_maps):
+        thresholds_map, thresholds_map_absmax, thresholds_map_scale, thresholds_map_zp, \
+            thresholds_map4, thresholds_map_absmax4, thresholds_map_scale4, thresholds_map_zp4 = th_maps
+        qmin, qmax = -128, 127
+        scale, zp = self.torchObserver_dict[out].calculate_qparams()
+        threshold = float(scale * max(-(qmin-zp), (qmax-zp)))
+        threshold = 1e-5 if (threshold <= 1e-5) else threshold  # fix me
+        thresholds_map[out] = threshold
+        thresholds_map_absmax[out] = threshold
+        thresholds_map_scale[out] = scale.numpy()[0]
+        thresholds_map_zp[out] = zp.numpy()[0]
+        if 'int4' in self.debug_cmd: # give when int4 selected, give symeetric value like in qat, both for int4 and int8
+            qmin, qmax = -128, 127
+            scale, zp = self.torchObserver_dict[out].calculate_qparams()
+            threshold = float(scale * max(-(qmin-zp), (qmax-zp)))
+            threshold = 1e-5 if (threshold <= 1e-5) else threshold  # fix me
+            thresholds_map[out] = threshold
+            thresholds_map_absmax[out] = threshold
+            thresholds_map_scale[out] = threshold/127.5
+            thresholds_map_zp[out] = 0
+            qmin, qmax = -8, 7
+            scale, zp = self.torchObserver_dict[out].calculate_qparams()
+            threshold = float(scale * max(-(qmin-zp), (qmax-zp)))
+            threshold = 1e-5 if (threshold <= 1e-5) else threshold
+            thresholds_map4[out] = threshold
+            thresholds_map_absmax4[out] = threshold
+            thresholds_map_scale4[out] = threshold/127.5
+            thresholds_map_zp4[out] = 0
+
+    def calc_th(self, histogram_data_map, histogram_width_map, th_maps):
+        thresholds_map, thresholds_map_absmax, thresholds_map_scale, thresholds_map_zp, \
+            thresholds_map4, thresholds_map_absmax4, thresholds_map_scale4, thresholds_map_zp4 = th_maps
         if 'use_torch_observer_for_cali' not in self.debug_cmd:
             thresholds_map = self.find_threshold(histogram_data_map, histogram_width_map)
             thresholds_map4 = thresholds_map.copy()
             for k, v in self.activations_statistics.items():
                 _, _, abs_val = v
                 thresholds_map_absmax[k] = abs_val
-                if thresholds_map[k] > abs_val:
+                # histograms are skipped in stream mode when the threshold is abs_max anyway
+                if k not in thresholds_map or thresholds_map[k] > abs_val:
                     thresholds_map[k] = abs_val
                     thresholds_map4[k] = abs_val
                 if 'use_percentile9999' in self.debug_cmd:
@@ -12,16 +12,24 @@ import pymlir
 pymlir.set_mem_mode("value_mem")
 import numpy as np
 import os
+import re
 import math
 import sys
 import copy
 import time
 import datetime
+import atexit
+import hashlib
+import multiprocessing
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
 from tqdm import tqdm
 from utils.mlir_shell import mlir_lowering
 from utils.mlir_parser import MlirParser
 from utils.misc import parse_debug_cmd
-from utils.preprocess import preprocess
+from utils.preprocess import preprocess, preprocess_image_batches
 from calibration.data_selector import DataSelector
 from utils.misc import cos_sim, seed_all
 import plotly.graph_objects as go
@@ -70,8 +78,149 @@ def find_all_pre_layers(all_pre_layers, op_name, parser, exist_ref_layers=None):
             all_pre_layers.append(op_name)
 
 
+MIX_MODEL_CACHE_SIZE = 4
+# lowering key -> [quanted_mlir_file, parser, idle modules, number of models in use, lowered here]
+g_mix_models = OrderedDict()
+# bytes of frontier activations a trial executor keeps in memory, the rest spill to disk
+FRONTIER_CACHE_BYTES = 1 << 30
+
+
+def file_digest(file: str):
+    if not file:
+        return ""
+    h = hashlib.sha1()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_stamp(file: str):
+    if not file or not os.path.exists(file):
+        return None
+    st = os.stat(file)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def top_weight_file(top_mlir: str):
+    with open(top_mlir, "r") as f:
+        match = re.search(r'module\.weight_file\s*=\s*"([^"]+)"', f.read())
+    return match.group(1) if match else None
+
+
+def lowering_key(top_mlir: str, mode: str, chip: str, calib_table: str = None, mix_table: str = None):
+    """
+    key of one lowering: the top mlir and its weights by stamp (bias correction
+    rewrites the weights in place), calibration and quantize tables by content
+    (searchers rewrite the same file names with new thresholds or layers)
+    """
+    h = hashlib.sha1()
+    for item in (os.path.realpath(top_mlir), file_stamp(top_mlir), file_stamp(top_weight_file(top_mlir)),
+                 mode, chip, file_digest(calib_table), file_digest(mix_table)):
+        h.update(repr(item).encode())
+    return h.hexdigest()
+
+
+def remove_lowered_files(quanted_mlir_file, parser):
+    # mlir_lowering names the weights of a quantize table after the output file
+    qtable_weight_file = quanted_mlir_file[:-len(".mlir")] + "_qtable_weights.npz"
+    for file in (quanted_mlir_file, parser.module_weight_file, qtable_weight_file):
+        try:
+            os.remove(file)
+        except OSError:
+            pass
+
+
+def evict_mix_models():
+    # drop the least recently used lowerings beyond the cache size, never one in use
+    for key in list(g_mix_models.keys()):
+        if len(g_mix_models) <= MIX_MODEL_CACHE_SIZE:
+            break
+        quanted_mlir_file, parser, _, in_use, owned = g_mix_models[key]
+        if in_use == 0:
+            del g_mix_models[key]
+            if owned:
+                remove_lowered_files(quanted_mlir_file, parser)
+
+
+def lower_mix_model(top_mlir: str, mode: str, chip: str, calib_table: str = None, mix_table: str = None):
+    """
+    lower the top mlir with tpuc-opt once per lowering key, return the key and
+    the lowered mlir file
+    """
+    key = lowering_key(top_mlir, mode, chip, calib_table, mix_table)
+    if key not in g_mix_models:
+        # searchers of other processes may lower the same model at the same time
+        quanted_mlir_file = '{}.{}.{}_{}.tune.mlir'.format(top_mlir, 'mix' if mix_table else mode, key[:8],
+                                                           os.getpid())
+        mlir_lowering(top_mlir, quanted_mlir_file, mode, chip, calib_table, False, mix_table)
+        g_mix_models[key] = [quanted_mlir_file, MlirParser(quanted_mlir_file), [], 0, True]
+    g_mix_models.move_to_end(key)
+    return key, g_mix_models[key][0]
+
+
+def hold_mix_model(key: str):
+    """keep a lowering from eviction until release_mix_model(key, None)"""
+    g_mix_models[key][3] += 1
+
+
+def get_mix_model(top_mlir: str, mode: str, chip: str, calib_table: str = None, mix_table: str = None,
+                  lowered: tuple = None):
+    """
+    keep the lowered files, the parser and the released modules of a lowering
+    until eviction, so that searchers asking again for an equal model skip
+    lowering and parsing; every model in use gets a module of its own.
+    lowered is the (key, quanted_mlir_file) of a lowering done by the searcher
+    process, trial workers only load it and leave its files to that process
+    """
+    if lowered is None:
+        key, _ = lower_mix_model(top_mlir, mode, chip, calib_table, mix_table)
+    else:
+        key, quanted_mlir_file = lowered
+        if key not in g_mix_models:
+            g_mix_models[key] = [quanted_mlir_file, MlirParser(quanted_mlir_file), [], 0, False]
+        g_mix_models.move_to_end(key)
+    entry = g_mix_models[key]
+    quanted_mlir_file, parser, idle_modules = entry[:3]
+    if idle_modules:
+        module = idle_modules.pop()
+    else:
+        module = pymlir.module()
+        module.load(quanted_mlir_file)
+    entry[3] += 1
+    evict_mix_models()
+    return key, quanted_mlir_file, module, parser
+
+
+def release_mix_model(key: str, module):
+    entry = g_mix_models.get(key)
+    if entry is None:
+        return
+    entry[3] -= 1
+    if module is not None and not entry[2]:
+        # one idle module is enough to serve the next equal model
+        entry[2].append(module)
+    evict_mix_models()
+
+
+def free_mix_models():
+    for quanted_mlir_file, parser, _, _, owned in g_mix_models.values():
+        if owned:
+            remove_lowered_files(quanted_mlir_file, parser)
+    g_mix_models.clear()
+
+
+atexit.register(free_mix_models)
+
+
 class MixQuantModel:
-    def __init__(self, fp32_mlir, chip: str, calib_table: str = None, mix_table: str = None, fp_type: str = 'auto'):
+    def __init__(self,
+                 fp32_mlir,
+                 chip: str,
+                 calib_table: str = None,
+                 mix_table: str = None,
+                 fp_type: str = 'auto',
+                 lowered: tuple = None):
         self.fp32_mlir = fp32_mlir
         self.chip = chip
         self.calib_table = None
@@ -89,12 +238,8 @@ class MixQuantModel:
                     print('parameter error, fp_type:{fp_type} not support by {chip}')
                     exit(1)
 
-        self.quanted_mlir_file = '{}.{}.tune.mlir'.format(fp32_mlir, 'mix' if mix_table else self.mode)
-        mlir_lowering(self.fp32_mlir, self.quanted_mlir_file, self.mode, self.chip,
-                      self.calib_table, False, self.mix_table)
-        self.module = pymlir.module()
-        self.module.load(self.quanted_mlir_file)
-        self.parser = MlirParser(self.quanted_mlir_file)
+        self.key, self.quanted_mlir_file, self.module, self.parser = get_mix_model(
+            self.fp32_mlir, self.mode, self.chip, self.calib_table, self.mix_table, lowered)
         self.weight_file = self.parser.module_weight_file
 
     def infer(self, data: list, global_compare_layers: list = None):
@@ -147,13 +292,247 @@ class MixQuantModel:
 
     def clean(self):
         try:
+            release_mix_model(self.key, self.module)
             del self.module
-            os.remove(self.quanted_mlir_file)
-            os.remove(self.weight_file)
         except:
             pass
 
 
+class ActivationCache:
+    """
+    Tensors of each sample, kept in memory up to max_bytes; the rest is
+    spilled to npy files of a temporary directory and read back memory-mapped.
+    """
+
+    def __init__(self, max_bytes: int = FRONTIER_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.data = {}  # (idx, name) -> array or npy file
+        self.spill_dir = None
+        self._finalizer = None
+
+    def put(self, idx, name, value):
+        if self.nbytes + value.nbytes <= self.max_bytes:
+            self.data[(idx, name)] = value
+            self.nbytes += value.nbytes
+            return
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='mix_frontier_')
+            self._finalizer = weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+        file = os.path.join(self.spill_dir, '{}.npy'.format(len(self.data)))
+        np.save(file, value)
+        self.data[(idx, name)] = file
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, idx, name):
+        value = self.data[(idx, name)]
+        if isinstance(value, str):
+            return np.load(value, mmap_mode='r')
+        return value
+
+    def clear(self):
+        self.data.clear()
+        self.nbytes = 0
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+            self.spill_dir = None
+
+
+class TrialExecutor:
+    """
+    Run trials that only change the quantization of one layer.
+
+    The first trial of a layer runs the whole network and caches, per sample,
+    the tensors flowing into the downstream cone of the layer. A later trial
+    whose lowered ops before the cone are identical sets those tensors and
+    invokes from the cone, so late layers cost a fraction of a full forward.
+    Any other trial runs in full and becomes the new reference.
+    """
+
+    def __init__(self, max_bytes: int = FRONTIER_CACHE_BYTES):
+        self.cache = ActivationCache(max_bytes)
+        self.layer_name = None
+        self.ref_ops = None  # signatures of the ops before the cone
+        self.start_op = None
+        self.frontier = []
+        self.partial = False
+
+    @staticmethod
+    def op_signatures(parser):
+        return [(op.name, op.type, tuple(op.opds), tuple(sorted(op.attrs.items()))) for op in parser.ops]
+
+    def set_layer(self, layer_name):
+        if layer_name != self.layer_name:
+            self.layer_name = layer_name
+            self.ref_ops = None
+            self.cache.clear()
+
+    def _find_frontier(self, parser, output_names):
+        cone = set(parser.get_all_next_ops_by_op_name(self.layer_name))
+        start = next((i for i, op in enumerate(parser.ops) if op.name in cone), None)
+        # invoke_from needs the name of a single result op
+        if start is None or len(parser.ops[start].outputs) != 1:
+            return None, []
+        produced = set()
+        for op in parser.ops[:start]:
+            produced.update(op.outputs)
+        needed = [opd for op in parser.ops[start:] for opd in op.opds] + list(output_names)
+        return start, [name for name in dict.fromkeys(needed) if name in produced]
+
+    def prepare(self, model, global_compare_layers):
+        """decide whether model can reuse the cached frontier of the layer"""
+        signatures = self.op_signatures(model.parser)
+        if self.ref_ops is not None and \
+                signatures[:len(self.ref_ops)] == self.ref_ops and \
+                len(signatures) > len(self.ref_ops) and signatures[len(self.ref_ops)][0] == self.start_op:
+            self.partial = True
+            return
+        self.partial = False
+        self.cache.clear()
+        output_names = model.module.output_names if global_compare_layers is None else global_compare_layers
+        start, self.frontier = self._find_frontier(model.parser, output_names)
+        if start is None:
+            self.ref_ops = None
+            return
+        self.ref_ops = signatures[:start]
+        self.start_op = signatures[start][0]
+
+    def infer(self, model, idx, data: list, global_compare_layers: list = None):
+        # a sample first seen by a partial trial runs in full and is cached then
+        if not self.partial or any((idx, name) not in self.cache for name in self.frontier):
+            outputs = model.infer(data, global_compare_layers)
+            if self.ref_ops is not None:
+                for name in self.frontier:
+                    if (idx, name) not in self.cache:
+                        self.cache.put(idx, name, model.module.get_tensor(name))
+            return outputs
+        for name in self.frontier:
+            model.module.set_tensor_from_int(name, self.cache.get(idx, name))
+        model.module.invoke_from(self.start_op)
+        outputs = {}
+        names = model.module.output_names if global_compare_layers is None else global_compare_layers
+        for name in names:
+            outputs[name] = model.module.get_tensor(name).copy()
+        return outputs
+
+    def close(self):
+        self.set_layer(None)
+
+
+# (searcher, global_compare_layers, layers_rate, predictions_gt) of a trial worker
+g_trial_context = None
+g_trial_executor = None
+
+
+def init_trial_worker(context):
+    global g_trial_context
+    g_trial_context = context
+
+
+def trial_executor(layer_name):
+    global g_trial_executor
+    if layer_name is None:
+        return None
+    if g_trial_executor is None:
+        g_trial_executor = TrialExecutor()
+    g_trial_executor.set_layer(layer_name)
+    return g_trial_executor
+
+
+def eval_trial(trial):
+    calib_table, mix_table, layer_name = trial
+    searcher, global_compare_layers, layers_rate, predictions_gt = g_trial_context
+    executor = trial_executor(layer_name)
+    model = MixQuantModel(searcher.fp32_mlir, searcher.chip, calib_table, mix_table)
+    outputs_cos = searcher.run_model(model, False, global_compare_layers, layers_rate, predictions_gt, executor)
+    model.clean()
+    return outputs_cos
+
+
+def eval_trials_on_samples(task):
+    """
+    losses of each sample in samples, for each trial in turn; trials come with
+    the lowering the searcher process did for them
+    """
+    trials, samples = task
+    searcher, global_compare_layers, layers_rate, predictions_gt = g_trial_context
+    results = []
+    for calib_table, mix_table, layer_name, lowered in trials:
+        executor = trial_executor(layer_name)
+        model = MixQuantModel(searcher.fp32_mlir, searcher.chip, calib_table, mix_table, lowered=lowered)
+        results.append(
+            searcher.sample_losses(model, samples, global_compare_layers, layers_rate, predictions_gt, executor))
+        model.clean()
+    return results
+
+
+class TrialScheduler:
+    """
+    Evaluate candidate (calibration table, mix table, changed layer) trials
+    over all samples. Trials naming the changed layer run through a per process
+    TrialExecutor, None runs the whole network.
+
+    With several workers every trial is lowered once here and the samples are
+    split among a pool of processes, each loading and running every lowered
+    trial on its own samples, so the frontier cached by the first trial of a
+    layer is reused by the others in every worker.
+    Losses are summed in sample order, giving the same results as one worker.
+    Workers are spawned instead of forked since the searcher process has
+    already run OpenMP kernels.
+    """
+
+    def __init__(self, searcher, global_compare_layers, layers_rate, predictions_gt, num_workers: int = 1):
+        self.context = (searcher, global_compare_layers, layers_rate, predictions_gt)
+        self.num_workers = max(1, num_workers)
+        self.pool = None
+
+    def run(self, trials: list):
+        """return the outputs cos of each trial"""
+        num_sample = self.context[0].num_sample
+        if self.num_workers == 1 or num_sample <= 1 or len(trials) == 0:
+            init_trial_worker(self.context)
+            return [eval_trial(trial) for trial in trials]
+
+        if self.pool is None:
+            self.pool = multiprocessing.get_context("spawn").Pool(self.num_workers, init_trial_worker,
+                                                                  (self.context, ))
+        num_shards = min(self.num_workers, num_sample)
+        shards = [list(range(num_sample * i // num_shards, num_sample * (i + 1) // num_shards))
+                  for i in range(num_shards)]
+        searcher = self.context[0]
+        lowered_trials = []
+        for calib_table, mix_table, layer_name in trials:
+            mode = "INT8" if calib_table else FLOAT_MAP[searcher.chip]
+            lowered = lower_mix_model(searcher.fp32_mlir, mode, searcher.chip, calib_table,
+                                      mix_table if calib_table else None)
+            hold_mix_model(lowered[0])
+            lowered_trials.append((calib_table, mix_table, layer_name, lowered))
+        try:
+            parts = self.pool.map(eval_trials_on_samples, [(lowered_trials, samples) for samples in shards])
+        finally:
+            for _, _, _, (key, _) in lowered_trials:
+                release_mix_model(key, None)
+        results = []
+        for i in range(len(trials)):
+            outputs_cos = 0
+            for part in parts:
+                for loss in part[i]:
+                    outputs_cos += loss
+            results.append(outputs_cos / num_sample)
+        return results
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if g_trial_executor is not None:
+            g_trial_executor.close()
+
+
 class MixPrecSearcher:
     def __init__(self, args):
         self.args = args
@@ -197,6 +576,14 @@ class MixPrecSearcher:
             self.post_process_path = None
             self.post_process_name = None
 
+    def __getstate__(self):
+        # sent to trial workers: the mlir parser, the redirected stdout and the
+        # search state are not needed to evaluate a model
+        state = self.__dict__.copy()
+        for k in ('parser', 'stdout', 'dot_log', 'int8_activations', 'input_data_buffer'):
+            state.pop(k, None)
+        return state
+
     def disable_print(self):
         if 'debug_log' not in self.debug_cmd:
             self.stdout = sys.stdout
@@ -226,6 +613,7 @@ class MixPrecSearcher:
             self.num_sample = len(ds.data_list) // self.batch_size
             batched_idx = 0
             batched_inputs = self.input_num * ['']
+            image_inputs = preprocess_image_batches(ppa_list, ds.data_list, self.batch_size)
             for data in ds.data_list:
                 inputs = data.split(',')
                 inputs = [s.strip() for s in inputs]
@@ -234,7 +622,7 @@ class MixPrecSearcher:
                 for i, input in enumerate(input_names):
                     batched_inputs[i] += '{},'.format(inputs[i])
                     if batched_idx == self.batch_size:
-                        x = ppa_list[i].run(batched_inputs[i][:-1])
+                        x = image_inputs[i][batched_inputs[i][:-1]]
                         count = self.parser.get_user_count_by_op_name(input)
                         self.ref_activations[tune_idx][input] = [x, count]
                 if batched_idx == self.batch_size:
@@ -571,25 +959,17 @@ class MixPrecSearcher:
                 layers_rate = len(global_compare_layers) * [1]
         return global_compare_layers, layers_rate, all_pre_layers
 
-    def run_model(self, model, float_type, global_compare_layers, layers_rate, predictions_gt):
+    def run_model(self, model, float_type, global_compare_layers, layers_rate, predictions_gt, executor=None):
         outputs_cos = 0
         if float_type:
             self.disable_print()
             self.logger.print_info("run float mode: {}".format(self.fp32_mlir))
         else:
             self.logger.print_info("run int8 mode: {}".format(self.fp32_mlir))
+        if executor is not None:
+            executor.prepare(model, global_compare_layers)
         for idx in range(self.num_sample):
-            data = []
-            for name in list(self.ref_activations[idx].keys()):
-                data.append(self.ref_activations[idx][name][0])
-            outputs = model.infer(data, global_compare_layers)
-            if self.post_process_path:
-                module_path = self.post_process_path
-                module_name = self.post_process_name
-                spec = importlib.util.spec_from_file_location(module_name, module_path)
-                modulevar = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(modulevar)
-                outputs = modulevar.PostProcess(outputs)
+            outputs = self.infer_sample(model, idx, global_compare_layers, executor)
             if float_type:
                 predictions_gt.append(outputs)
             else:
@@ -597,6 +977,32 @@ class MixPrecSearcher:
         outputs_cos = outputs_cos / self.num_sample
         return outputs_cos
 
+    def infer_sample(self, model, idx, global_compare_layers, executor=None):
+        data = []
+        for name in list(self.ref_activations[idx].keys()):
+            data.append(self.ref_activations[idx][name][0])
+        if executor is None:
+            outputs = model.infer(data, global_compare_layers)
+        else:
+            outputs = executor.infer(model, idx, data, global_compare_layers)
+        if self.post_process_path:
+            module_path = self.post_process_path
+            module_name = self.post_process_name
+            spec = importlib.util.spec_from_file_location(module_name, module_path)
+            modulevar = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(modulevar)
+            outputs = modulevar.PostProcess(outputs)
+        return outputs
+
+    def sample_losses(self, model, samples, global_compare_layers, layers_rate, predictions_gt, executor=None):
+        """the loss of model on each sample idx of samples, as summed by run_model"""
+        if executor is not None:
+            executor.prepare(model, global_compare_layers)
+        return [
+            self._loss(self.infer_sample(model, idx, global_compare_layers, executor), predictions_gt[idx],
+                       layers_rate) for idx in samples
+        ]
+
     def get_full_op_list(self, float_model, int8_model, fp_op_names, int8_op_names):
         full_op_list, cur_fp_op_idx = {}, 0
         for int8_op in int8_op_names:
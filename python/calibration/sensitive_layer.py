@@ -11,6 +11,7 @@ import logging
 from utils.mlir_parser import *
 from calibration.mix_precision import MixQuantModel
 from calibration.mix_precision import MixPrecSearcher
+from calibration.mix_precision import TrialScheduler
 from calibration.kld_calibrator import CalibrationTable, ActivationCalibrator2, SimpleTuner
 from pathlib import Path
 from utils.net_dot_log import net_dot_log
@@ -132,60 +133,45 @@ class SensitiveLayer:
 
 
     def search_sensitve_layer(self, layer_names, quantize_method_list, float_model, int8_model, layer_th_dicts, global_compare_layers, layers_rate, predictions_gt):
-        num_quantize_method = len(quantize_method_list)
         fp_layer_list = []
         for op_name in layer_names:
             fp_layer_list.append(op_name)
-        modified_layers = {}
-        last_tried_method = quantize_method_list[0]
         sensitive_layer_analysis_dict = {}
-        for layer_name in layer_names:
-            layer_type = self.parser.get_op_type_by_op_name(layer_name)
-            self.mix_prec.logger.print_info("start to handle layer: {}, type: {}".format(layer_name, layer_type))
-            fp_layer_list.remove(layer_name)
-            mix_table = self.mix_prec._gen_mix_table(fp_layer_list)
-            ret = False
-            while not ret:
-                if layer_name not in modified_layers:
-                    last_tried_method = quantize_method_list[0]
-                    modified_layers[layer_name] = [1, float('inf'), layer_th_dicts[last_tried_method][layer_name][1], last_tried_method]
-                    method = last_tried_method
-                    new_th = layer_th_dicts[last_tried_method][layer_name][1]  # layer_th_dicts{quantize_method: {layer_name:{fmax, th}}}
-                    new_cali_table_name = self.set_layer_new_th(int8_model, layer_name, new_th)
-                    last_tried_method = method
+        # the methods of one layer are independent trials on the same table,
+        # each only needs to re-run the network from that layer
+        scheduler = TrialScheduler(self.mix_prec, global_compare_layers, layers_rate, predictions_gt,
+                                   self.args.num_workers)
+        trial_tables = ["new_cali_table_{}.txt".format(i) for i in range(len(quantize_method_list))]
+        try:
+            for layer_name in layer_names:
+                layer_type = self.parser.get_op_type_by_op_name(layer_name)
+                self.mix_prec.logger.print_info("start to handle layer: {}, type: {}".format(layer_name, layer_type))
+                fp_layer_list.remove(layer_name)
+                mix_table = self.mix_prec._gen_mix_table(fp_layer_list)
+                trials = []
+                for method, trial_table in zip(quantize_method_list, trial_tables):
+                    new_th = layer_th_dicts[method][layer_name][1]  # layer_th_dicts{quantize_method: {layer_name:{fmax, th}}}
+                    self.cali_table.update_to(trial_table, layer_name, new_th)
                     self.mix_prec.logger.print_info("adjust layer {} th, with method {}, and threshlod {}".format(layer_name, method, new_th))
-                    mixmodel = MixQuantModel(self.fp32_mlir, self.chip, new_cali_table_name, mix_table)
-                    outputs_cos = 1 - self.mix_prec.run_model(mixmodel, False, global_compare_layers, layers_rate, predictions_gt)
+                    trials.append((trial_table, mix_table, layer_name))
+                best_loss, best_method = float('inf'), quantize_method_list[0]
+                for method, outputs_cos in zip(quantize_method_list, scheduler.run(trials)):
+                    outputs_cos = 1 - outputs_cos
                     self.mix_prec.logger.print_info("outputs_cos_los = {}".format(outputs_cos))
-                elif modified_layers[layer_name][0] < num_quantize_method:
-                    method_idx = modified_layers[layer_name][0]
-                    method = quantize_method_list[method_idx]
-                    if outputs_cos < modified_layers[layer_name][1]:
-                        modified_layers[layer_name][1] = outputs_cos
-                        modified_layers[layer_name][2] = layer_th_dicts[last_tried_method][layer_name][1]
-                        modified_layers[layer_name][3] = last_tried_method
-                    new_th = layer_th_dicts[method][layer_name][1]
-                    new_cali_table_name = self.set_layer_new_th(int8_model, layer_name, new_th)
-                    last_tried_method = method
-                    self.mix_prec.logger.print_info("adjust layer {} th, with method {}, and threshlod {}".format(layer_name, method, new_th))
-                    modified_layers[layer_name][0] += 1
-                    mixmodel = MixQuantModel(self.fp32_mlir, self.chip, new_cali_table_name, mix_table)
-                    outputs_cos = 1 - self.mix_prec.run_model(mixmodel, False, global_compare_layers, layers_rate, predictions_gt)
-                    self.mix_prec.logger.print_info("outputs_cos_los = {}".format(outputs_cos))
-                elif modified_layers[layer_name][0] == num_quantize_method:
-                    if outputs_cos < modified_layers[layer_name][1]:
-                        modified_layers[layer_name][1] = outputs_cos
-                        modified_layers[layer_name][2] = layer_th_dicts[last_tried_method][layer_name][1]
-                        modified_layers[layer_name][3] = last_tried_method
-                    best_th = modified_layers[layer_name][2]
-                    modified_layers[layer_name][0] += 1
-                    new_cali_table_name = self.set_layer_new_th(int8_model, layer_name, best_th)
-                    self.mix_prec.logger.print_info("layer {}, layer type is {}, best_th = {}, best_method = {}, best_cos_loss = {}"
-                                           .format(layer_name, layer_type, best_th, modified_layers[layer_name][3], modified_layers[layer_name][1]))
-                    sensitive_layer_analysis_dict[layer_name] = [modified_layers[layer_name][1], layer_type]
-                    ret = True
+                    if outputs_cos < best_loss:
+                        best_loss, best_method = outputs_cos, method
+                best_th = layer_th_dicts[best_method][layer_name][1]
+                new_cali_table_name = self.set_layer_new_th(int8_model, layer_name, best_th)
+                self.mix_prec.logger.print_info("layer {}, layer type is {}, best_th = {}, best_method = {}, best_cos_loss = {}"
+                                       .format(layer_name, layer_type, best_th, best_method, best_loss))
+                sensitive_layer_analysis_dict[layer_name] = [best_loss, layer_type]
 
-            fp_layer_list.append(layer_name)
+                fp_layer_list.append(layer_name)
+        finally:
+            scheduler.close()
+            for trial_table in trial_tables:
+                if os.path.exists(trial_table):
+                    os.remove(trial_table)
         return sensitive_layer_analysis_dict, new_cali_table_name
 
     def analysis_sensitive_layers(self, sensitive_layer_analysis_dict):
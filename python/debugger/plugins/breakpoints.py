@@ -49,8 +49,7 @@ class AddrBreakpoint(Breakpoint):
         if self.mode == "":
             self.mode = "rw"
 
-    def should_stop(self, tdb: TdbCmdBackend) -> bool:
-        op = tdb.get_op()
+    def match_op(self, op, tdb: TdbCmdBackend) -> bool:
         checked_values = []
         if "r" in self.mode:
             checked_values.extend(op.operands)
@@ -77,9 +76,7 @@ class CmdIdBreakpoint(Breakpoint):
         self.match_type = CMDType.tiu if text[0] == "T" else CMDType.dma
         self.match_index = int(text[1:])
 
-    def should_stop(self, tdb: "TdbCmdBackend") -> bool:
-        op = tdb.get_op()
-
+    def match_op(self, op, tdb: "TdbCmdBackend") -> bool:
         if self.match_type != op.cmd_type:
             return False
 
@@ -105,9 +102,7 @@ class ValueIdBreakpoint(Breakpoint):
     type = "value-id"
     pattern = re.compile("^%[0-9]+")
 
-    def should_stop(self, tdb: TdbCmdBackend) -> bool:
-        op = tdb.get_op()
-
+    def match_op(self, op, tdb: TdbCmdBackend) -> bool:
         index = tdb.get_plugin(FinalMlirIndexPlugin)  # type: FinalMlirIndexPlugin
         if not index.enabled:
             return False
@@ -122,8 +117,7 @@ class DialectOpBreakpoint(Breakpoint):
     type = "dialect"
     pattern = re.compile(r"^(tpu|top)\.\w+")
 
-    def should_stop(self, tdb: TdbCmdBackend) -> bool:
-        op = tdb.get_op()
+    def match_op(self, op, tdb: TdbCmdBackend) -> bool:
         index = tdb.get_plugin(FinalMlirIndexPlugin)  # type: FinalMlirIndexPlugin
         if not index.enabled:
             return False
@@ -180,6 +174,9 @@ class Breakpoints:
         self.breaks: Dict[int, Breakpoint] = {}
         self.break_id = 1
         self.tdb = tdb
+        # (start, end, matched): no enabled breakpoint matches a command in
+        # [start, end), and command end is matched if `matched`
+        self.scanned = None
 
     def __str__(self) -> str:
         table = [["index", "type", "enable", "text", "hit"]]
@@ -190,6 +187,7 @@ class Breakpoints:
         return df.to_string(index=False, header=False)
 
     def _clear(self):
+        self.scanned = None
         for b in self.breaks.values():
             b.hit_conut = 0
 
@@ -198,12 +196,14 @@ class Breakpoints:
             if i.match_break(text, self):
                 breakpoint = i(text, cond, index=self.break_id)
                 self.breaks[self.break_id] = breakpoint
+                self.scanned = None
                 self.break_id += 1
                 return breakpoint
 
     def delete_break(self, index: Union[int, List[int]]):
         if isinstance(index, int):
             index = [index]
+        self.scanned = None
         for i in index:
             if i in self.breaks:
                 return self.breaks.pop(index)
@@ -219,9 +219,47 @@ class Breakpoints:
                     return v
         return None
 
+    def next_break(self, tdb: "TdbCmdBackend", limit: int = None) -> int:
+        """
+        the first command in [tdb.cmd_point, limit) matched by an enabled
+        breakpoint, or limit if there is none. Ignore counts are left to
+        should_break, scanned commands are not matched again until the
+        breakpoints change.
+        """
+        end = len(tdb.cmditer) if limit is None else min(limit, len(tdb.cmditer))
+        breaks = [v for v in self.breaks.values() if v.enabled]
+        if len(breaks) == 0:
+            return end
+        if any(type(v).should_stop is not Breakpoint.should_stop for v in breaks):
+            # only checked against the current command
+            return tdb.cmd_point
+
+        start = origin = tdb.cmd_point
+        if self.scanned is not None:
+            scan_start, scan_end, matched = self.scanned
+            if scan_start <= start <= scan_end:
+                if matched or scan_end >= end:
+                    return min(scan_end, end)
+                start, origin = scan_end, scan_start
+
+        for point in range(start, end):
+            op = tdb.cmditer[point]
+            for v in breaks:
+                try:
+                    if v.match_op(op, tdb):
+                        self.scanned = (origin, point, True)
+                        return point
+                except Exception:
+                    # let the step report it
+                    self.scanned = (origin, point, True)
+                    return point
+        self.scanned = (origin, end, False)
+        return end
+
     def enable(self, index: Union[int, List[int]]):
         if isinstance(index, int):
             index = [index]
+        self.scanned = None
         for i in index:
             if i in self.breaks:
                 self.breaks[i].toggle_enable(True)
@@ -229,6 +267,7 @@ class Breakpoints:
     def disable(self, index: Union[int, List[int]]):
         if isinstance(index, int):
             index = [index]
+        self.scanned = None
         for i in index:
             if i in self.breaks:
                 self.breaks[i].toggle_enable(False)
@@ -314,6 +353,9 @@ class BreakpointPlugin(TdbPlugin, TdbPluginCmd):
     def after_load(self, tdb: TdbCmdBackend):
         self.breakpoints._clear()
 
+    def next_step_point(self, tdb: TdbCmdBackend, limit: int) -> int:
+        return self.breakpoints.next_break(tdb, limit)
+
     def before_step(
         self,
         tdb: "TdbCmdBackend",
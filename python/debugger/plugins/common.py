@@ -416,6 +416,12 @@ class ProgressPlugin(TdbPlugin):
         )
         self.progress.refresh()
 
+    def next_step_point(self, tdb: TdbCmdBackend, limit: int) -> int:
+        # updated at the end of each fast-forward instead
+        return len(tdb.cmditer)
+
+    after_fast_forward = after_step
+
     def after_stop(self, tdb: TdbCmdBackend):
         self.progress.stop()
 
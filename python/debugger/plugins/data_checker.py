@@ -10,6 +10,8 @@
 import numpy as np
 from numpy.lib import format
 from typing import Tuple, Dict, List
+from collections import OrderedDict
+from bisect import bisect_left
 import os
 import json
 import zipfile
@@ -38,14 +40,15 @@ from enum import Enum
 
 
 class IncNpzFile:
-    def __init__(self, file: str):
+    def __init__(self, file: str, compression=zipfile.ZIP_STORED):
         """
-        :param file: the ``npz`` file to write
-        :param mode: must be one of {'x', 'w', 'a'}. See
-               https://docs.python.org/3/library/zipfile.html for detail
+        :param file: the ``npz`` file to append
+        :param compression: zip compression of the members, stored by default
+               so that dumping does not spend time in deflate
         """
         self.fn = file
-        self.zip = zipfile.ZipFile(file, mode="a", compression=zipfile.ZIP_DEFLATED)
+        self.compression = compression
+        self.zip = zipfile.ZipFile(file, mode="a", compression=compression)
         self.keys = set()
 
     def __setitem__(self, key: str, data) -> None:
@@ -59,7 +62,7 @@ class IncNpzFile:
         }
         if self.zip is None or self.zip.fp is None:
             self.zip = zipfile.ZipFile(
-                self.fn, mode="a", compression=zipfile.ZIP_DEFLATED
+                self.fn, mode="a", compression=self.compression
             )
 
         with self.zip.open(key, **kwargs) as fid:
@@ -67,8 +70,10 @@ class IncNpzFile:
             format.write_array(fid, val, allow_pickle=True)
 
     def __getitem__(self, key: str):
-        self.zip.close()
-        return np.load(self.fn, allow_pickle=True)[key]
+        if self.zip is None or self.zip.fp is None:
+            return np.load(self.fn, allow_pickle=True)[key]
+        with self.zip.open(key) as fid:
+            return format.read_array(fid, allow_pickle=True)
 
     def close(self):
         if self.zip is not None:
@@ -80,6 +85,129 @@ class IncNpzFile:
         return np.load(self.fn, allow_pickle=True)
 
 
+REF_CACHE_BYTES = 1 << 30
+
+GROUP3D_LAYOUTS = (
+    "continuous_group3d",
+    "eu_align_group3d",
+    "compact_group3d",
+    "eu_align_xn_group3d",
+    "compact_xn_group3d",
+)
+
+
+def parse_index(index: str):
+    """
+    turn a tensor_location slice such as ``[0:1, :, 2:4, ...]`` into a tuple of
+    ``slice``/``Ellipsis``; other expressions are compiled once and evaluated
+    """
+
+    def to_int(x: str):
+        x = x.strip()
+        return int(x) if x else None
+
+    try:
+        body = index.strip()
+        assert body[0] == "[" and body[-1] == "]"
+        items = []
+        for item in body[1:-1].split(","):
+            item = item.strip()
+            if item == "...":
+                items.append(Ellipsis)
+            elif ":" in item:
+                items.append(slice(*map(to_int, item.split(":"))))
+            else:
+                items.append(int(item))
+        return tuple(items)
+    except (AssertionError, IndexError, ValueError):
+        return compile(f"ref_data{index}", "<slice>", "eval")
+
+
+class RefDataStore:
+    """
+    Reference tensors of all ``npz`` files, indexed by name once.
+
+    Members are decompressed on first use and kept in a LRU cache bounded by
+    ``cache_bytes``; the reshape/slice/transpose of each operand is parsed
+    once and reused.
+    """
+
+    def __init__(self, files: List[str], cache_bytes: int = REF_CACHE_BYTES):
+        self.cache_bytes = cache_bytes
+        self.used_bytes = 0
+        self.cache: Dict[str, np.ndarray] = OrderedDict()
+        self.views: Dict[Tuple[str, str, str], Tuple] = {}
+        self.zips: List[zipfile.ZipFile] = []
+        # name -> (file index, member name)
+        self.index: Dict[str, Tuple[int, str]] = {}
+        for fn in files:
+            zf = zipfile.ZipFile(fn)
+            self.zips.append(zf)
+            for member in zf.namelist():
+                name = member[:-4] if member.endswith(".npy") else member
+                # the first file holding a name wins
+                self.index.setdefault(name, (len(self.zips) - 1, member))
+
+    def __contains__(self, name: str):
+        return name in self.index
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name in self.cache:
+            self.cache.move_to_end(name)
+            return self.cache[name]
+
+        idx, member = self.index[name]
+        with self.zips[idx].open(member) as fid:
+            data = format.read_array(fid)
+        # cached arrays are shared by all views
+        data.setflags(write=False)
+
+        self.cache[name] = data
+        self.used_bytes += data.nbytes
+        while self.used_bytes > self.cache_bytes and len(self.cache) > 1:
+            _, old = self.cache.popitem(last=False)
+            self.used_bytes -= old.nbytes
+        return data
+
+    def view(self, operand: Value):
+        key = (operand.reshape, operand.slice, operand.layout)
+        if key not in self.views:
+            reshape = operand.reshape
+            if reshape:
+                reshape = tuple(int(x) for x in reshape[1:-1].split("x"))
+            transpose = None
+            # The data in HW has a transposed collapsed shape.
+            # To align the Bmodel with TPU.mlir, we need to transpose the reference data.
+            if operand.layout in GROUP3D_LAYOUTS:
+                n, c, d, h, w = 0, 1, 2, 3, 4
+                transpose = (d, n, c, h, w)
+            self.views[key] = (reshape, parse_index(operand.slice), transpose)
+        return self.views[key]
+
+    def get(self, operand: Value):
+        if operand.name not in self.index:
+            return None
+
+        reshape, index, transpose = self.view(operand)
+        ref_data = self[operand.name]
+        if reshape:
+            ref_data = ref_data.reshape(reshape)
+        if isinstance(index, tuple):
+            data = ref_data[index]  # type: np.ndarray
+        else:
+            data = eval(index)
+        if transpose is not None:
+            data = data.transpose(transpose)
+        return data
+
+    def close(self):
+        for zf in self.zips:
+            zf.close()
+        self.zips.clear()
+        self.cache.clear()
+        self.used_bytes = 0
+
+
 class DumpMode(Enum):
     NEVER = 0
     FAILED = 1
@@ -211,9 +339,7 @@ class DataCheck(TdbPlugin, TdbPluginCmd):
     def __init__(self, tdb: TdbCmdBackend) -> None:
         super().__init__(tdb)
 
-        self.ref_data = []
-        for ref_fn in tdb.reference_data_fns:
-            self.ref_data.append(np.load(ref_fn))
+        self.ref_data = RefDataStore(tdb.reference_data_fns)
 
         self.tc = TensorCompare(
             cosine_similarity_tol=0.99,
@@ -247,6 +373,19 @@ class DataCheck(TdbPlugin, TdbPluginCmd):
 
         self._failed_tensor = None
         self.tdb.message(f"dump mode = {self.dump_mode}")
+        self.check_points = []
+        if self.enabled:
+            self.check_points = sorted(self.index.cmdkey2loc.keys())
+
+    def next_step_point(self, tdb: TdbCmdBackend, limit: int) -> int:
+        if self.ref_data is None or not self.enabled:
+            return len(tdb.cmditer)
+        # operands are checked before the step at a key, results after the
+        # step that reaches a key
+        pos = bisect_left(self.check_points, tdb.cmd_point)
+        if pos == len(self.check_points):
+            return len(tdb.cmditer)
+        return max(tdb.cmd_point, self.check_points[pos] - 1)
 
     @property
     def failed_tensor(self):
@@ -444,32 +583,7 @@ class DataCheck(TdbPlugin, TdbPluginCmd):
         return ["True", "False"]
 
     def get_ref_data(self, operand: Value):
-        for ref in self.ref_data:
-            if operand.name not in ref:
-                continue
-            reshape = operand.reshape
-            ref_data = ref[operand.name]
-
-            if reshape:
-                reshape = eval(reshape[1:-1].replace("x", ","))  # '1,3,1,192,1024'
-                ref_data = ref_data.reshape(reshape)
-
-            _slice = operand.slice
-            data = eval(f"ref_data{_slice}")  # type: np.ndarray
-            # The data in HW has a transposed collapsed shape.
-            # To align the Bmodel with TPU.mlir, we need to transpose the reference data.
-            if operand.layout in (
-                "continuous_group3d",
-                "eu_align_group3d",
-                "compact_group3d",
-                "eu_align_xn_group3d",
-                "compact_xn_group3d",
-            ):
-                n, c, d, h, w = 0, 1, 2, 3, 4
-                data = data.transpose((d, n, c, h, w))
-            return data
-
-        return None
+        return self.ref_data.get(operand)
 
     def check_data(self, value_view: ValueView) -> ComparedResult:
         value = value_view.value
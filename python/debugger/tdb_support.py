@@ -175,6 +175,8 @@ class TdbCmdBackend(cmd.Cmd):
 
         self.static_mode = False
         self.enable_message = True
+        # run commands no plugin watches without per-step callbacks
+        self.fast_forward_mode = True
         self.cmditer: List[Union[BaseTpuOp, CpuOp, DynIrOp]]
 
         self.plugins = PluginCompact(self)
@@ -205,6 +207,7 @@ class TdbCmdBackend(cmd.Cmd):
         self.status = TdbStatus.IDLE
         self.static_mode = False
         self._build_index()
+        self._build_computes()
 
     def _load_bmodel(self):
         bmodel_file = self.bmodel_file
@@ -290,6 +293,27 @@ class TdbCmdBackend(cmd.Cmd):
                 # breakpoint()
                 pass
 
+    def _build_computes(self):
+        """
+        bind the compute function of every command once, so that fast-forward
+        does not decode and dispatch each command again
+        """
+        computes = {
+            CMDType.tiu: self.runner.tiu_compute,
+            CMDType.dma: self.runner.dma_compute,
+            CMDType.cpu: self.runner.cpu_compute,
+            CMDType.dyn_ir: self.runner.dynamic_compute,
+        }
+        self.cmd_computes = []
+        for op in self.cmditer:
+            cmd, cmd_type = op.cmd, op.cmd_type
+            if self.decoder.is_end(cmd):
+                self.cmd_computes.append(None)
+            elif cmd_type in computes:
+                self.cmd_computes.append(partial(computes[cmd_type], cmd))
+            else:
+                self.cmd_computes.append(partial(self.error, "skip unknown CMDType"))
+
     def add_plugin(self, plugin_name: str):
         plugin = self.plugins.add_plugin(plugin_name)
 
@@ -383,6 +407,53 @@ class TdbCmdBackend(cmd.Cmd):
 
         self.cmd_point += 1
 
+    def next_step_point(self) -> int:
+        """
+        the first command from cmd_point on which any plugin needs to see
+        through before_step/after_step. Each plugin only looks as far as the
+        nearest point found so far.
+        """
+        point = len(self.cmditer)
+        for plugin in self.plugins.plugins.values():
+            point = min(point, plugin.next_step_point(self, point))
+            if point <= self.cmd_point:
+                break
+        return point
+
+    @add_callback("fast_forward")
+    def fast_forward(self, end: int):
+        """
+        execute commands in [cmd_point, end) without step callbacks, plugins
+        are only called before and after the whole range
+        """
+        computes = self.cmd_computes
+        point = self.cmd_point
+        try:
+            if self.static_mode:
+                point = end
+            else:
+                for point in range(self.cmd_point, end):
+                    compute = computes[point]
+                    if compute is not None:
+                        compute()
+                point = end
+        except ValueError as e:
+            self.error(e)
+            raise BreakpointStop()
+        finally:
+            self.cmd_point = point
+
+    def continue_step(self):
+        """
+        fast-forward to the next command watched by plugins, or step one
+        command if the current one is watched
+        """
+        if self.fast_forward_mode and self.status != TdbStatus.UNINIT:
+            end = self.next_step_point()
+            if end > self.cmd_point:
+                return self.fast_forward(end)
+        return self.step()
+
     def set_inputs_dict(self, inputs):
         args = self.atomic_mlir.functions[0].signature[0]
         from utils.lowering import lowering
@@ -520,7 +591,10 @@ class Breakpoint:
         return [f"{self.index}", self.type, enable_str, self.text, f"{self.hit_conut}"]
 
     def should_stop(self, tdb: TdbCmdBackend) -> bool:
-        pass
+        return self.match_op(tdb.get_op(), tdb)
+
+    def match_op(self, op, tdb: TdbCmdBackend) -> bool:
+        return False
 
     def toggle_enable(self, flag: bool):
         self.enabled = flag
@@ -566,6 +640,21 @@ class TdbPlugin:
     def before_next(self, tdb: TdbCmdBackend):
         pass
 
+    def next_step_point(self, tdb: TdbCmdBackend, limit: int) -> int:
+        """
+        the first command from tdb.cmd_point whose step this plugin needs to see,
+        commands before it may be fast-forwarded. Points at or beyond `limit`
+        are already covered by another plugin and need not be searched for.
+        Plugins with step callbacks see every step unless they override this.
+        """
+        cls = type(self)
+        if (
+            getattr(cls, "before_step", None) is None
+            and cls.after_step is TdbPlugin.after_step
+        ):
+            return len(tdb.cmditer)
+        return tdb.cmd_point
+
     def after_stop(self, tdb: TdbCmdBackend):
         pass
 
@@ -10,6 +10,10 @@
 import importlib
 import numpy as np
 import argparse
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import pymlir
 pymlir.set_mem_mode("value_mem")
 import onnx
@@ -22,19 +26,23 @@ from utils.misc import *
 from tools.model_runner import get_chip_from_model, round_away_from_zero
 
 
+def get_mlir_file(model_file):
+    if model_file.endswith(".bmodel") or model_file.endswith(".cvimodel"):
+        bmodel_mlir_file = ''.join(model_file.split('.')[:-1])
+        mlir_file = f'{bmodel_mlir_file}_tpu.mlir'
+        if not os.path.exists(mlir_file):
+            print(f'the mlir file:{mlir_file} of {model_file} is not exist, can not extract preprocess para')
+            exit(0)
+        return mlir_file
+    return model_file
+
 
 class common_inference():
     def __init__(self, args):
         self.idx = 0
         self.postprocess_type = args.postprocess_type
         if not args.model_file.endswith('.onnx'):
-            model_file = args.model_file
-            if args.model_file.endswith(".bmodel") or args.model_file.endswith(".cvimodel"):
-                bmodel_mlir_file = ''.join(args.model_file.split('.')[:-1])
-                model_file = f'{bmodel_mlir_file}_tpu.mlir'
-                if not os.path.exists(model_file):
-                    print(f'the mlir file:{model_file} of {args.model_file} is not exist, can not extract preprocess para')
-                    exit(0)
+            model_file = get_mlir_file(args.model_file)
             self.module = pymlir.module()
             self.module.load(model_file)
             self.module_parsered = MlirParser(model_file)
@@ -75,23 +83,58 @@ class common_inference():
             self.model_invoke()
         return self.score.get_result()
 
-    def model_invoke(self):
-        ratio_list = None
+    def run_list(self, items, start = 0, prefetch = 2):
+        """Evaluate items [(img_path, target)], numbered from start.
+
+        Items are packed into batches of the model batch size, the last batch
+        padded like get_result(). Preprocessing runs in a background thread up
+        to prefetch batches ahead of inference and scoring.
+        """
+        begin = time.time()
+        batches = []
+        for b in range(0, len(items), self.batch_size):
+            batch = list(items[b:b + self.batch_size])
+            batch += [batch[-1]] * (self.batch_size - len(batch))
+            batches.append((start + b + self.batch_size - 1, batch))
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = deque()
+            for idx, batch in batches:
+                img_paths = ','.join(path for path, _ in batch)
+                labels = [target for _, target in batch if target is not None]
+                pending.append((idx, img_paths, labels, pool.submit(self.preprocess, img_paths)))
+                if len(pending) > prefetch:
+                    idx, img_paths, labels, future = pending.popleft()
+                    self.forward(idx, img_paths, labels, *future.result())
+            while pending:
+                idx, img_paths, labels, future = pending.popleft()
+                self.forward(idx, img_paths, labels, *future.result())
+        cost = time.time() - begin
+        print('eval {} samples in {:.2f}s, {:.2f} samples/s'.format(
+            len(items), cost, len(items) / max(cost, 1e-6)))
+
+    def preprocess(self, img_paths):
         if 'not_use_preprocess' in self.debug_cmd:
-            self.x = self.score.preproc(self.batched_imgs)
-        else:
-            self.x= self.img_proc.run(self.batched_imgs)
-            ratio_list = self.img_proc.get_config('ratio')
+            return self.score.preproc(img_paths), None
+        x = self.img_proc.run(img_paths)
+        return x, self.img_proc.get_config('ratio')
+
+    def forward(self, idx, img_paths, labels, x, ratio_list):
+        self.idx = idx
+        self.x = x
         outputs = self.invoke()
-        if len(self.batched_labels) > 0:
-            self.score.update(self.idx, outputs, labels = self.batched_labels, ratios = ratio_list)
+        if len(labels) > 0:
+            self.score.update(self.idx, outputs, labels = labels, ratios = ratio_list)
         else:
-            self.score.update(self.idx, outputs, img_paths = self.batched_imgs, ratios = ratio_list)
-        self.batched_labels.clear()
-        self.batched_imgs = ''
+            self.score.update(self.idx, outputs, img_paths = img_paths, ratios = ratio_list)
         if (self.idx + 1) % 5 == 0:
             self.score.print_info()
 
+    def model_invoke(self):
+        x, ratio_list = self.preprocess(self.batched_imgs)
+        self.forward(self.idx, self.batched_imgs, self.batched_labels, x, ratio_list)
+        self.batched_labels.clear()
+        self.batched_imgs = ''
+
     def invoke(self):
         pass
 
@@ -275,5 +318,44 @@ class model_inference(object):
     def run(self, idx, img_path, target = None):
         self.engine.run(idx, img_path, target)
 
+    def run_list(self, items, start = 0):
+        self.engine.run_list(items, start)
+
     def get_result(self):
         self.engine.get_result()
+
+
+g_eval_parser = None
+
+
+def eval_shard(shard):
+    start, items = shard
+    engine = model_inference(g_eval_parser).engine
+    engine.run_list(items, start)
+    return engine.score
+
+
+def model_eval_parallel(parser, items, num_workers):
+    """Shard items across num_workers processes, each with its own model.
+
+    Shards are contiguous and aligned to the model batch size, so every sample
+    keeps its index and batch; the scores of the shards are merged in order.
+    """
+    global g_eval_parser
+    args, _ = parser.parse_known_args()
+    batch_size = MlirParser(get_mlir_file(args.model_file)).get_batch_size()
+    num_batches = (len(items) + batch_size - 1) // batch_size
+    num_workers = max(1, min(num_workers, num_batches))
+    step = (num_batches + num_workers - 1) // num_workers * batch_size
+    shards = [(b, items[b:b + step]) for b in range(0, len(items), step)]
+    g_eval_parser = parser
+    begin = time.time()
+    with multiprocessing.Pool(len(shards)) as pool:
+        scores = pool.map(eval_shard, shards)
+    cost = time.time() - begin
+    print('eval {} samples with {} workers in {:.2f}s, {:.2f} samples/s'.format(
+        len(items), len(shards), cost, len(items) / max(cost, 1e-6)))
+    score = scores[0]
+    for s in scores[1:]:
+        score.merge(s)
+    return score.get_result()
@@ -19,3 +19,7 @@ class base_class(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def print_info(self):
         pass
+
+    def merge(self, other):
+        # fold the score of another shard of the dataset into this one
+        raise NotImplementedError("{} can not be merged".format(type(self).__name__))
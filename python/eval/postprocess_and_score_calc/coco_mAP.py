@@ -495,5 +495,9 @@ class coco_mAP(base_class):
         # eval coco
         cal_coco_result(self.args.coco_annotation, './result_json_file')
 
+    def merge(self, other):
+        self.json_dict.extend(other.json_dict)
+        self.ratio_list.extend(other.ratio_list)
+
     def print_info(self):
         pass
@@ -65,5 +65,10 @@ class topx(base_class):
         top5 = self.c5/self.idx
         return top1, top5
 
+    def merge(self, other):
+        self.c1 += other.c1
+        self.c5 += other.c5
+        self.idx = max(self.idx, other.idx)
+
     def print_info(self):
         logger.info('idx:{0}, top1:{1:.3f}, top5:{2:.3f}'.format(self.idx, self.c1/self.idx, self.c5/self.idx))
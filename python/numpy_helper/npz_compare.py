@@ -14,9 +14,11 @@ import sys
 import argparse
 import struct
 from .tensor_compare import TensorCompare, TensorCompareStats
+import io
+import contextlib
 import multiprocessing
 from tqdm import tqdm
-import gc
+from utils.npz_mmap import load_npz
 
 
 def parse_args(args_list):
@@ -113,12 +115,7 @@ def dequantize(d1, threshold):
     return d1
 
 
-def compare_one_array(tc, npz1, npz2, name, verbose, lock, dic, int8_tensor_close,
-                      per_axis_compare):
-    lock.acquire()
-    d1 = npz1.get(name)
-    d2 = npz2.get(name)
-    lock.release()
+def compare_one_tensor(tc, d1, d2, name, verbose, int8_tensor_close, per_axis_compare):
     try:
         # dirty hack for NonMaxSuppression
         # onnx and bmodel can get correct shape, but top/tpu always get largest shape
@@ -132,21 +129,34 @@ def compare_one_array(tc, npz1, npz2, name, verbose, lock, dic, int8_tensor_clos
         print("Error: {} in two npz file is not same shape. {} v.s. {}".format(
             name, d1.shape, d2.shape))
         result = (False, tc.NOT_MATCH, {}, None)
-        dic[name] = result
         return result
     result = tc.compare(d1, d2, verbose, int8_tensor_close, per_axis_compare)
-    dic[name] = result
     return result
 
 
-def print_result_one_array(tc, npz1, name, dic, verbose, per_axis_compare):
+# per worker state of the compare pool, both npz are opened once per worker and
+# tensors are memory mapped (or decompressed) by name on demand
+_compare_ctx = None
+
+
+def _compare_init(f1, f2, tc, verbose, int8_tensor_close, per_axis_compare):
+    global _compare_ctx
+    _compare_ctx = (load_npz(f1), load_npz(f2), tc, verbose, int8_tensor_close, per_axis_compare)
+
+
+def _compare_name(name):
+    npz1, npz2, tc, verbose, int8_tensor_close, per_axis_compare = _compare_ctx
     d1 = npz1[name]
-    tc.print_result(d1, name, dic[name], verbose, per_axis_compare)
+    result = compare_one_tensor(tc, d1, npz2[name], name, verbose, int8_tensor_close,
+                                per_axis_compare)
+    # the printed result only needs target data, format it here instead of reloading it
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        tc.print_result(d1, name, result, verbose, per_axis_compare)
+    return name, result, log.getvalue()
 
 
 def npz_compare(args_list):
-    lock = multiprocessing.Lock()
-    dic = multiprocessing.Manager().dict()
     args = parse_args(args_list)
     f1 = args.target_file
     f2 = args.ref_file
@@ -166,8 +176,8 @@ def npz_compare(args_list):
     quant_types = {}
 
     int8_tensor_close = args.int8_tensor_close
-    npz1 = np.load(f1)
-    npz2 = np.load(f2)
+    npz1 = load_npz(f1)
+    npz2 = load_npz(f2)
     tc = TensorCompare(close_order_tol=3,
                        cosine_similarity_tol=tolerance[0],
                        euclidean_similarity_tol=tolerance[1],
@@ -188,43 +198,37 @@ def npz_compare(args_list):
 
     stats = TensorCompareStats()
 
-    names_list = list(names)  # deep copy
-    if len(names_list) > 200:
-        step = len(names_list) // 200
-        if step > 1:
-            names_list = names_list[::step]
-        if names[-1] not in names_list:
-            # last compare is very important
-            names_list.append(names[-1])
-    process_number = min(multiprocessing.cpu_count(), 8)
+    # every tensor is compared, large ones are dispatched first to balance the workers
+    names_list = sorted(names, key=lambda name: npz1.nbytes(name) + npz2.nbytes(name), reverse=True)
+    process_number = min(multiprocessing.cpu_count(), 8, max(len(names_list), 1))
     if args.per_axis_compare >= 0:
         process_number = 1
+    init_args = (f1, f2, tc, args.verbose, int8_tensor_close, args.per_axis_compare)
 
+    results = {}
     pbar = tqdm(names, total=len(names_list), position=0, leave=True)
-    while (len(names_list) > 0):
-        compare_process_name_list = names_list[:process_number]
-        names_list = names_list[process_number:]  # remove done name
-        # take process number names
-        # take name which will do compare
-        processes = []
-        for name in compare_process_name_list:
+    if process_number > 1:
+        with multiprocessing.Pool(process_number, initializer=_compare_init,
+                                  initargs=init_args) as pool:
+            for name, result, log in pool.imap_unordered(_compare_name, names_list):
+                pbar.set_description("compare {}".format(name))
+                pbar.update(1)
+                results[name] = (result, log)
+    else:
+        _compare_init(*init_args)
+        for name in names_list:
             pbar.set_description("compare {}".format(name))
             pbar.update(1)
-            p = multiprocessing.Process(target=compare_one_array,
-                                        args=(tc, npz1, npz2, name, args.verbose, lock, dic,
-                                              int8_tensor_close, args.per_axis_compare))
-            processes.append(p)
-            p.start()
-
-        for j in processes:
-            j.join()
-        gc.collect()
+            _, result, log = _compare_name(name)
+            results[name] = (result, log)
+    pbar.close()
 
     for name in names:
-        if dic.get(name) == None:
+        if name not in results:
             continue
-        stats.update(name, dic.get(name))
-        print_result_one_array(tc, npz1, name, dic, args.verbose, args.per_axis_compare)
+        result, log = results[name]
+        stats.update(name, result)
+        print(log, end='')
 
     stats.print_result()
     if (args.save):
@@ -10,7 +10,6 @@ import sys
 import struct
 # from math import fabs
 from enum import IntEnum
-from scipy import spatial
 from math import *
 from collections import OrderedDict
 
@@ -29,6 +28,79 @@ def get_topk(a, k):
     return topk
 
 
+def fused_metrics(xs, ys, close_orders=(), block_size=1 << 18):
+    """Similarity statistics of row pairs (xs[i], ys[i]) in one blocked pass.
+
+    All rows must have the same length. Each block of columns is copied once
+    into float64 buffers and every statistic is accumulated from it, instead
+    of one full pass (and full size temporaries) per metric. nan/inf are
+    replaced by 0/+-10000 for the metrics, close orders are checked on the
+    raw values like np.allclose(rtol=10**-order, atol=1e-8, equal_nan=True).
+    """
+    rows = len(xs)
+    size = xs[0].size if rows else 0
+    orders = list(close_orders)
+    acc = {
+        "equal": np.ones(rows, dtype=bool),
+        "close": np.ones((rows, len(orders)), dtype=bool),
+        "dot": np.zeros(rows),
+        "norm1": np.zeros(rows),
+        "norm2": np.zeros(rows),
+        "diff_norm": np.zeros(rows),
+        "max_abs_err": np.zeros(rows),
+        # (count, mean, M2) of x and of the noise x - y, merged blockwise
+        "mean1": np.zeros(rows),
+        "var1": np.zeros(rows),
+        "mean_noise": np.zeros(rows),
+        "var_noise": np.zeros(rows),
+    }
+    if rows == 0 or size == 0:
+        return acc
+    cols = max(1, min(size, block_size // rows))
+    a = np.empty((rows, cols))
+    b = np.empty((rows, cols))
+    d = np.empty((rows, cols))
+    t = np.empty((rows, cols))
+    count = 0
+    with np.errstate(invalid='ignore', over='ignore'):
+        for start in range(0, size, cols):
+            n = min(cols, size - start)
+            a_, b_, d_, t_ = a[:, :n], b[:, :n], d[:, :n], t[:, :n]
+            for i in range(rows):
+                a_[i] = xs[i].ravel()[start:start + n]
+                b_[i] = ys[i].ravel()[start:start + n]
+            acc["equal"] &= np.all(a_ == b_, axis=1)
+            if orders:
+                np.subtract(a_, b_, out=d_)
+                np.abs(d_, out=d_)
+                np.abs(b_, out=t_)
+                finite = np.isfinite(a_) & np.isfinite(b_)
+                if not finite.all():
+                    same = (a_ == b_) | (np.isnan(a_) & np.isnan(b_))
+                    d_[~finite] = np.where(same[~finite], 0.0, np.inf)
+                    t_[~finite] = 0.0
+                for k, order in enumerate(orders):
+                    acc["close"][:, k] &= np.all(d_ <= 1e-8 + 10**(-order) * t_, axis=1)
+            np.nan_to_num(a_, copy=False, nan=0.0, posinf=10000.0, neginf=-10000.0)
+            np.nan_to_num(b_, copy=False, nan=0.0, posinf=10000.0, neginf=-10000.0)
+            acc["dot"] += np.einsum('ij,ij->i', a_, b_)
+            acc["norm1"] += np.einsum('ij,ij->i', a_, a_)
+            acc["norm2"] += np.einsum('ij,ij->i', b_, b_)
+            np.subtract(a_, b_, out=d_)
+            acc["diff_norm"] += np.einsum('ij,ij->i', d_, d_)
+            np.maximum(acc["max_abs_err"], np.abs(d_).max(axis=1), out=acc["max_abs_err"])
+            for x_, key in ((a_, "1"), (d_, "_noise")):
+                mean = x_.sum(axis=1) / n
+                np.subtract(x_, mean[:, None], out=t_)
+                m2 = np.einsum('ij,ij->i', t_, t_)
+                delta = mean - acc["mean" + key]
+                acc["mean" + key] += delta * n / (count + n)
+                acc["var" + key] += m2 + delta * delta * count * n / (count + n)
+            count += n
+    acc["diff_norm"] = np.sqrt(acc["diff_norm"])
+    return acc
+
+
 class TensorCompare():
     NOT_MATCH = "NOT_MATCH"
     EQUAL = "EQUAL"
@@ -111,17 +183,66 @@ class TensorCompare():
             details['all'] = (d1, d2)
         return details
 
+    def close_orders(self):
+        # orders below close_order_tol never make a tensor CLOSE, no need to check them
+        return list(range(self.close_order_tol + 2, max(self.close_order_tol, 2) - 1, -1))
+
+    def channel_result(self, metrics, i, d1_loop, d2_loop, verbose, loop=0):
+        simi = {}
+        # check allclose, the highest order that passes
+        for k, order in enumerate(self.close_orders()):
+            if metrics["close"][i, k]:
+                simi["close_order"] = order
+                return (True, self.CLOSE, 0, simi, None)
+        if self.close_order_tol <= 2:
+            # the allclose search stops at order 2
+            simi["close_order"] = 2
+            return (True, self.CLOSE, 0, simi, None)
+
+        # check similarity
+        # cosine similarity
+        norm1, norm2 = metrics["norm1"][i], metrics["norm2"][i]
+        if norm1 != 0 and norm2 != 0:
+            cosine_similarity = metrics["dot"][i] / sqrt(norm1 * norm2)
+        else:
+            cosine_similarity = 0.0
+        # measure euclidean similarity, |(a+b)/2|^2 = (|a|^2 + |b|^2) / 2 - |a-b|^2 / 4
+        ed = metrics["diff_norm"][i]
+        sr = sqrt(max((norm1 + norm2) / 2 - ed * ed / 4, 0.0)) + 1e-7
+        if (np.isinf(ed) or np.isinf(sr)):
+            euclidean_similarity = 0.0
+        else:
+            euclidean_similarity = 1 - ed / sr
+        # SQNR is non-commutative, d1 is the signal and d1 - d2 the noise
+        var_raw, var_noise = metrics["var1"][i], metrics["var_noise"][i]
+        if var_noise <= 0 or var_raw <= 0:
+            sqnr = float('inf')
+        else:
+            sqnr = 10 * np.log10(var_raw / var_noise)
+
+        simi["cosine"] = float(cosine_similarity)
+        simi["euclid"] = float(euclidean_similarity)
+        simi["sqnr"] = float(sqnr)
+        simi["max_abs_err"] = float(metrics["max_abs_err"][i])
+        # check similarity
+        if (cosine_similarity > self.cosine_similarity_tol
+                and euclidean_similarity > self.euclidean_similarity_tol
+                and sqnr > self.signal_to_quantization_noise_tol):
+            return (True, self.SIMILAR, loop, simi, None)
+        # Not similar
+        details = self.diff_details(d1_loop, d2_loop, verbose)
+        return (False, self.NOT_SIMILAR, loop, simi, details)
+
     # structure of result is (result T/F, level, channel, similarity, detail)
     def compare(self, d1, d2, verbose, int8_tensor_close=True, per_axis_compare=-1):
         similarities = {}
         if d1.size != d2.size:
             return (False, self.NOT_MATCH, 0, similarities, None)
 
-        if np.array_equal(d1, d2):
-            return (True, self.EQUAL, 0, similarities, None)
-
         # int8 only check equal, not close
         if d1.dtype == np.int8 and int8_tensor_close:
+            if np.array_equal(d1, d2):
+                return (True, self.EQUAL, 0, similarities, None)
             details = self.diff_details(d1, d2, verbose)
             return (False, self.NOT_EQUAL, 0, similarities, details)
 
@@ -133,62 +254,16 @@ class TensorCompare():
         else:
             inner_dim = np.prod(d1.shape)
 
+        d1_rows = d1.reshape(outer_dim, inner_dim)
+        d2_rows = d2.reshape(outer_dim, inner_dim)
+        metrics = fused_metrics(d1_rows, d2_rows, self.close_orders())
+        if metrics["equal"].all():
+            return (True, self.EQUAL, 0, similarities, None)
+
         channel_simi = {}
         for loop in np.arange(outer_dim):
-            if outer_dim > 1:
-                d1_loop = d1.ravel()[loop * inner_dim:(loop + 1) * inner_dim]
-                d2_loop = d2.ravel()[loop * inner_dim:(loop + 1) * inner_dim]
-            else:
-                d1_loop = d1.ravel()
-                d2_loop = d2.ravel()
-            simi = {}
-            # check allclose
-            for order in range((self.close_order_tol + 2), 1, -1):
-                if (np.allclose(d1_loop, d2_loop, rtol=1 * 10**(-order), atol=1e-8,
-                                equal_nan=True)):
-                    break
-            if order >= self.close_order_tol:
-                simi["close_order"] = order
-                channel_simi[loop] = (True, self.CLOSE, 0, simi, None)
-                continue
-
-            d1_loop[np.isnan(d1_loop)] = 0.0
-            d2_loop[np.isnan(d2_loop)] = 0.0
-            d1_loop[np.isposinf(d1_loop)] = 10000.0
-            d1_loop[np.isneginf(d1_loop)] = -10000.0
-            d2_loop[np.isposinf(d2_loop)] = 10000.0
-            d2_loop[np.isneginf(d2_loop)] = -10000.0
-            # check similarity
-            # cosine similarity
-            # cosine_similarity_my = self.cosine_similarity(d1.flatten(), d2.flatten())
-            if np.sum(np.abs(d1_loop)) != 0 and np.sum(np.abs(d2_loop) != 0):
-                a = d1_loop if d1_loop.dtype == np.float32 else d1_loop.astype(np.float32)
-                b = d2_loop if d2_loop.dtype == np.float32 else d2_loop.astype(np.float32)
-                cosine_similarity = 1 - spatial.distance.cosine(a, b)
-            else:
-                cosine_similarity = 0.0
-            # measure euclidean similarity
-            ed = self.euclidean_distance(d1_loop, d2_loop)
-            sr = self.square_rooted((d1_loop + d2_loop) / 2) + 1e-7
-            if (np.isinf(ed) or np.isinf(sr)):
-                euclidean_similarity = 0.0
-            else:
-                euclidean_similarity = 1 - ed / sr
-
-            sqnr = self.sqnr_similarity(d1_loop, d2_loop)
-
-            simi["cosine"] = cosine_similarity
-            simi["euclid"] = euclidean_similarity
-            simi["sqnr"] = sqnr
-            # check similarity
-            if (cosine_similarity > self.cosine_similarity_tol
-                    and euclidean_similarity > self.euclidean_similarity_tol
-                    and sqnr > self.signal_to_quantization_noise_tol):
-                channel_simi[loop] = (True, self.SIMILAR, loop, simi, None)
-            else:
-                # Not similar
-                details = self.diff_details(d1_loop, d2_loop, verbose)
-                channel_simi[loop] = (False, self.NOT_SIMILAR, loop, simi, details)
+            channel_simi[loop] = self.channel_result(metrics, loop, d1_rows[loop], d2_rows[loop],
+                                                     verbose, loop)
 
         result = channel_simi[loop]
         min_cos = 1.0
@@ -199,6 +274,32 @@ class TensorCompare():
                 min_cos = ss['cosine']
         return result
 
+    def compare_batch(self, d1_list, d2_list, verbose, int8_tensor_close=True):
+        """Compare many same-shaped tensor pairs with one fused pass over all of them.
+
+        Returns a list of results in the same form as compare().
+        """
+        results = [None] * len(d1_list)
+        rows = []
+        for i, (d1, d2) in enumerate(zip(d1_list, d2_list)):
+            if d1.size != d2.size:
+                results[i] = (False, self.NOT_MATCH, 0, {}, None)
+            elif d1.dtype == np.int8 and int8_tensor_close:
+                results[i] = self.compare(d1, d2, verbose, int8_tensor_close)
+            else:
+                rows.append(i)
+        sizes = {d1_list[i].size for i in rows}
+        assert len(sizes) <= 1, "compare_batch expects tensors of the same size"
+        xs = [d1_list[i].ravel() for i in rows]
+        ys = [d2_list[i].ravel() for i in rows]
+        metrics = fused_metrics(xs, ys, self.close_orders())
+        for k, i in enumerate(rows):
+            if metrics["equal"][k]:
+                results[i] = (True, self.EQUAL, 0, {}, None)
+            else:
+                results[i] = self.channel_result(metrics, k, xs[k], ys[k], verbose)
+        return results
+
     def int8_tensor_stats(self, d):
         d_int8 = d.astype(np.int8)
         pos = np.sum(d_int8 == 127)
@@ -12,6 +12,7 @@ from enum import Enum
 import ctypes as ct
 from collections import namedtuple
 import struct as st
+import numpy as np
 
 from bmprofile_utils import *
 
@@ -845,6 +846,24 @@ class LayerInfo():
         prefix += "-{}".format(str(self.layer_type).split(".")[-1])
         return prefix
 
+def update_layers_time(layers, begin_usec, end_usec):
+    """LayerInfo.update_time for many records at once.
+
+    Record i of layers[i] ran from begin_usec[i] to end_usec[i]; each layer is
+    updated once with the min begin and max end of its records.
+    """
+    if len(layers) == 0:
+        return
+    unique_layers = dict()
+    layer_idx = np.array([unique_layers.setdefault(id(l), (len(unique_layers), l))[0] for l in layers])
+    num_layers = len(unique_layers)
+    layer_begin = np.full(num_layers, np.inf)
+    layer_end = np.full(num_layers, -np.inf)
+    np.minimum.at(layer_begin, layer_idx, np.asarray(begin_usec, dtype=np.float64))
+    np.maximum.at(layer_end, layer_idx, np.asarray(end_usec, dtype=np.float64))
+    for idx, layer in unique_layers.values():
+        layer.update_time(layer_begin[idx].item(), layer_end[idx].item())
+
 def enum_name(val):
     return str(val).split(".")[-1]
 
@@ -9,8 +9,10 @@
 # ==============================================================================
 
 import os
+import glob
+import json
 from collections import namedtuple
-from shutil import copyfile
+from shutil import copyfile, copyfileobj
 import logging
 from enum import Enum
 
@@ -135,36 +137,21 @@ class BMProfileGenerator:
                 f.write(self.__item_str((s.iteration, s.subnet_id, s.subnet_type, s.duration), **item_config))
 
         gmem_partition, lmem_partition = self.__partition_data(parsed_data[0])
-        time_data, gmem_records, lmem_records, _ = self.__time_data(parsed_data)
 
         detail_file = os.path.join(out_dir, "detail.csv")
         mem_file = os.path.join(out_dir, "mem.csv")
-        with open(detail_file, "w") as f:
+        # local records follow all global ones in mem.csv, keep them aside while streaming
+        lmem_file = mem_file + ".local"
+        with open(detail_file, "w") as f, open(mem_file, "w") as mem_f, open(lmem_file, "w+") as lmem_f:
             category_num = len(ShowCategory.__members__.keys())
             categories = [ShowCategory(c).name for c in range(category_num)]
             # f.write('let categories = {}\n'.format(self.__item_str(categories)))
             time_header = ["category", "begin_usec", "end_usec", "duration(us)", "func_type",
                            "layer_id", "layer_type", "subnet_id", "subnet_type", "iteration", "info"]
             f.write(self.__item_str(time_header, **item_config))
-            for td in time_data:
-                f.write(self.__item_str((
-                    "{}-{}".format(td.category, ShowCategory(td.category).name),
-                    td.begin_usec,
-                    td.end_usec,
-                    td.end_usec-td.begin_usec,
-                    td.func_type,
-                    td.layer_id,
-                    td.layer_type,
-                    td.subnet_id,
-                    td.subnet_type,
-                    td.iteration,
-                    td.info.replace("\n", ",").replace("<br>",",").strip(",")
-                ), **item_config))
-
-        with open(mem_file, "w") as f:
             mem_header = [ "mem_type", "start_addr", "end_addr", "byte_size", "rw_type", "start_usec", "end_usec", "duration", "partition", "info"]
-            f.write(self.__item_str(mem_header, **item_config))
-            def write_records(type_name, records, partitions):
+            mem_f.write(self.__item_str(mem_header, **item_config))
+            def write_records(f, type_name, records, partitions):
                 for m in records:
                     note = ""
                     for p in partitions:
@@ -183,10 +170,31 @@ class BMProfileGenerator:
                         note,
                         m.desc
                     ), **item_config))
-            write_records("global", gmem_records, gmem_partition)
-            write_records("local", lmem_records, lmem_partition)
-
-    def __generate_html(self, parsed_data, out_dir):
+            for _, time_data, gmem_records, lmem_records, _ in self.__iter_time_data(parsed_data):
+                for td in time_data:
+                    f.write(self.__item_str((
+                        "{}-{}".format(td.category, ShowCategory(td.category).name),
+                        td.begin_usec,
+                        td.end_usec,
+                        td.end_usec-td.begin_usec,
+                        td.func_type,
+                        td.layer_id,
+                        td.layer_type,
+                        td.subnet_id,
+                        td.subnet_type,
+                        td.iteration,
+                        td.info.replace("\n", ",").replace("<br>",",").strip(",")
+                    ), **item_config))
+                write_records(mem_f, "global", gmem_records, gmem_partition)
+                write_records(lmem_f, "local", lmem_records, lmem_partition)
+            lmem_f.seek(0)
+            copyfileobj(lmem_f, mem_f)
+        os.remove(lmem_file)
+
+    def __generate_html(self, parsed_data, out_dir, option):
+        if isinstance(option, str):
+            option = option_to_map(option)
+        chunk_rows = int(option.get("chunk_rows", 100000))
         if not os.path.exists(out_dir):
             os.mkdir(out_dir)
         assert os.path.isdir(out_dir)
@@ -231,12 +239,66 @@ class BMProfileGenerator:
             gmem_partition, lmem_partition = self.__partition_data(parsed_data[0])
             self.__write_data(f, "lmem_partition", lmem_partition)
             self.__write_data(f, "gmem_partition", gmem_partition)
-            time_data, gmem_records, lmem_records, _ = self.__time_data(parsed_data)
-            self.__write_data(f, "time_data", time_data)
-            self.__write_data(f, "gmem_op_record", gmem_records)
-            self.__write_data(f, "lmem_op_record", lmem_records)
+            # records are loaded by result.html from the chunk files on demand
+            self.__write_data(f, "time_data", [])
+            self.__write_data(f, "gmem_op_record", [])
+            self.__write_data(f, "lmem_op_record", [])
+            chunks = self.__write_chunks(parsed_data, out_dir, chunk_rows)
+            f.write("let profile_chunks = {}\n".format(json.dumps(chunks)))
         return os.path.join(out_dir, file_to_copy[0])
 
+    def __write_chunks(self, parsed_data, out_dir, chunk_rows):
+        """Stream time and mem records into chunk files.
+
+        Every part of __iter_time_data is split into chunks of at most
+        chunk_rows records each. profile_data/<index>.js passes a chunk to
+        profile_chunk_loaded() of result.html, profile_data/index.jsonl
+        describes one chunk per line. Returns the index.
+        """
+        chunk_dir_name = "profile_data"
+        chunk_dir = os.path.join(out_dir, chunk_dir_name)
+        os.makedirs(chunk_dir, exist_ok=True)
+        for old_file in glob.glob(os.path.join(chunk_dir, "*.js")):
+            os.remove(old_file)
+
+        def json_value(v):
+            return v if isinstance(v, (int, float)) else str(v)
+
+        chunks = []
+        with open(os.path.join(chunk_dir, "index.jsonl"), "w") as index_f:
+            for summary, time_data, gmem_records, lmem_records, _ in self.__iter_time_data(parsed_data):
+                num_rows = max(len(time_data), len(gmem_records), len(lmem_records))
+                for part, begin in enumerate(range(0, num_rows, chunk_rows)):
+                    end = begin + chunk_rows
+                    part_data = [("time_data", time_data[begin:end]),
+                                 ("gmem_op_record", gmem_records[begin:end]),
+                                 ("lmem_op_record", lmem_records[begin:end])]
+                    chunk_file = "{}/{}.js".format(chunk_dir_name, len(chunks))
+                    with open(os.path.join(out_dir, chunk_file), "w") as f:
+                        f.write("profile_chunk_loaded({}, {{\n".format(len(chunks)))
+                        for var_name, data in part_data:
+                            f.write('"{}": [\n'.format(var_name))
+                            for d in data:
+                                f.write("  {},\n".format(self.__item_str(d)))
+                            f.write("],\n")
+                        f.write("})\n")
+                    times = [t for td in part_data[0][1] for t in (td.begin_usec, td.end_usec)]
+                    chunk = dict(
+                        file = chunk_file,
+                        iteration = json_value(summary.iteration) if summary else "host",
+                        subnet_id = json_value(summary.subnet_id) if summary else -1,
+                        subnet_type = json_value(summary.subnet_type) if summary else "-",
+                        part = part,
+                        begin_usec = min(times) if times else 0,
+                        end_usec = max(times) if times else 0,
+                        time_rows = len(part_data[0][1]),
+                        gmem_rows = len(part_data[1][1]),
+                        lmem_rows = len(part_data[2][1]),
+                    )
+                    index_f.write(json.dumps(chunk) + "\n")
+                    chunks.append(chunk)
+        return chunks
+
     def __write_data(self, f, var_name, data):
             f.write("let {}= [\n".format(var_name))
             for d in data:
@@ -355,6 +417,8 @@ class BMProfileGenerator:
                         gmem_records.append(record)
                     else:
                         lmem_records.append(record)
+        # time of layers is updated once all monitor records are collected
+        record_layers, record_begin_usec, record_end_usec = [], [], []
         if idata.monitor_gdma is not None and len(idata.monitor_gdma)>0:
             gdma_trans_data = []
             max_trans_speed = 0
@@ -380,7 +444,9 @@ class BMProfileGenerator:
                 if m.static:
                     n = m.static
                     if n.layer is not None:
-                        n.layer.update_time(begin_usec, end_usec)
+                        record_layers.append(n.layer)
+                        record_begin_usec.append(begin_usec)
+                        record_end_usec.append(end_usec)
                         layer_id = n.layer.layer_id
                         layer_type = get_layer_type(n.layer)
                     info = "{}<br>".format(n.gdma_func.name) + info
@@ -419,7 +485,9 @@ class BMProfileGenerator:
                 if m.static:
                     n = m.static
                     if n.layer is not None:
-                        n.layer.update_time(begin_usec, end_usec)
+                        record_layers.append(n.layer)
+                        record_begin_usec.append(begin_usec)
+                        record_end_usec.append(end_usec)
                         layer_id = n.layer.layer_id
                         layer_type = get_layer_type(n.layer, "-")
                         info = n.bd_func.name+"<br>"+ info
@@ -436,6 +504,7 @@ class BMProfileGenerator:
                     iteration = summary.iteration,
                     info = info
                     ))
+        update_layers_time(record_layers, record_begin_usec, record_end_usec)
 
         subnet_timeoffset = 0
         first_begin_usec = min([summary.begin_usec]+[layer.begin_usec for layer in layer_info if layer.begin_usec is not None])
@@ -517,9 +586,7 @@ class BMProfileGenerator:
                     ))
         return time_data, gmem_records, lmem_records, layer_info
 
-    def __time_data(self, parsed_data):
-        global_data, iter_data, bmlib_data = parsed_data
-        all_data = iter_data + bmlib_data
+    def __host_time_data(self, all_data):
         time_data = []
         # add iteration info
         for data in all_data:
@@ -556,16 +623,32 @@ class BMProfileGenerator:
                     iteration = s.iteration,
                     info = sinfo.info))
 
+        return time_data
+
+    def __iter_time_data(self, parsed_data):
+        """Yield (summary, time_data, gmem_records, lmem_records, layer_info) part by part.
+
+        The host part of all iterations comes first with summary None, then the
+        device part of each iteration, so the records of a whole profile never
+        need to be held at once.
+        """
+        global_data, iter_data, bmlib_data = parsed_data
+        all_data = iter_data + bmlib_data
+        yield None, self.__host_time_data(all_data), [], [], []
         # add dynamic/static TPU subnet info
+        for idata in all_data:
+            yield (idata.parsed_summary, *self.__device_time_data(idata, global_data))
+
+    def __time_data(self, parsed_data):
+        time_data = []
         gmem_records = []
         lmem_records = []
         layer_info = []
-        for idata in all_data:
-            device_time_data, device_gmem_records, device_lmem_records, device_layer_info =  self.__device_time_data(idata, global_data)
-            time_data += device_time_data
-            gmem_records += device_gmem_records
-            lmem_records += device_lmem_records
-            layer_info += device_layer_info
+        for _, part_time_data, part_gmem_records, part_lmem_records, part_layer_info in self.__iter_time_data(parsed_data):
+            time_data += part_time_data
+            gmem_records += part_gmem_records
+            lmem_records += part_lmem_records
+            layer_info += part_layer_info
         return time_data, gmem_records, lmem_records, layer_info
 
     def __item_str(self, item, sep=",", prefix="[", suffix="]"):
@@ -760,7 +843,7 @@ class BMProfileGenerator:
 
     def generate(self, parsed_data, out_dir, out_format, option):
         if out_format.lower() == "html":
-            result_path = self.__generate_html(parsed_data, out_dir)
+            result_path = self.__generate_html(parsed_data, out_dir, option)
             try:
                 import webbrowser
                 webbrowser.open(result_path)
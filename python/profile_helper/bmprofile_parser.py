@@ -14,6 +14,8 @@ import logging
 import struct as st
 from collections import namedtuple
 import glob
+import mmap
+import numpy as np
 
 from bmprofile_common import *
 from bmprofile_utils import *
@@ -59,33 +61,155 @@ class MemInfo:
         self.info = info
 
 
-def parse_fixed_length_items(raw_data, FixedType):
-    class FixedItemWrapper():
-        def __str__(self):
-            kv_list=[f"{k}:{getattr(self, k)}" for k in self._fields_]
-            kv_list.sort()
-            return ",".join(kv_list)
-        def add_kv(self, k, v):
-            self._fields_.append(k)
-            setattr(self, k, v)
-    tlen = ct.sizeof(FixedType)
-    items = []
-    while True:
-        num_items = len(items)
-        if len(raw_data) - num_items*tlen == 0:
+def match_ids(node_ids, cmd_ids, node_begin=0, cmd_begin=0, cmd_end=None):
+    """Match commands to nodes by id, both in order.
+
+    Same as walking node_ids from node_begin and taking every node whose id
+    equals the id of the current command, starting at cmd_begin and stopping
+    at cmd_end. Runs of equal ids are compared as arrays, after a mismatch the
+    next node with the wanted id is found in the sorted ids.
+    Returns the node and command indices of the matched pairs.
+    """
+    node_ids = np.asarray(node_ids, dtype=np.int64)
+    cmd_ids = np.asarray(cmd_ids, dtype=np.int64)
+    if cmd_end is None:
+        cmd_end = len(cmd_ids)
+    order = np.argsort(node_ids, kind="stable")
+    sorted_ids = node_ids[order]
+    node_idx, cmd_idx = [], []
+    i, j = node_begin, cmd_begin
+    while i < len(node_ids) and j < cmd_end:
+        max_run = min(len(node_ids) - i, cmd_end - j)
+        run = 0
+        step = 64
+        while run < max_run:
+            size = min(step, max_run - run)
+            diff = np.flatnonzero(node_ids[i+run:i+run+size] != cmd_ids[j+run:j+run+size])
+            if len(diff) > 0:
+                run += diff[0]
+                break
+            run += size
+            step *= 2
+        node_idx.append(np.arange(i, i + run))
+        cmd_idx.append(np.arange(j, j + run))
+        i += run
+        j += run
+        if i >= len(node_ids) or j >= cmd_end:
             break
-        if len(raw_data)<(num_items+1)*tlen:
-            logging.warn("raw_data may be incomplete when parsing fixed length items: " + FixedType.__name__)
+        lo, hi = np.searchsorted(sorted_ids, [cmd_ids[j], cmd_ids[j]+1])
+        pos = np.searchsorted(order[lo:hi], i, side="right")
+        if lo + pos >= hi:
             break
-        item_data = raw_data[num_items*tlen: (num_items+1)*tlen]
-        raw_item = ct.cast(item_data, ct.POINTER(FixedType)).contents
-        item = FixedItemWrapper()
-        for key in raw_item._fields_:
-            setattr(item, key[0], getattr(raw_item, key[0]))
-        item._fields_ = list(x[0] for x in raw_item._fields_)
-        items.append(item)
+        i = order[lo + pos]
+    if len(node_idx) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(node_idx), np.concatenate(cmd_idx)
+
+class FixedItemWrapper():
+    def __str__(self):
+        kv_list=[f"{k}:{getattr(self, k)}" for k in self._fields_]
+        kv_list.sort()
+        return ",".join(kv_list)
+    def add_kv(self, k, v):
+        self._fields_.append(k)
+        setattr(self, k, v)
+
+_struct_layouts = dict()
+def struct_layout(FixedType):
+    """Map the layout of a packed ctypes struct to numpy.
+
+    Returns (raw_dtype, fields). raw_dtype has the same itemsize and offsets as
+    FixedType, bit fields are read through their storage unit named
+    "_unit_<offset>". fields lists (name, unit_name, bit_offset, bit_size), the
+    bit part is None for plain fields.
+    """
+    if FixedType in _struct_layouts:
+        return _struct_layouts[FixedType]
+    names, formats, offsets = [], [], []
+    fields = []
+    for field in FixedType._fields_:
+        name, ctype = field[0], field[1]
+        desc = getattr(FixedType, name)
+        if len(field) == 2:
+            names.append(name)
+            formats.append(np.dtype(ctype))
+            offsets.append(desc.offset)
+            fields.append((name, name, None, None))
+            continue
+        if hasattr(desc, "bit_size"):
+            bit_offset, bit_size = desc.bit_offset, desc.bit_size
+        else:
+            # before python 3.14, size of a bit field is (bit_size << 16) | bit_offset
+            bit_offset, bit_size = desc.size & 0xffff, desc.size >> 16
+        unit_name = "_unit_{}".format(desc.offset)
+        if unit_name not in names:
+            names.append(unit_name)
+            formats.append(np.dtype(ctype))
+            offsets.append(desc.offset)
+        fields.append((name, unit_name, bit_offset, bit_size))
+    raw_dtype = np.dtype(dict(names=names, formats=formats, offsets=offsets,
+                              itemsize=ct.sizeof(FixedType)))
+    _struct_layouts[FixedType] = (raw_dtype, fields)
+    return raw_dtype, fields
+
+def parse_fixed_length_array(raw_data, FixedType):
+    """Parse raw_data as an array of FixedType into a numpy structured array.
+
+    raw_data can be bytes or a memoryview of a mmap, the result is a copy so
+    it does not keep the mapping alive. Bit fields are unpacked into plain
+    columns of their storage type.
+    """
+    raw_dtype, fields = struct_layout(FixedType)
+    tlen = raw_dtype.itemsize
+    num_items = len(raw_data) // tlen
+    if len(raw_data) != num_items * tlen:
+        logging.warn("raw_data may be incomplete when parsing fixed length items: " + FixedType.__name__)
+    raw = np.frombuffer(raw_data, dtype=raw_dtype, count=num_items)
+    if all(bit_size is None for _, _, _, bit_size in fields):
+        return raw.copy()
+    items = np.empty(num_items, dtype=[(name, raw_dtype.fields[unit][0]) for name, unit, _, _ in fields])
+    for name, unit, bit_offset, bit_size in fields:
+        if bit_size is None:
+            items[name] = raw[name]
+        else:
+            unit_type = raw_dtype.fields[unit][0].type
+            mask = unit_type((1 << bit_size) - 1)
+            items[name] = (raw[unit] >> unit_type(bit_offset)) & mask
     return items
 
+def array_to_items(items, **defaults):
+    """Build a FixedItemWrapper for each record of a structured array.
+
+    defaults are set as extra attributes on every item, they are not listed
+    in _fields_.
+    """
+    names = list(items.dtype.names)
+    result = []
+    for values in items.tolist():
+        item = FixedItemWrapper()
+        item.__dict__.update(defaults)
+        item.__dict__.update(zip(names, values))
+        item._fields_ = list(names)
+        result.append(item)
+    return result
+
+def with_columns(items, **columns):
+    """Copy of the structured array items with columns replaced or appended."""
+    names = list(items.dtype.names)
+    descr = [(name, np.asarray(columns[name]).dtype if name in columns else items.dtype.fields[name][0])
+             for name in names]
+    descr += [(name, np.asarray(value).dtype) for name, value in columns.items() if name not in names]
+    result = np.empty(len(items), dtype=descr)
+    for name in names:
+        if name not in columns:
+            result[name] = items[name]
+    for name, value in columns.items():
+        result[name] = value
+    return result
+
+def parse_fixed_length_items(raw_data, FixedType):
+    return array_to_items(parse_fixed_length_array(raw_data, FixedType))
+
 def parse_dyn_data(raw_data):
     return parse_fixed_length_items(raw_data, DynRecord)
 
@@ -98,21 +222,43 @@ def parse_monitor_bd(raw_data, archlib):
 def parse_monitor_gdma(raw_data, archlib):
     return parse_fixed_length_items(raw_data, archlib.GDMAProfileFormat)
 
+def parse_dyn_data_array(raw_data):
+    return parse_fixed_length_array(raw_data, DynRecord)
+
+def parse_monitor_bd_array(raw_data, archlib):
+    return parse_fixed_length_array(raw_data, archlib.BDProfileFormat)
+
+def parse_monitor_gdma_array(raw_data, archlib):
+    return parse_fixed_length_array(raw_data, archlib.GDMAProfileFormat)
+
 def parse_data_blocks(filename):
+    """Split a profile file into blocks.
+
+    The file is memory mapped, the contents of the large record blocks
+    (MONITOR_BD, MONITOR_GDMA, DYN_DATA) are memoryviews of the mapping so they
+    can be parsed with parse_fixed_length_array() without being copied; the
+    other blocks are bytes.
+    """
     BlockItem=namedtuple("BlockItem", "type content")
     if not os.path.isfile(filename):
         return None
     blocks = []
+    if os.path.getsize(filename) == 0:
+        return blocks
+    record_blocks = (BlockType.MONITOR_BD, BlockType.MONITOR_GDMA, BlockType.DYN_DATA)
     with open(filename, "rb") as f:
-        while True:
-            header_data = f.read(8)
-            if len(header_data) != 8:
-                break
-            block_type, block_len = st.unpack("II", header_data)
-            block_type = BlockType(block_type)
-            block_content = f.read(block_len)
-            assert len(block_content) == block_len
-            blocks.append(BlockItem(block_type, block_content))
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    offset = 0
+    while offset + 8 <= len(data):
+        block_type, block_len = st.unpack_from("II", data, offset)
+        block_type = BlockType(block_type)
+        offset += 8
+        block_content = data[offset:offset + block_len]
+        assert len(block_content) == block_len
+        offset += block_len
+        if block_type not in record_blocks:
+            block_content = block_content.tobytes()
+        blocks.append(BlockItem(block_type, block_content))
     return blocks
 
 def parse_dyn_extra(raw_data):
@@ -247,16 +393,36 @@ class BMLibSummary:
         for t,i,v in extra:
             data_dict[t][i].info = v
 
+def record_items(array_name, **defaults):
+    """IterRecord property with the FixedItemWrapper objects of an array,
+    they are built on first use."""
+    def get_items(self):
+        if array_name not in self._items:
+            array = getattr(self, array_name)
+            self._items[array_name] = [] if array is None else array_to_items(array, **defaults)
+        return self._items[array_name]
+    def set_items(self, items):
+        self._items[array_name] = items
+    return property(get_items, set_items)
+
 class IterRecord():
+    # dyn and monitor records are kept as numpy structured arrays, the arrays
+    # must not change once their objects are used
+    dyn_data = record_items("dyn_array")
+    monitor_gdma = record_items("monitor_gdma_array", static=None, dynamic=None, command=None)
+    monitor_bd = record_items("monitor_bd_array", static=None, dynamic=None, command=None)
     def __init__(self):
-        self.dyn_data = []
         self.dyn_extra = dict()
-        self.monitor_gdma = []
-        self.monitor_bd = []
+        self.dyn_array = None
+        self.monitor_gdma_array = None
+        self.monitor_bd_array = None
+        self._items = dict()
         self.summary = None
         self.command_info = None
         self.subnet_info = None
         self.bmlib_extra = None
+    def has_monitor_data(self):
+        return any(a is not None and len(a) > 0 for a in (self.monitor_bd_array, self.monitor_gdma_array))
     def merge(self, other):
         self.summary.merge(other.summary)
         for key, value in other.dyn_extra.items():
@@ -264,11 +430,13 @@ class IterRecord():
                 self.dyn_data[key]+= value
             else:
                 self.dyn_data[key] = value
-        self.monitor_bd += other.monitor_bd
-        self.monitor_gdma += other.monitor_gdma
-        self.dyn_data = sorted(self.dyn_data, key=lambda i: i.begin_cycle)
-        self.monitor_bd= sorted(self.monitor_bd, key=lambda i: i.inst_start_time)
-        self.monitor_gdma= sorted(self.monitor_gdma, key=lambda i: i.inst_start_time)
+        for name, key in [("dyn_array", "begin_cycle"), ("monitor_bd_array", "inst_start_time"),
+                          ("monitor_gdma_array", "inst_start_time")]:
+            arrays = [a for a in (getattr(self, name), getattr(other, name)) if a is not None]
+            if len(arrays) > 0:
+                merged = np.concatenate(arrays)
+                setattr(self, name, merged[np.argsort(merged[key], kind="stable")])
+        self._items.clear()
 
 class NetStatParser:
     layer_prefix = "LAYER_"
@@ -639,58 +807,60 @@ class BMProfileParser:
         return [gdma_command, bd_command]
 
     def match_node(self, commands, dyn_node, static_node, node_id_func):
-        if not commands:
-            return
+        """Match the monitor records in the structured array commands to nodes.
 
-        def next_id(raw_id, inc=1):
-            return next_id_by_width(raw_id, inc, self.archlib.ID_WIDTH)
+        Returns the fixed inst_id column and a list of (nodes, kind,
+        node_idx, cmd_idx) to be applied by link_node().
+        """
+        if commands is None or len(commands) == 0:
+            return None, []
 
         # fix command
+        inst_ids = commands["inst_id"].astype(np.int64)
         if self.archlib.ID_WIDTH>16:
-            delta_id = 0
-            last_id = 0
-            for c in commands:
-                if last_id > 65000 and c.inst_id < 1000:
-                    delta_id += 65536
-                last_id = c.inst_id
-                c.inst_id += delta_id
-        for c in commands:
-            c.static = None
-            c.dynamic = None
-            c.command = None
+            wrapped = np.zeros(len(inst_ids), dtype=np.int64)
+            wrapped[1:] = (inst_ids[:-1] > 65000) & (inst_ids[1:] < 1000)
+            inst_ids += np.cumsum(wrapped) * 65536
+        cmd_keys = (inst_ids + 1) % (1 << self.archlib.ID_WIDTH)
+        dyn_keys = [node_id_func(d) for d in dyn_node]
 
+        matches = []
         dyn_idx = 0
         cmd_idx = 0
         if static_node:
-            for i, d in enumerate(dyn_node):
-                c = commands[cmd_idx]
-                if c.inst_id == 0 and cmd_idx > 0:
-                    dyn_idx = i
-                    break
-                if node_id_func(d) == next_id(c.inst_id):
-                    c.dynamic = d
-                    c.command = d.command
-                    d.pmu_info = c
-                    cmd_idx += 1
-            for s in static_node:
-                if cmd_idx >= len(commands):
-                    break
-                c = commands[cmd_idx]
-                if node_id_func(s) == next_id(c.inst_id):
-                    c.static = s
-                    c.command = s.command
-                    s.pmu_info = c
-                    cmd_idx += 1
-        for i in range(dyn_idx, len(dyn_node)):
-            if cmd_idx >= len(commands):
-                break
-            d = dyn_node[i]
-            c = commands[cmd_idx]
-            if node_id_func(d) == next_id(c.inst_id):
-                c.dynamic = d
+            # dynamic nodes before the next command with inst_id 0
+            zero_ids = np.flatnonzero(inst_ids[1:] == 0)
+            cmd_end = zero_ids[0] + 1 if len(zero_ids) else len(commands)
+            node_idx, match_idx = match_ids(dyn_keys, cmd_keys, 0, 0, cmd_end)
+            matches.append((dyn_node, "dynamic", node_idx, match_idx))
+            cmd_idx += len(match_idx)
+            if cmd_idx == cmd_end < len(commands) and node_idx[-1] + 1 < len(dyn_node):
+                dyn_idx = node_idx[-1] + 1
+            node_idx, match_idx = match_ids([node_id_func(s) for s in static_node], cmd_keys, 0, cmd_idx)
+            matches.append((static_node, "static", node_idx, match_idx))
+            cmd_idx += len(match_idx)
+        node_idx, match_idx = match_ids(dyn_keys, cmd_keys, dyn_idx, cmd_idx)
+        matches.append((dyn_node, "dynamic", node_idx, match_idx))
+        return inst_ids, matches
+
+    @staticmethod
+    def matched_index(matches):
+        """Map id() of each matched node to the index of its monitor record."""
+        index = dict()
+        for nodes, _, node_idx, match_idx in matches:
+            for i, j in zip(node_idx.tolist(), match_idx.tolist()):
+                index[id(nodes[i])] = j
+        return index
+
+    @staticmethod
+    def link_node(commands, matches):
+        for nodes, kind, node_idx, match_idx in matches:
+            for i, j in zip(node_idx.tolist(), match_idx.tolist()):
+                c = commands[j]
+                d = nodes[i]
+                setattr(c, kind, d)
                 c.command = d.command
                 d.pmu_info = c
-                cmd_idx += 1
 
     def update_relation(self, item:IterRecord, global_data):
         # relation between static set node and static command
@@ -815,69 +985,74 @@ class BMProfileParser:
         # relation set id node
         static_gdma = item.subnet_info.gdma_nodes if item.subnet_info else []
         static_bd = item.subnet_info.bd_nodes if item.subnet_info else []
-        self.match_node(item.monitor_gdma, dyn_gdma, static_gdma, lambda d: d.gdma_id)
-        self.match_node(item.monitor_bd, dyn_bd, static_bd, lambda d: d.bd_id)
+        gdma_ids, gdma_matches = self.match_node(item.monitor_gdma_array, dyn_gdma, static_gdma, lambda d: d.gdma_id)
+        bd_ids, bd_matches = self.match_node(item.monitor_bd_array, dyn_bd, static_bd, lambda d: d.bd_id)
 
         # calibrate time
-        def reset_monitor_time(monitor_data, start_cycle=0):
-            monitor_start = 0
-            if len(monitor_data)>0:
-                monitor_start = monitor_data[0].inst_start_time
-            last_start_time = 0
-            last_end_time = 0
-            fixed_offset = start_cycle
-            for n in monitor_data:
-                if n.inst_start_time < last_start_time or n.inst_end_time < last_end_time:
-                    fixed_offset += 1<<32
-                last_start_time = n.inst_start_time
-                last_end_time = n.inst_end_time
-                n.add_kv("raw_inst_start_time", n.inst_start_time)
-                n.add_kv("raw_inst_end_time", n.inst_end_time)
-                n.inst_start_time = int(n.inst_start_time - monitor_start + fixed_offset)
-                n.inst_end_time = int(n.inst_end_time - monitor_start + fixed_offset)
-
-        reset_monitor_time(item.monitor_gdma, monitor_start_time/global_data.gdma_period)
-        reset_monitor_time(item.monitor_bd, monitor_start_time/global_data.tiu_period)
-
-        if len(item.monitor_bd) == 0 or len(item.monitor_gdma) == 0:
-            return
+        def reset_monitor_time(monitor_data, inst_ids, start_cycle=0):
+            if monitor_data is None or len(monitor_data) == 0:
+                return monitor_data
+            start_time = monitor_data["inst_start_time"].astype(np.int64)
+            end_time = monitor_data["inst_end_time"].astype(np.int64)
+            # the 32 bit counters wrap whenever start or end time goes backwards
+            fixed_offset = np.zeros(len(monitor_data), dtype=np.float64)
+            fixed_offset[0] = start_cycle
+            fixed_offset[1:] = ((start_time[1:] < start_time[:-1]) |
+                                (end_time[1:] < end_time[:-1])) * float(1<<32)
+            fixed_offset = np.cumsum(fixed_offset)
+            return with_columns(monitor_data,
+                                inst_id=inst_ids,
+                                inst_start_time=(start_time - start_time[0] + fixed_offset).astype(np.int64),
+                                inst_end_time=(end_time - start_time[0] + fixed_offset).astype(np.int64),
+                                raw_inst_start_time=start_time,
+                                raw_inst_end_time=end_time)
+
+        monitor_gdma = reset_monitor_time(item.monitor_gdma_array, gdma_ids, monitor_start_time/global_data.gdma_period)
+        monitor_bd = reset_monitor_time(item.monitor_bd_array, bd_ids, monitor_start_time/global_data.tiu_period)
 
         # assert gdma is always first
-        if len(static_gdma) > 0 and len(static_bd) > 0: # use static info
-            for gdma_node in static_gdma:
-                if gdma_node.pmu_info is None:
-                    continue
-                gdma_start = int(gdma_node.pmu_info.inst_end_time * global_data.gdma_period/global_data.tiu_period)
-                bd_id = gdma_node.bd_id
-                offset = 0
-                for n in static_bd:
-                    if n.bd_id == bd_id+1 and n.pmu_info and n.gdma_id == gdma_node.gdma_id:
-                        offset = gdma_start - n.pmu_info.inst_start_time
-                        break
-                if offset != 0:
-                    for n in item.monitor_bd:
-                        n.inst_start_time += offset
-                        n.inst_end_time += offset
-                    break
-        elif len(dyn_gdma)>0 and len(dyn_bd)>0:
-            for gdma_node in dyn_gdma:
-                if gdma_node.pmu_info is None:
+        def tiu_start_offset():
+            gdma_index = self.matched_index(gdma_matches)
+            bd_index = self.matched_index(bd_matches)
+            def first_matched_bd(bd_nodes):
+                first_bd = dict()
+                for n in bd_nodes:
+                    if id(n) in bd_index:
+                        first_bd.setdefault((n.bd_id, n.gdma_id), n)
+                return first_bd
+
+            if len(static_gdma) > 0 and len(static_bd) > 0: # use static info
+                gdma_nodes, first_bd = static_gdma, first_matched_bd(static_bd)
+            elif len(dyn_gdma)>0 and len(dyn_bd)>0:
+                gdma_nodes, first_bd = dyn_gdma, first_matched_bd(dyn_bd)
+            else:
+                print("WARNING: Cannot determine tiu start time, use 0 instead")
+                return 0
+            for gdma_node in gdma_nodes:
+                if id(gdma_node) not in gdma_index:
                     continue
-                gdma_start = int(gdma_node.pmu_info.inst_end_time * global_data.gdma_period/global_data.tiu_period)
-                bd_id = gdma_node.bd_id
+                gdma_end = monitor_gdma["inst_end_time"][gdma_index[id(gdma_node)]]
+                gdma_start = int(gdma_end * global_data.gdma_period/global_data.tiu_period)
                 offset = 0
-                for n in dyn_bd:
-                    if n.bd_id == bd_id+1 and n.pmu_info and n.gdma_id == gdma_node.gdma_id:
-                        offset = max(gdma_start - n.pmu_info.inst_start_time, int(n.end_usec/global_data.tiu_period))
-                        break
+                n = first_bd.get((gdma_node.bd_id+1, gdma_node.gdma_id))
+                if n is not None:
+                    offset = gdma_start - int(monitor_bd["inst_start_time"][bd_index[id(n)]])
+                    if gdma_nodes is dyn_gdma:
+                        offset = max(offset, int(n.end_usec/global_data.tiu_period))
                 if offset != 0:
-                    for n in item.monitor_bd:
-                        n.inst_start_time += offset
-                        n.inst_end_time += offset
-                    break
-        else:
-            print("WARNING: Cannot determine tiu start time, use 0 instead")
-            return
+                    return offset
+            return 0
+
+        if monitor_bd is not None and monitor_gdma is not None and len(monitor_bd) > 0 and len(monitor_gdma) > 0:
+            offset = tiu_start_offset()
+            monitor_bd["inst_start_time"] += offset
+            monitor_bd["inst_end_time"] += offset
+
+        # records objects are built here with their final values
+        item.monitor_gdma_array = monitor_gdma
+        item.monitor_bd_array = monitor_bd
+        self.link_node(item.monitor_gdma, gdma_matches)
+        self.link_node(item.monitor_bd, bd_matches)
 
     def parse(self, in_dir, sim_only=False):
         self.in_dir = in_dir
@@ -899,13 +1074,13 @@ class BMProfileParser:
             item = IterRecord()
             for block in blocks:
                 if block.type == BlockType.DYN_DATA:
-                    item.dyn_data = parse_dyn_data(block.content)
+                    item.dyn_array = parse_dyn_data_array(block.content)
                 elif block.type == BlockType.DYN_EXTRA:
                     item.dyn_extra = parse_dyn_extra(block.content)
                 elif block.type == BlockType.MONITOR_BD and not sim_only:
-                    item.monitor_bd = parse_monitor_bd(block.content, self.archlib)
+                    item.monitor_bd_array = parse_monitor_bd_array(block.content, self.archlib)
                 elif block.type == BlockType.MONITOR_GDMA and not sim_only:
-                    item.monitor_gdma = parse_monitor_gdma(block.content, self.archlib)
+                    item.monitor_gdma_array = parse_monitor_gdma_array(block.content, self.archlib)
                 elif block.type == BlockType.SUMMARY:
                     item.summary = parse_summary(block.content)
                     for s in global_info.subnet_list:
@@ -914,7 +1089,7 @@ class BMProfileParser:
                             break
                 elif block.type == BlockType.COMMAND:
                     item.command_info = self.__parse_command_info(block.content)
-            if len(item.monitor_bd)>0 or len(item.monitor_gdma)>0:
+            if item.has_monitor_data():
                 no_perf_data = False
 
             assert item.summary is not None
@@ -937,13 +1112,13 @@ class BMProfileParser:
             bmlib_extra = None
             for block in blocks:
                 if block.type == BlockType.DYN_DATA:
-                    item.dyn_data = parse_dyn_data(block.content)
+                    item.dyn_array = parse_dyn_data_array(block.content)
                 elif block.type == BlockType.DYN_EXTRA:
                     item.dyn_extra = parse_dyn_extra(block.content)
                 elif block.type == BlockType.MONITOR_BD:
-                    item.monitor_bd = parse_monitor_bd(block.content, self.archlib)
+                    item.monitor_bd_array = parse_monitor_bd_array(block.content, self.archlib)
                 elif block.type == BlockType.MONITOR_GDMA:
-                    item.monitor_gdma = parse_monitor_gdma(block.content, self.archlib)
+                    item.monitor_gdma_array = parse_monitor_gdma_array(block.content, self.archlib)
                 elif block.type == BlockType.BMLIB:
                     item.summary = BMLibSummary(block.content, infile, self.archlib)
                 elif block.type == BlockType.BMLIB_EXTRA:
@@ -951,7 +1126,7 @@ class BMProfileParser:
             assert item.summary is not None
             item.summary.iteration = os.path.basename(infile).split(".")[0]
             item.summary.add_extra(bmlib_extra)
-            if len(item.monitor_bd)>0 or len(item.monitor_gdma)>0:
+            if item.has_monitor_data():
                 no_perf_data = False
             self.update_relation(item, global_info)
             bmlib_data.append(item)
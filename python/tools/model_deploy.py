@@ -15,7 +15,7 @@ from utils.mlir_shell import *
 from utils.mlir_parser import *
 from utils.preprocess import preprocess, supported_customization_format
 from utils.auto_remove import file_mark, file_clean
-from tools.model_runner import mlir_inference, model_inference, show_fake_cmd
+from tools.model_runner import mlir_inference, model_inference, free_mlir_module, show_fake_cmd
 import pymlir
 from utils.misc import str2bool
 
@@ -184,7 +184,8 @@ class DeployTool:
                     else:
                         self.inputs[ppa.input_name] = ppa.run(infile)
                     if gen_ref:
-                        gen_input_f32[ppa.input_name] = ppa.run(infile)
+                        gen_input_f32[ppa.input_name] = ppa.run(
+                            infile) if self.fuse_preprocess else self.inputs[ppa.input_name]
 
                 elif infile.endswith(".npy"):
                     data = np.load(infile)
@@ -205,6 +206,8 @@ class DeployTool:
             show_fake_cmd(gen_in_f32_npz, self.mlir_file, self.ref_npz)
             top_outputs = mlir_inference(gen_input_f32, self.mlir_file)
             np.savez(self.ref_npz, **top_outputs)
+            del top_outputs
+            free_mlir_module()
         self.tpu_npz = "{}_tpu_outputs.npz".format(self.prefix)
         file_mark(self.tpu_npz)
 
@@ -212,6 +215,8 @@ class DeployTool:
         show_fake_cmd(self.in_f32_npz, self.tpu_mlir, self.tpu_npz)
         tpu_outputs = mlir_inference(self.inputs, self.tpu_mlir, self.compare_all)
         np.savez(self.tpu_npz, **tpu_outputs)
+        del tpu_outputs
+        free_mlir_module()
         # compare fp32 blobs and quantized tensors with tolerance similarity
         f32_blobs_compare(self.tpu_npz, self.ref_npz, self.tolerance, self.excepts)
 
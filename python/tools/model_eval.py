@@ -30,6 +30,8 @@ parser.add_argument("--dataset_type", type=str, default = 'imagenet', choices=['
 parser.add_argument("--postprocess_type", type=str, required=True,
                     help="the postprocess type.")
 parser.add_argument("--count", type=int, default=0)
+parser.add_argument("--num_workers", type=int, default=1,
+                    help="number of processes to shard the dataset across, each loads its own model")
 parser.add_argument('--debug_cmd', type=str, default='', help='debug cmd')
 args,_ = parser.parse_known_args()
 
@@ -40,27 +42,19 @@ class MyImageFolder(datasets.ImageFolder):
 if __name__ == '__main__':
   if not os.path.exists(args.dataset):
       raise ValueError ("Dataset path doesn't exist.")
-  engine = model_inference(parser)
   if args.dataset_type == 'imagenet':
-    val_loader = torch.utils.data.DataLoader(
-        MyImageFolder(args.dataset),
-        batch_size=1, shuffle=False, num_workers=1, pin_memory=True, sampler=None)
-    count = args.count if args.count > 0 else len(val_loader)
-    for i, item in enumerate(val_loader):
-        path, target = item
-        engine.run(i, path[0], int(target[0]))
-        if (i + 1) >= count:
-          break
+    # only paths and labels are needed, images are read by the preprocess
+    items = MyImageFolder(args.dataset).imgs
   elif args.dataset_type == 'coco':
-    image_list = get_image_list(args.dataset, args.count)
-    with tqdm(total = len(image_list)) as pbar:
-        for i, image_path in enumerate(image_list):
-            engine.run(i, image_path)
-            pbar.update(1)
+    items = [(image_path, None) for image_path in get_image_list(args.dataset, args.count)]
   elif args.dataset_type == 'user_define':
     selector = DataSelector(args.dataset, args.count, args.data_list)
-    for i, img in enumerate(selector.data_list):
-        engine.run(i, img)
-        if (i + 1) >= args.count:
-          break
-  engine.get_result()
+    items = [(img, None) for img in selector.data_list]
+  if args.count > 0:
+    items = items[:args.count]
+  if args.num_workers > 1 and not args.model_file.endswith('.onnx'):
+    model_eval_parallel(parser, items, args.num_workers)
+  else:
+    engine = model_inference(parser)
+    engine.run_list(items)
+    engine.get_result()
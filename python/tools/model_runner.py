@@ -14,6 +14,7 @@ import argparse
 import os
 import struct
 import shutil
+from collections import OrderedDict
 from utils.misc import str2bool
 from utils.lowering import lowering, round_away_from_zero, bf16_to_fp32
 
@@ -150,91 +151,220 @@ def model_inference(inputs: dict, model_file: str, dump_all = True) -> dict:
     return outputs
 
 
-g_mlir_module = None
+# sessions kept loaded, callers running several mlir files in turn may raise it
+MLIR_SESSION_CACHE_SIZE = 1
+g_mlir_sessions = OrderedDict()
 
 
-def mlir_inference(inputs: dict, mlir_file: str, dump_all: bool = True, debug=None) -> dict:
-    import pymlir
-    pymlir.set_mem_mode("value_mem")
-    from utils.mlir_parser import MlirParser
-    global g_mlir_module
-    if g_mlir_module != None:
-        g_mlir_module = None
-    g_mlir_module = pymlir.module()
-    g_mlir_module.load(mlir_file)
-    parser = MlirParser(mlir_file)
-    only_one = len(inputs) == 1
-    if only_one:
+class MlirSession:
+    """Loaded pymlir module and parsed graph of one mlir file.
 
-        assert (len(g_mlir_module.input_names) == 1)
-    for name in g_mlir_module.input_names:
-        if not only_one:
-            assert (name in inputs)
+    Loading the module and parsing the mlir dominate a small inference, so a
+    session is kept alive by get_mlir_session() and reused by mlir_inference()
+    while the mlir file and its weight file are unchanged.
+    """
 
-            input = inputs[name]
-        else:
-            input = list(inputs.values())[0]
-        if input.dtype == np.int8 or input.dtype == np.uint8:
-            g_mlir_module.set_tensor_from_int(name, input.astype(np.float32))
-        else:
-            g_mlir_module.set_tensor(name, input.astype(np.float32))
-    tensors = dict()
-    layer_names = g_mlir_module.all_tensor_names if dump_all else g_mlir_module.output_names
-    # def func2(layer_name):
-    #     if layer_name in layer_names:
-    #         tensors[layer_name] = g_mlir_module.get_tensor(layer_name).copy()
-    # g_mlir_module.after_invoke(func2)
-    g_mlir_module.invoke()
-    tensors = g_mlir_module.get_all_tensor()
-    if dump_all:
-        return tensors
-    outputs = dict()
-    for name in g_mlir_module.output_names:
-        outputs[name] = tensors[name]
+    def __init__(self, mlir_file: str):
+        import pymlir
+        pymlir.set_mem_mode("value_mem")
+        from utils.mlir_parser import MlirParser
+        self.mlir_file = mlir_file
+        self.module = pymlir.module()
+        self.module.load(mlir_file)
+        self.parser = MlirParser(mlir_file)
+        self.input_names = list(self.module.input_names)
+        self.output_names = list(self.module.output_names)
+        self.all_tensor_names = set(self.module.all_tensor_names)
         # assume output of op has the same name
-        op_type = parser.get_op_type_by_op_name(name)
-        if op_type == "tpu.Cast":
-            pre_op = parser.get_pre_op_by_op_name(name)[0]
-            if pre_op in tensors:
-                outputs[pre_op] = tensors[pre_op]
-    return outputs
+        self.cast_inputs = dict()
+        for name in self.output_names:
+            if self.parser.get_op_type_by_op_name(name) == "tpu.Cast":
+                self.cast_inputs[name] = self.parser.get_pre_op_by_op_name(name)[0]
+        self.stamp = self.file_stamp()
+
+    def file_stamp(self):
+        stamp = []
+        for file in [self.mlir_file, self.parser.module_weight_file]:
+            if not os.path.exists(file):
+                stamp.append(None)
+                continue
+            st = os.stat(file)
+            stamp.append((st.st_mtime_ns, st.st_size))
+        return stamp
+
+    def is_stale(self) -> bool:
+        return self.stamp != self.file_stamp()
+
+    def set_inputs(self, inputs: dict):
+        only_one = len(inputs) == 1
+        if only_one:
+            assert (len(self.input_names) == 1)
+        for name in self.input_names:
+            if not only_one:
+                assert (name in inputs)
+                input = inputs[name]
+            else:
+                input = list(inputs.values())[0]
+            if input.dtype == np.int8 or input.dtype == np.uint8:
+                self.module.set_tensor_from_int(name, input.astype(np.float32))
+            else:
+                self.module.set_tensor(name, input.astype(np.float32))
+
+    def run(self, inputs: dict, dump_all: bool = True, tensor_names: list = None) -> dict:
+        """Run one inference.
+
+        Returns all tensors if dump_all, else the outputs (and the input of an
+        output tpu.Cast). If tensor_names is given, only those tensors are
+        returned. The module returns copies of its tensors, so only the
+        returned ones are fetched.
+        """
+        self.set_inputs(inputs)
+        self.module.invoke()
+        if tensor_names is not None:
+            return {
+                name: self.module.get_tensor(name)
+                for name in tensor_names if name in self.all_tensor_names
+            }
+        if dump_all:
+            return self.module.get_all_tensor()
+        outputs = dict()
+        for name in self.output_names:
+            outputs[name] = self.module.get_tensor(name)
+            pre_op = self.cast_inputs.get(name)
+            if pre_op is not None and pre_op in self.all_tensor_names:
+                outputs[pre_op] = self.module.get_tensor(pre_op)
+        return outputs
+
+    def run_batch(self, inputs_list: list, dump_all: bool = False, tensor_names: list = None) -> list:
+        return [self.run(inputs, dump_all, tensor_names) for inputs in inputs_list]
+
+
+def get_mlir_session(mlir_file: str) -> MlirSession:
+    # weight file in mlir is relative to the working directory
+    key = (os.path.realpath(mlir_file), os.getcwd())
+    session = g_mlir_sessions.pop(key, None)
+    if session is None or session.is_stale():
+        # release the old module and evicted sessions before loading the new one
+        session = None
+        while g_mlir_sessions and len(g_mlir_sessions) >= MLIR_SESSION_CACHE_SIZE:
+            g_mlir_sessions.popitem(last=False)
+        session = MlirSession(mlir_file)
+    g_mlir_sessions[key] = session
+    return session
+
+
+def mlir_inference(inputs: dict,
+                   mlir_file: str,
+                   dump_all: bool = True,
+                   debug=None,
+                   tensor_names: list = None) -> dict:
+    session = get_mlir_session(mlir_file)
+    return session.run(inputs, dump_all, tensor_names)
+
+
+def mlir_inference_batch(inputs_list: list,
+                         mlir_file: str,
+                         dump_all: bool = False,
+                         tensor_names: list = None) -> list:
+    session = get_mlir_session(mlir_file)
+    return session.run_batch(inputs_list, dump_all, tensor_names)
 
 
 def free_mlir_module():
-    global g_mlir_module
-    g_mlir_module = None
+    g_mlir_sessions.clear()
 
 
-def onnx_inference(inputs: dict, onnx_file: str, dump_all: bool = True) -> dict:
-    import onnx
-    import onnxruntime
+ONNX_SESSION_CACHE_SIZE = 2
+g_onnx_sessions = OrderedDict()
 
-    def generate_onnx_with_all(onnx_file: str):
-        # for dump all activations
-        # plz refre https://github.com/microsoft/onnxruntime/issues/1455
-        output_keys = []
-        model = onnx.load(onnx_file)
-        no_list = ["Cast", "Constant", "Dropout", "Loop"]
 
-        # tested commited #c3cea486d https://github.com/microsoft/onnxruntime.git
-        for x in model.graph.node:
-            if x.op_type in no_list:
-                continue
-            for name in x.output:
-                if not name:
-                    continue
-                intermediate_layer_value_info = onnx.helper.ValueInfoProto()
-                intermediate_layer_value_info.name = name
-                model.graph.output.append(intermediate_layer_value_info)
-                output_keys.append(intermediate_layer_value_info.name + '_' + x.op_type)
-        dump_all_tensors_onnx = onnx_file.replace('.onnx', '_all.onnx', 1)
-        onnx.save(model, dump_all_tensors_onnx, save_as_external_data=True)
-        return output_keys, dump_all_tensors_onnx
+def generate_onnx_with_capture(onnx_file: str, tensor_names: tuple = None, window: int = 0):
+    """Write <name>_all.onnx with intermediate tensors appended as graph outputs.
 
+    All tensors are captured if tensor_names is None, else only the named ones
+    (onnx tensor name, or name_OpType as in the dumped npz) and the tensors of
+    the `window` nodes before and after each of them. Weights are not loaded,
+    the new model keeps referring to the external data of the original.
+    """
+    import onnx
+    # for dump all activations
+    # plz refre https://github.com/microsoft/onnxruntime/issues/1455
+    model = onnx.load(onnx_file, load_external_data=False)
+    no_list = ["Cast", "Constant", "Dropout", "Loop"]
+    nodes = list(model.graph.node)
+    selected = range(len(nodes))
+    if tensor_names is not None:
+        wanted = set(tensor_names)
+        selected = set()
+        for i, x in enumerate(nodes):
+            if any(name in wanted or name + '_' + x.op_type in wanted for name in x.output):
+                selected.update(range(max(0, i - window), min(len(nodes), i + window + 1)))
+        selected = sorted(selected)
+
+    # tested commited #c3cea486d https://github.com/microsoft/onnxruntime.git
     output_keys = []
-    if dump_all:
-        output_keys, onnx_file = generate_onnx_with_all(onnx_file)
-    session = onnxruntime.InferenceSession(onnx_file, providers=['CPUExecutionProvider'])
+    for i in selected:
+        x = nodes[i]
+        if x.op_type in no_list:
+            continue
+        for name in x.output:
+            if not name:
+                continue
+            intermediate_layer_value_info = onnx.helper.ValueInfoProto()
+            intermediate_layer_value_info.name = name
+            model.graph.output.append(intermediate_layer_value_info)
+            output_keys.append(intermediate_layer_value_info.name + '_' + x.op_type)
+    dump_all_tensors_onnx = onnx_file.replace('.onnx', '_all.onnx', 1)
+    onnx.save(model, dump_all_tensors_onnx)
+    return output_keys, dump_all_tensors_onnx
+
+
+def get_onnx_session(onnx_file: str, capture=None, window: int = 0):
+    """Return (session, output_keys), reused while the onnx file is unchanged.
+
+    capture is None for the model outputs only, True for all tensors, or a
+    tuple of tensor names, see generate_onnx_with_capture().
+    """
+    import onnxruntime
+    path = os.path.realpath(onnx_file)
+    st = os.stat(onnx_file)
+    key = (path, st.st_mtime_ns, st.st_size, capture, window)
+    cached = g_onnx_sessions.pop(key, None)
+    if cached is None:
+        for k in [k for k in g_onnx_sessions if k[0] == path and k[1:3] != key[1:3]]:
+            del g_onnx_sessions[k]
+        output_keys = []
+        model_file = onnx_file
+        if capture is not None:
+            names = None if capture is True else capture
+            output_keys, model_file = generate_onnx_with_capture(onnx_file, names, window)
+        try:
+            session = onnxruntime.InferenceSession(model_file, providers=['CPUExecutionProvider'])
+        finally:
+            if model_file != onnx_file:
+                os.remove(model_file)
+        cached = (session, output_keys)
+    g_onnx_sessions[key] = cached
+    while len(g_onnx_sessions) > ONNX_SESSION_CACHE_SIZE:
+        g_onnx_sessions.popitem(last=False)
+    return cached
+
+
+def free_onnx_session():
+    g_onnx_sessions.clear()
+
+
+def onnx_inference(inputs: dict,
+                   onnx_file: str,
+                   dump_all: bool = True,
+                   tensor_names: list = None,
+                   window: int = 0) -> dict:
+    capture = None
+    if tensor_names:
+        capture = tuple(tensor_names)
+    elif dump_all:
+        capture = True
+    session, output_keys = get_onnx_session(onnx_file, capture, window)
     inodes = session.get_inputs()
     only_one = len(inputs) == 1
     if only_one:
@@ -256,7 +386,7 @@ def onnx_inference(inputs: dict, onnx_file: str, dump_all: bool = True) -> dict:
             data[name] = list(inputs.values())[0].astype(dtype)
     outs = session.run(None, data)
     outputs = dict()
-    if not dump_all:
+    if capture is None:
         onodes = session.get_outputs()
         for node, out in zip(onodes, outs):
             outputs[node.name] = out.astype(np.float32)
@@ -264,7 +394,6 @@ def onnx_inference(inputs: dict, onnx_file: str, dump_all: bool = True) -> dict:
     else:
         output_num = len(outs) - len(output_keys)
         outs = outs[output_num:]
-        os.remove(onnx_file)
         return dict(filter(lambda x: isinstance(x[1], np.ndarray), zip(output_keys, outs)))
 
 
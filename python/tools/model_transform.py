@@ -54,7 +54,13 @@ class ModelTransformer(object):
         self.module_parsered = MlirParser(self.mlir_file)
         self.input_num = self.module_parsered.get_input_num()
 
-    def model_validate(self, file_list: str, tolerance, excepts, test_result):
+    def model_validate(self,
+                       file_list: str,
+                       tolerance,
+                       excepts,
+                       test_result,
+                       tensor_names: list = None,
+                       window: int = 0):
         from tools.model_runner import mlir_inference, free_mlir_module, show_fake_cmd
         import gc
         in_f32_npz = self.model_name + '_in_f32.npz'
@@ -89,7 +95,11 @@ class ModelTransformer(object):
         # original model inference to get blobs of all layer
         ref_npz = self.model_name + '_ref_outputs.npz'
         show_fake_cmd(in_f32_npz, self.model_def, ref_npz)
-        ref_outputs = self.origin_inference(inputs)
+        if tensor_names:
+            # only the named tensors and their neighbours are dumped and compared
+            ref_outputs = self.origin_inference(inputs, tensor_names=tensor_names, window=window)
+        else:
+            ref_outputs = self.origin_inference(inputs)
         print(f'trans_ref_output:{len(ref_outputs)}')
         if not self.do_mlir_infer:
             print("Saving {}".format(test_result))
@@ -98,13 +108,17 @@ class ModelTransformer(object):
         print("Saving {}".format(ref_npz))
         # print(f'len_ref_output:{len(ref_outputs)}\n')
         np.savez(ref_npz, **ref_outputs)
+        self.free_origin_inference()
+        names = list(ref_outputs) if tensor_names else None
         del self.converter  #save memory
         del ref_outputs
         gc.collect()
 
         # inference of mlir model
         show_fake_cmd(in_f32_npz, self.mlir_file, test_result)
-        f32_outputs = mlir_inference(inputs, self.mlir_file)
+        f32_outputs = mlir_inference(inputs,
+                                     self.mlir_file,
+                                     tensor_names=names)
         print("Saving {}".format(test_result))
         np.savez(test_result, **f32_outputs)
         del f32_outputs
@@ -118,6 +132,9 @@ class ModelTransformer(object):
     def origin_inference(self, inputs: dict) -> dict:
         pass
 
+    def free_origin_inference(self):
+        pass
+
 
 class OnnxTransformer(ModelTransformer):
 
@@ -128,7 +145,8 @@ class OnnxTransformer(ModelTransformer):
                  output_names: list = [],
                  preprocessor: dict = {},
                  static_shape=True,
-                 onnx_sim=''):
+                 onnx_sim='',
+                 cache_dir=''):
         super().__init__(model_name, model_def)
         from transform.OnnxConverter import OnnxConverter
         self.converter = OnnxConverter(self.model_name,
@@ -137,11 +155,19 @@ class OnnxTransformer(ModelTransformer):
                                        output_names,
                                        preprocessor,
                                        static_shape,
-                                       onnx_sim=onnx_sim)
+                                       onnx_sim=onnx_sim,
+                                       cache_dir=cache_dir)
 
-    def origin_inference(self, inputs: dict):
+    def origin_inference(self, inputs: dict, tensor_names: list = None, window: int = 0):
         from tools.model_runner import onnx_inference
-        return onnx_inference(inputs, self.converter.onnx_file)
+        return onnx_inference(inputs,
+                              self.converter.onnx_file,
+                              tensor_names=tensor_names,
+                              window=window)
+
+    def free_origin_inference(self):
+        from tools.model_runner import free_onnx_session
+        free_onnx_session()
 
 
 class CaffeTransformer(ModelTransformer):
@@ -242,7 +268,8 @@ def get_model_transform(args):
                                args.input_shapes,
                                args.output_names,
                                preprocessor.to_dict(),
-                               onnx_sim=args.onnx_sim)
+                               onnx_sim=args.onnx_sim,
+                               cache_dir=args.cache_dir)
     elif args.model_def.endswith('.prototxt') and args.model_data.endswith('.caffemodel'):
         tool = CaffeTransformer(args.model_name, args.model_def, args.model_data, args.input_shapes,
                                 args.output_names, preprocessor.to_dict())
@@ -281,10 +308,16 @@ if __name__ == '__main__':
     parser.add_argument("--tolerance", default='0.99,0.99',
                         help="minimum similarity tolerance to model transform")
     parser.add_argument("--excepts", default='-', help="excepts")
+    parser.add_argument("--validate_tensors", default=list(), type=str2list,
+                        help="only dump and compare these tensors of the onnx model, like: conv1_Conv,relu1_Relu")
+    parser.add_argument("--validate_window", default=0, type=int,
+                        help="also compare tensors of this many ops before and after each validate_tensors")
     parser.add_argument("--add_postprocess", default="", type=str.lower,
                         choices=['','yolov3','yolov5','yolov8','ssd'], help="add postprocess for model")
     parser.add_argument("--onnx_sim", default="", type=str, choices=['', 'skip_fuse_bn'],
                         help="pass options of onnx-sim, sep by quote without space")
+    parser.add_argument("--cache_dir", default="", type=str,
+                        help="reuse the simplified onnx model and weights of previous conversions with the same model, shapes and options")
     parser.add_argument("--debug", action='store_true', help='to keep all intermediate files for debug')
     parser.add_argument("--mlir", type=str, required=True, help="output mlir model file")
     # yapf: enable
@@ -294,8 +327,11 @@ if __name__ == '__main__':
         args.unknown_params += unknown_args
     tool = get_model_transform(args)
     tool.model_transform(args.mlir, args.add_postprocess)
+    if args.validate_tensors and not isinstance(tool, OnnxTransformer):
+        raise RuntimeError("validate_tensors only support onnx model")
     if args.test_input:
         assert (args.test_result)
-        tool.model_validate(args.test_input, args.tolerance, args.excepts, args.test_result)
+        tool.model_validate(args.test_input, args.tolerance, args.excepts, args.test_result,
+                            args.validate_tensors, args.validate_window)
     if not args.debug:
         tool.cleanup()
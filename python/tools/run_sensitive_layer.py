@@ -48,6 +48,9 @@ if __name__ == '__main__':
                         help='post_process program path')
     parser.add_argument('-o', '--quantize_table', required=True,
                         help='output searched sensitive layers table')
+    parser.add_argument('--num_workers', type=int, default=1,
+                        help='num of processes evaluating the threshold candidates of a layer in parallel, '
+                        'each on a share of the samples')
     parser.add_argument('--debug_cmd', type=str, default='', help='debug cmd')
 
     # yapf: enable
@@ -85,7 +85,7 @@ class TdbInterface(TdbCmdBackend):
         self.status = TdbStatus.RUNNING
         while True:
             try:
-                self.step()
+                self.continue_step()
             except (KeyboardInterrupt, BreakpointStop):
                 self.status = TdbStatus.IDLE
                 break
@@ -126,7 +126,7 @@ class TdbInterface(TdbCmdBackend):
 
         while True:
             try:
-                _ = self.step()
+                _ = self.continue_step()
             except (BreakpointStop, KeyboardInterrupt):
                 self.status = TdbStatus.IDLE
                 break
@@ -5,14 +5,98 @@
 #
 # ==============================================================================
 
+import hashlib
+import zipfile
 import numpy as np
+from collections.abc import MutableMapping
+
+
+class WeightStore(MutableMapping):
+    """Weights by name, read as float32 arrays.
+
+    Weights added with add_lazy keep their source dtype and are loaded and
+    converted on each read, no converted copy is kept; add_lazy loaders usually
+    return a memory map. The content digest of a weight is taken once, when it
+    is set or when a lazy weight is first compared.
+    """
+
+    def __init__(self):
+        self.arrays = dict()
+        self.loaders = dict()
+        self.dtypes = dict()
+        self.digests = dict()
+
+    def add_lazy(self, name, dtype, loader):
+        self.arrays.pop(name, None)
+        self.digests.pop(name, None)
+        self.loaders[name] = loader
+        self.dtypes[name] = np.dtype(dtype)
+
+    def dtype(self, name):
+        """dtype of the weight before conversion to float32"""
+        return self.dtypes[name]
+
+    def read_dtype(self, name):
+        """dtype of the weight as read, lazy weights are read as float32"""
+        if name in self.arrays:
+            return self.arrays[name].dtype
+        if name not in self.loaders:
+            raise KeyError(name)
+        return np.dtype(np.float32)
+
+    def __getitem__(self, name):
+        if name in self.arrays:
+            return self.arrays[name]
+        data = np.asarray(self.loaders[name]())
+        if data.dtype != np.float32:
+            data = data.astype(np.float32)
+        if len(data.shape) == 0:
+            data = data.reshape([1])
+        return data
+
+    def __setitem__(self, name, data):
+        self.loaders.pop(name, None)
+        self.dtypes[name] = data.dtype
+        self.arrays[name] = data
+        self.digests[name] = self.content_digest(data)
+
+    def __delitem__(self, name):
+        if name not in self.dtypes:
+            raise KeyError(name)
+        for d in (self.arrays, self.loaders, self.dtypes, self.digests):
+            d.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self.dtypes
+
+    def __iter__(self):
+        return iter(self.dtypes)
+
+    def __len__(self):
+        return len(self.dtypes)
+
+    @staticmethod
+    def content_digest(data):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(str((data.dtype.str, data.shape)).encode())
+        h.update(np.ascontiguousarray(data).view(np.uint8).ravel())
+        return h.digest()
+
+    def digest(self, name):
+        if name not in self.digests:
+            self.digests[name] = self.content_digest(self[name])
+        return self.digests[name]
+
+    def same(self, name, data):
+        """if data has the dtype, shape and bytes of weight name"""
+        return self.digest(name) == self.content_digest(data)
 
 
 class BaseConverter(object):
 
     def __init__(self):
         self.operands = dict()
-        self.tensors = dict()
+        self.tensors = WeightStore()
         self.shapes = dict()
         self.input_names = list()
         self.output_names = list()
@@ -64,16 +148,23 @@ class BaseConverter(object):
             raise KeyError("tensor data must be numpy array")
         if data.dtype != np.float32:
             data = data.astype(np.float32)
+        if len(data.shape) == 0:
+            data = data.reshape([1])
         if name in self.tensors:
-            if np.all(self.tensors[name] == data):
+            if self.tensors.same(name, data):
                 return
             raise KeyError("tensor {} conflict".format(name))
-        if len(data.shape) == 0:
-            data = data.reshape([1])
         # all weight convert to f32.
         self.tensors[name] = data
         self.addShape(name, data.shape)
 
+    def addLazyWeight(self, name, shape: list, dtype, loader):
+        """add a weight that loader() reads when it is used, converted to f32 then"""
+        if name in self.tensors:
+            return self.addWeight(name, np.asarray(loader()))
+        self.tensors.add_lazy(name, dtype, loader)
+        self.addShape(name, list(shape))
+
     def isWeight(self, name):
         if name in self.tensors:
             return True
@@ -109,7 +200,7 @@ class BaseConverter(object):
         if shape and old_shape != shape:
             assert (np.prod(old_shape) == np.prod(shape))
             old_shape = shape
-        ori_type = str(self.tensors[name].dtype)
+        ori_type = str(self.tensors.read_dtype(name))
         type_dict = {
             'int8': "INT8",
             'uint8': "UINT8",
@@ -125,8 +216,14 @@ class BaseConverter(object):
         return op
 
     def WeightToNpz(self, weight_file):
-        tensor_npz = {}
-        for name in self.tensors:
-            if name in self.operands:
-                tensor_npz[name] = self.tensors[name]
-        np.savez(weight_file, **tensor_npz)
+        # same layout as np.savez, but written one tensor at a time
+        if isinstance(weight_file, str) and not weight_file.endswith('.npz'):
+            weight_file = weight_file + '.npz'
+        with zipfile.ZipFile(weight_file, mode="w", compression=zipfile.ZIP_STORED,
+                             allowZip64=True) as zf:
+            for name in self.tensors:
+                if name not in self.operands:
+                    continue
+                with zf.open(name + '.npy', mode="w", force_zip64=True) as f:
+                    np.lib.format.write_array(f, np.asanyarray(self.tensors[name]),
+                                              allow_pickle=False)
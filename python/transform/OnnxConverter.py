@@ -10,7 +10,7 @@
 
 from .MLIRImporter import MLIRImporter, Platform
 from .BaseConverter import BaseConverter
-from .OnnxOpt import onnx_opt, ConstantFolding
+from .OnnxOpt import onnx_opt, ConstantFolding, WeightFolding
 from onnx import numpy_helper, mapping
 from numbers import Number
 import onnx
@@ -18,6 +18,10 @@ import numpy as np
 from utils.pad_setting import set_auto_pad
 from utils.auto_remove import file_mark, file_clean
 import copy, sys
+import os
+import json
+import shutil
+import hashlib
 import mlir.dialects.top as top
 from mlir.ir import *
 from typing import List
@@ -69,6 +73,46 @@ def convert_onnx_attribute_proto(attr_proto):
         raise ValueError("Unsupported ONNX attribute: {}".format(attr_proto))
 
 
+def graph_tensors(graph):
+    yield from graph.initializer
+    for node in graph.node:
+        for attr in node.attribute:
+            if attr.HasField('t'):
+                yield attr.t
+            yield from attr.tensors
+            if attr.HasField('g'):
+                yield from graph_tensors(attr.g)
+            for g in attr.graphs:
+                yield from graph_tensors(g)
+
+
+def external_data_locations(model):
+    locations = set()
+    for tensor in graph_tensors(model.graph):
+        if tensor.data_location == onnx.TensorProto.EXTERNAL:
+            for entry in tensor.external_data:
+                if entry.key == "location":
+                    locations.add(entry.value)
+    return sorted(locations)
+
+
+def set_external_data_location(model, location):
+    for tensor in graph_tensors(model.graph):
+        if tensor.data_location == onnx.TensorProto.EXTERNAL:
+            for entry in tensor.external_data:
+                if entry.key == "location":
+                    entry.value = location
+
+
+def link_or_copy(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
 class BaseNode():
 
     def __init__(self, info):
@@ -102,7 +146,8 @@ class OnnxConverter(BaseConverter):
                  output_names: list,
                  preprocess_args: dict = {},
                  static_shape=True,
-                 onnx_sim=""):
+                 onnx_sim="",
+                 cache_dir=""):
         super().__init__()
 
         self.model_name = model_name
@@ -115,6 +160,7 @@ class OnnxConverter(BaseConverter):
             np.bool_, np.float16, np.float64, np.uint32, np.uint64, None, None, None
         ]
         self.onnx_sim = onnx_sim
+        self.cache_dir = cache_dir
         self.load_onnx_model(onnx_file, input_shapes, output_names, static_shape)
         self.init_MLIRImporter()
         self.unranked_type = self.mlir.get_tensor_type([])
@@ -413,7 +459,218 @@ class OnnxConverter(BaseConverter):
             onnx_tensor = node.attrs['value']
             return numpy_helper.to_array(onnx_tensor)
 
+    def tool_key(self):
+        """versions of the code and libraries producing cache entries"""
+        import onnxruntime
+        h = hashlib.sha256()
+        this_dir = os.path.dirname(os.path.abspath(__file__))
+        for src in ["OnnxConverter.py", "OnnxOpt.py"]:
+            with open(os.path.join(this_dir, src), "rb") as f:
+                h.update(f.read())
+        h.update(
+            json.dumps([onnx.__version__, onnxruntime.__version__,
+                        getattr(onnxsim, "__version__", "")]).encode())
+        return h.hexdigest()
+
+    def model_digest(self, onnx_file):
+        """Content hash of the model and its external data.
+
+        Memoized in the cache dir by path, mtime and size of the files, so an
+        unchanged model is not read again.
+        """
+        index_file = os.path.join(self.cache_dir, "digests.json")
+        try:
+            with open(index_file) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        path = os.path.realpath(onnx_file)
+
+        def stamp(file):
+            st = os.stat(file)
+            return [file, st.st_mtime_ns, st.st_size]
+
+        entry = index.get(path)
+        if entry is not None:
+            try:
+                if all(stamp(x[0]) == x for x in entry["stamps"]):
+                    return entry["digest"]
+            except OSError:
+                pass
+        model = onnx.load(onnx_file, load_external_data=False)
+        base_dir = os.path.dirname(path)
+        files = [path] + [os.path.join(base_dir, x) for x in external_data_locations(model)]
+        h = hashlib.sha256()
+        for file in files:
+            with open(file, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 24), b""):
+                    h.update(chunk)
+        index[path] = {"stamps": [stamp(x) for x in files], "digest": h.hexdigest()}
+        tmp_file = "{}.tmp{}".format(index_file, os.getpid())
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_file, index_file)
+        except OSError as e:
+            print("WARNING: failed to save model digests {}: {}".format(index_file, e))
+        return index[path]["digest"]
+
+    def cache_path(self, onnx_file, input_shapes: list, output_names: list, static_shape):
+        """Cache entries of a model: (model dir, conversion entry).
+
+        The model dir is keyed by the model content and tool versions and holds
+        the weight folded model shared by all conversions of it; the
+        conversion entry under it is keyed by the selected outputs, assigned
+        input shapes and options.
+        """
+        if not self.cache_dir or not isinstance(onnx_file, str):
+            return None, None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        h = hashlib.sha256()
+        h.update(self.model_digest(onnx_file).encode())
+        h.update(self.tool_key().encode())
+        model_dir = os.path.join(self.cache_dir, h.hexdigest())
+        key = json.dumps([list(input_shapes), list(output_names), static_shape, self.onnx_sim],
+                         default=str)
+        return model_dir, os.path.join(model_dir, hashlib.sha256(key.encode()).hexdigest())
+
+    def load_base_model(self, onnx_file, model_dir):
+        """the model with weight only nodes folded, built once per model dir"""
+        base_file = os.path.join(model_dir, "base", "model.onnx")
+        if not os.path.exists(base_file):
+            model = onnx.load(onnx_file)
+            try:
+                model = WeightFolding(model).run()
+            except:
+                print("WARNING: WeightFolding failed.")
+            tmp_path = "{}.tmp{}".format(os.path.dirname(base_file), os.getpid())
+            os.makedirs(tmp_path, exist_ok=True)
+            try:
+                onnx.save(model, os.path.join(tmp_path, "model.onnx"), save_as_external_data=True,
+                          location="model.data")
+                os.rename(tmp_path, os.path.dirname(base_file))
+            except OSError as e:
+                print("WARNING: failed to save conversion cache {}: {}".format(model_dir, e))
+                return model
+            finally:
+                if os.path.exists(tmp_path):
+                    shutil.rmtree(tmp_path)
+        else:
+            print("Load weight folded model from cache {}".format(base_file))
+        return onnx.load(base_file)
+
+    def save_opt_model(self):
+        # self.model keeps referring to the external data file written here
+        data_file = self.onnx_file + ".data"
+        file_mark(self.onnx_file)
+        file_mark(data_file)
+        if os.path.exists(data_file):
+            os.remove(data_file)
+        onnx.save(self.model,
+                  self.onnx_file,
+                  save_as_external_data=True,
+                  location=os.path.basename(data_file))
+        strip_model = onnx.ModelProto()
+        strip_model.CopyFrom(self.model)
+        strip_model.graph.ClearField("initializer")
+        with open(self.onnx_file + ".prototxt", "w") as f:
+            f.write(str(strip_model))
+
+    def add_initializer_weights(self):
+        """all initializers as weights, the ones in external data are memory mapped"""
+        base_dir = os.path.dirname(os.path.abspath(self.onnx_file))
+        raw_types = [
+            onnx.TensorProto.FLOAT, onnx.TensorProto.UINT8, onnx.TensorProto.INT8,
+            onnx.TensorProto.UINT16, onnx.TensorProto.INT16, onnx.TensorProto.INT32,
+            onnx.TensorProto.INT64, onnx.TensorProto.BOOL, onnx.TensorProto.FLOAT16,
+            onnx.TensorProto.DOUBLE, onnx.TensorProto.UINT32, onnx.TensorProto.UINT64
+        ]
+        for tensor in self.model.graph.initializer:
+            name = tensor.name
+            shape = list(tensor.dims)
+            if tensor.data_location != onnx.TensorProto.EXTERNAL \
+                    or tensor.data_type not in raw_types or np.prod(shape) == 0:
+                data = numpy_helper.to_array(tensor, base_dir).astype(np.float32)
+                self.addWeight(name, data)
+                continue
+            info = {x.key: x.value for x in tensor.external_data}
+            dtype = mapping.TENSOR_TYPE_TO_NP_TYPE[tensor.data_type]
+            loader = lambda path=os.path.join(base_dir, info["location"]), dtype=dtype, \
+                offset=int(info.get("offset", 0)), shape=tuple(shape): \
+                np.memmap(path, dtype=dtype, mode='c', offset=offset, shape=shape)
+            self.addLazyWeight(name, shape or [1], dtype, loader)
+            # TODO: for quantized onnx, keep the same type
+
+    def save_to_cache(self, cache_path):
+        tmp_path = "{}.tmp{}".format(cache_path, os.getpid())
+        os.makedirs(tmp_path, exist_ok=True)
+        try:
+            meta = {
+                "input_names": self.input_names,
+                "input_shapes": [self.getShape(name) for name in self.input_names],
+            }
+            with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+                json.dump(meta, f)
+            # small models may have no tensor big enough for external data
+            if os.path.exists(self.onnx_file + ".data"):
+                link_or_copy(self.onnx_file + ".data", os.path.join(tmp_path, "model.data"))
+            shutil.copyfile(self.onnx_file + ".prototxt", os.path.join(tmp_path, "model.prototxt"))
+            model = onnx.ModelProto()
+            model.CopyFrom(self.model)
+            set_external_data_location(model, "model.data")
+            with open(os.path.join(tmp_path, "model.onnx"), "wb") as f:
+                f.write(model.SerializeToString())
+            os.rename(tmp_path, cache_path)
+        except OSError as e:
+            print("WARNING: failed to save conversion cache {}: {}".format(cache_path, e))
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path)
+
+    def load_from_cache(self, cache_path):
+        with open(os.path.join(cache_path, "meta.json")) as f:
+            meta = json.load(f)
+        self.input_names = meta["input_names"]
+        self.num_input = len(self.input_names)
+        for name, shape in zip(self.input_names, meta["input_shapes"]):
+            self.addShape(name, shape)
+        # the graph refers to the weights by external data, as after save_opt_model
+        with open(os.path.join(cache_path, "model.onnx"), "rb") as f:
+            self.model = onnx.load_model_from_string(f.read())
+        data_file = self.onnx_file + ".data"
+        set_external_data_location(self.model, os.path.basename(data_file))
+        file_mark(self.onnx_file)
+        file_mark(data_file)
+        if os.path.exists(os.path.join(cache_path, "model.data")):
+            link_or_copy(os.path.join(cache_path, "model.data"), data_file)
+        with open(self.onnx_file, "wb") as f:
+            f.write(self.model.SerializeToString())
+        shutil.copyfile(os.path.join(cache_path, "model.prototxt"), self.onnx_file + ".prototxt")
+        self.input_shapes = self.get_input_shapes(self.model)
+        self.input_types = self.get_input_types(self.model)
+        self.output_types = self.get_output_types(self.model)
+        self.add_initializer_weights()
+        self.get_output_name(self.model.graph)
+
     def load_onnx_model(self, onnx_file, input_shapes: list, output_names: list, static_shape=True):
+        self.onnx_file = "{}_opt.onnx".format(self.model_name)
+        model_dir, cache_path = self.cache_path(onnx_file, input_shapes, output_names, static_shape)
+        if cache_path and os.path.isdir(cache_path):
+            print("Load converted model from cache {}".format(cache_path))
+            self.load_from_cache(cache_path)
+        elif cache_path:
+            os.makedirs(model_dir, exist_ok=True)
+            self.convert_onnx_model(self.load_base_model(onnx_file, model_dir), input_shapes,
+                                    output_names, static_shape)
+            self.save_to_cache(cache_path)
+        else:
+            self.convert_onnx_model(onnx_file, input_shapes, output_names, static_shape)
+        if static_shape:
+            # fuse ops such as layernorm gelu...
+            self.model, self.node_name_mapping = onnx_opt(self.model, True)
+
+    def convert_onnx_model(self, onnx_file, input_shapes: list, output_names: list,
+                           static_shape=True):
         if isinstance(onnx_file, str):
             self.model = onnx.load(onnx_file)
         else:
@@ -430,24 +687,10 @@ class OnnxConverter(BaseConverter):
         self.input_shapes = self.get_input_shapes(self.model)
         self.input_types = self.get_input_types(self.model)
         self.output_types = self.get_output_types(self.model)
-        # add all weight
-        for tensor in self.model.graph.initializer:
-            name = tensor.name
-            data = numpy_helper.to_array(tensor).astype(np.float32)
-            self.addWeight(name, data)
-            # TODO: for quantized onnx, keep the same type
+        # weights are added from the saved model, big ones stay in its external data
+        self.save_opt_model()
+        self.add_initializer_weights()
         self.get_output_name(self.model.graph)
-        self.onnx_file = "{}_opt.onnx".format(self.model_name)
-        file_mark(self.onnx_file)
-        onnx.save(self.model, self.onnx_file, save_as_external_data=True)
-        strip_model = onnx.ModelProto()
-        strip_model.CopyFrom(self.model)
-        strip_model.graph.ClearField("initializer")
-        with open(self.onnx_file + ".prototxt", "w") as f:
-            f.write(str(strip_model))
-        if static_shape:
-            # fuse ops such as layernorm gelu...
-            self.model, self.node_name_mapping = onnx_opt(self.model, True)
 
     def get_output_name(self, graph):
         for output in graph.output:
@@ -1,4 +1,6 @@
 from collections import Counter, defaultdict, OrderedDict
+import os
+import tempfile
 import onnx
 import onnx.numpy_helper
 import copy
@@ -70,7 +72,9 @@ class ConstantFolding(object):
             onnx.checker.check_model(self.model)
         except:
             print("WARNING: onnx model check failed")
-        self.const_tensors = []
+        self.const_tensors = set()
+        # single node sessions keyed by (normalized node, input dtypes and shapes)
+        self.session_cache = {}
 
     def get_inputs(self):
         initializer_names = [x.name for x in self.model.graph.initializer]
@@ -171,21 +175,21 @@ class ConstantFolding(object):
 
     def get_constant_nodes(self):
         const_nodes = []
-        dynamic_tensors = []
-        self.const_tensors = [x.name for x in self.model.graph.initializer]
-        self.const_tensors.extend([node.output[0] for node in self.model.graph.node if node.op_type == "Constant"])
-        self.const_tensors.extend([''])
+        dynamic_tensors = set()
+        self.const_tensors = set(x.name for x in self.model.graph.initializer)
+        self.const_tensors.update([node.output[0] for node in self.model.graph.node if node.op_type == "Constant"])
+        self.const_tensors.add('')
         for node in self.model.graph.node:
             if node.op_type == "Shape" and node.input[0] not in dynamic_tensors:
                 const_nodes.append(node)
-                self.const_tensors.extend(node.output)
+                self.const_tensors.update(node.output)
             elif node.op_type == "Resize" and all([x in self.const_tensors for x in node.input]):
                 const_nodes.append(node)
-                self.const_tensors.extend(node.output)
+                self.const_tensors.update(node.output)
             elif any(x in dynamic_tensors for x in node.input):
-                dynamic_tensors.extend(node.output)
+                dynamic_tensors.update(node.output)
             elif self.is_dynamic(node):
-                dynamic_tensors.extend(node.output)
+                dynamic_tensors.update(node.output)
             elif self.is_quantizeLinear(node):
                 pass
             elif self.has_subgraph_in_node(node):
@@ -195,29 +199,20 @@ class ConstantFolding(object):
             elif len(node.input) > 0 and all([x in self.const_tensors for x in node.input]) \
                     and not self.is_non_determinstic_node(node):
                 const_nodes.append(node)
-                self.const_tensors.extend(node.output)
+                self.const_tensors.update(node.output)
             elif node.op_type == "Transpose" and all([x in self.const_tensors for x in node.input]):
                 const_nodes.append(node)
-                self.const_tensors.extend(node.output)
+                self.const_tensors.update(node.output)
         return copy.deepcopy(const_nodes)
 
     def forward(self, model):
+        # model is a serialized model or the path of a model file
         input_shapes = {}
         sess_options = rt.SessionOptions()
         sess_options.graph_optimization_level = rt.GraphOptimizationLevel(0)
         sess_options.log_severity_level = 3
-        try:
-            sess = rt.InferenceSession(model.SerializeToString(), sess_options=sess_options,
-                                       providers=["CPUExecutionProvider"])
-        except ValueError:
-            print("Waring: Try to convert through a temporary file.")
-            # large models try to convert through a temporary file
-            import os
-            import tempfile
-            with tempfile.TemporaryDirectory() as tmpdirname:
-                model_path = os.path.join(tmpdirname, 'model.onnx')
-                onnx.save(model, model_path, save_as_external_data=True)
-                sess = rt.InferenceSession(model_path)
+        sess = rt.InferenceSession(model, sess_options=sess_options,
+                                   providers=["CPUExecutionProvider"])
 
         input_names = self.get_input_names()
         inputs = {}
@@ -231,16 +226,199 @@ class ConstantFolding(object):
         return OrderedDict(zip(outputs, sess.run(outputs, inputs, run_options=run_options)))
 
     def forward_for_node_outputs(self, const_nodes):
-        model = copy.deepcopy(self.model)
+        # serialize with the outputs exposed temporarily instead of running a deep copy
+        # of the model, self.model itself is never passed to onnxruntime or onnx.save
+        outputs = [onnx.ValueInfoProto(name=output) for node in const_nodes for output in node.output]
+        num_outputs = len(self.model.graph.output)
+        self.model.graph.output.extend(outputs)
+        try:
+            model_bytes = self.model.SerializeToString()
+        except ValueError:
+            model_bytes = None
+        finally:
+            del self.model.graph.output[num_outputs:]
+        if model_bytes is not None:
+            return self.forward(model_bytes)
+
+        print("Waring: Try to convert through a temporary file.")
+        # large models try to convert through a temporary file
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            model_path = os.path.join(tmpdirname, 'model.onnx')
+            self.save_external_copy(model_path, outputs)
+            return self.forward(model_path)
+
+    def save_external_copy(self, model_path, outputs):
+        """
+        save self.model with extra graph outputs to model_path, initializers with raw
+        data are written to model_path.data as external data. Only the graph without
+        those initializers is copied, self.model is not modified.
+        """
+
+        def copy_fields(dst, src, skip=()):
+            for field, value in src.ListFields():
+                if field.name in skip:
+                    continue
+                if field.label == field.LABEL_REPEATED:
+                    getattr(dst, field.name).extend(value)
+                elif field.type == field.TYPE_MESSAGE:
+                    getattr(dst, field.name).CopyFrom(value)
+                else:
+                    setattr(dst, field.name, value)
+
+        model = onnx.ModelProto()
+        copy_fields(model, self.model, skip=("graph", ))
+        copy_fields(model.graph, self.model.graph, skip=("initializer", ))
+        model.graph.output.extend(outputs)
+        location = os.path.basename(model_path) + ".data"
+        offset = 0
+        with open(model_path + ".data", "wb") as f:
+            for tensor in self.model.graph.initializer:
+                if not tensor.HasField("raw_data"):
+                    model.graph.initializer.append(tensor)
+                    continue
+                header = model.graph.initializer.add()
+                copy_fields(header, tensor, skip=("raw_data", ))
+                f.write(tensor.raw_data)
+                for key, value in (("location", location), ("offset", offset),
+                                   ("length", len(tensor.raw_data))):
+                    header.external_data.add(key=key, value=str(value))
+                header.data_location = onnx.TensorProto.EXTERNAL
+                offset += len(tensor.raw_data)
+        onnx.save(model, model_path)
+
+    def build_const_index(self):
+        self.initializer_map = {x.name: x for x in self.model.graph.initializer}
+        self.constant_map = {
+            node.output[0]: node
+            for node in self.model.graph.node if node.op_type == "Constant"
+        }
+        # same priority as get_value_info_all
+        self.value_info_map = {}
+        for v in reversed([*self.model.graph.value_info, *self.model.graph.input,
+                           *self.model.graph.output]):
+            self.value_info_map[v.name] = v
+
+    def get_const_value(self, name, values):
+        if name not in values:
+            if name in self.initializer_map:
+                values[name] = onnx.numpy_helper.to_array(self.initializer_map[name])
+            elif name in self.constant_map:
+                res = self.forward_single_node(self.constant_map[name], values)
+                if res is None:
+                    return None
+                values.update(res)
+            else:
+                return None
+        return values[name]
+
+    def get_static_shape(self, name, values):
+        if name in self.const_tensors:
+            value = self.get_const_value(name, values)
+            return None if value is None else list(value.shape)
+        vinfo = self.value_info_map.get(name)
+        if vinfo is None or not vinfo.type.tensor_type.HasField("shape"):
+            return None
+        dims = vinfo.type.tensor_type.shape.dim
+        if not all(dim.HasField("dim_value") for dim in dims):
+            return None
+        return self.get_shape_from_value_info_proto(vinfo)
+
+    def forward_single_node(self, node, values):
+        """Evaluate one constant node from the values of its inputs.
+
+        Returns None if the node can not be evaluated on its own, the caller then
+        falls back to running the whole model.
+        """
+        attrs = {attr.name: onnx.helper.get_attribute_value(attr) for attr in node.attribute}
+        if node.op_type == "Constant" and "value" in attrs:
+            return {node.output[0]: onnx.numpy_helper.to_array(attrs["value"])}
+        if node.op_type == "Shape":
+            shape = self.get_static_shape(node.input[0], values)
+            if shape is None:
+                return None
+            shape = shape[attrs.get("start", 0):attrs.get("end", len(shape))]
+            return {node.output[0]: np.array(shape, dtype=np.int64)}
+        if self.has_subgraph_in_node(node):
+            return None
+        feeds = {}
+        input_map = {}
+        for name in node.input:
+            if name and name not in input_map:
+                value = self.get_const_value(name, values)
+                if value is None:
+                    return None
+                input_map[name] = "input_{}".format(len(input_map))
+                feeds[input_map[name]] = value
+        fold_node = onnx.NodeProto()
+        fold_node.CopyFrom(node)
+        fold_node.name = ""
+        del fold_node.input[:]
+        del fold_node.output[:]
+        fold_node.input.extend([input_map.get(name, '') for name in node.input])
+        fold_node.output.extend(
+            ["output_{}".format(i) if name else '' for i, name in enumerate(node.output)])
+        key = (fold_node.SerializeToString(),
+               tuple((v.dtype.str, v.shape) for v in feeds.values()))
+        if key not in self.session_cache:
+            self.session_cache[key] = self.build_single_node_session(fold_node, feeds)
+        sess = self.session_cache[key]
+        if sess is None:
+            return None
+        outputs = [(name, fold_name) for name, fold_name in zip(node.output, fold_node.output)
+                   if name]
+        run_options = rt.RunOptions()
+        run_options.log_severity_level = 3
+        try:
+            res = sess.run([x[1] for x in outputs], feeds, run_options=run_options)
+        except Exception:
+            return None
+        return dict(zip([x[0] for x in outputs], res))
+
+    def build_single_node_session(self, fold_node, feeds):
+        try:
+            inputs = [
+                onnx.helper.make_tensor_value_info(
+                    name, onnx.helper.np_dtype_to_tensor_dtype(value.dtype), value.shape)
+                for name, value in feeds.items()
+            ]
+            outputs = [onnx.ValueInfoProto(name=name) for name in fold_node.output if name]
+            graph = onnx.helper.make_graph([fold_node], "constant_folding", inputs, outputs)
+            model = onnx.helper.make_model(graph, opset_imports=self.model.opset_import)
+            model.ir_version = self.model.ir_version
+            sess_options = rt.SessionOptions()
+            sess_options.graph_optimization_level = rt.GraphOptimizationLevel(0)
+            sess_options.log_severity_level = 3
+            return rt.InferenceSession(model.SerializeToString(), sess_options=sess_options,
+                                       providers=["CPUExecutionProvider"])
+        except Exception:
+            return None
+
+    def forward_const_nodes(self, const_nodes):
+        # const_nodes are in topological order, so a single pass propagates the
+        # constants node by node. Nodes that can not be evaluated alone (e.g. Shape
+        # of a tensor without a static shape yet) are left for the next pass, after
+        # shape inference on the folded model; the whole model is only run when no
+        # node could be folded on its own
+        self.build_const_index()
+        values = {}
+        res = OrderedDict()
+        fallback_nodes = []
         for node in const_nodes:
-            for output in node.output:
-                model.graph.output.extend([onnx.ValueInfoProto(name=output)])
-        return self.forward(model)
+            outputs = self.forward_single_node(node, values)
+            if outputs is None:
+                fallback_nodes.append(node)
+                continue
+            values.update(outputs)
+            res.update(outputs)
+        if fallback_nodes and not res:
+            res.update(self.forward_for_node_outputs(fallback_nodes))
+        return res
 
     def eliminate_const_nodes(self, const_node, res):
         do_eliminate = False
+        const_node_map = {node.output[0]: node for node in const_node}
         for i, node in enumerate(self.model.graph.node):
-            if node in const_node:
+            if len(node.output) > 0 and const_node_map.get(node.output[0]) == node:
                 if node.op_type == "If":
                     sub_graph = {}
                     for attr in node.attribute:
@@ -259,24 +437,36 @@ class ConstantFolding(object):
                     self.model.graph.node.remove(node)
                     do_eliminate = True
                     continue
+                if len(node.output) == 1:
+                    # replace in place, same result as inserting behind and deleting the node
+                    new_node = self.make_constant_node(node, node.output[0], res)
+                    self.model.graph.node[i].CopyFrom(new_node)
+                    do_eliminate = True
+                    continue
                 for output in node.output:
-                    new_node = copy.deepcopy(node)
-                    new_node.name = "node_" + output
-                    new_node.op_type = "Constant"
-                    new_attr = onnx.helper.make_attribute(
-                        "value",
-                        onnx.numpy_helper.from_array(res[output], name=output)
-                    )
-                    del new_node.input[:]
-                    del new_node.attribute[:]
-                    del new_node.output[:]
-                    new_node.output.extend([output])
-                    new_node.attribute.extend([new_attr])
+                    new_node = self.make_constant_node(node, output, res)
                     self.insert_elem(self.model.graph.node, i + 1, new_node)
                 del self.model.graph.node[i]
                 do_eliminate = True
         return do_eliminate
 
+    @staticmethod
+    def make_constant_node(node, output, res):
+        new_node = onnx.NodeProto()
+        new_node.CopyFrom(node)
+        new_node.name = "node_" + output
+        new_node.op_type = "Constant"
+        new_attr = onnx.helper.make_attribute(
+            "value",
+            onnx.numpy_helper.from_array(res[output], name=output)
+        )
+        del new_node.input[:]
+        del new_node.attribute[:]
+        del new_node.output[:]
+        new_node.output.extend([output])
+        new_node.attribute.extend([new_attr])
+        return new_node
+
     def remove_unused_nodes(self):
         node_inputs = []
         unused_node = []
@@ -301,7 +491,7 @@ class ConstantFolding(object):
 
     def folding(self, infer_shapes=True):
         const_nodes = self.get_constant_nodes()
-        res = self.forward_for_node_outputs(const_nodes)
+        res = self.forward_const_nodes(const_nodes)
         const_node = [node for node in const_nodes if node.output[0] in res]
         do_eliminate = self.eliminate_const_nodes(const_node, res)
         if infer_shapes:
@@ -322,6 +512,46 @@ class ConstantFolding(object):
         return self.model
 
 
+class WeightFolding(ConstantFolding):
+    """Fold the nodes computed from weights only, whatever the input shapes.
+
+    Shape nodes and everything depending on them are kept, so the folded model
+    still accepts any input shapes and output selection.
+    """
+
+    def get_constant_nodes(self):
+        const_nodes = []
+        self.const_tensors = set(x.name for x in self.model.graph.initializer)
+        self.const_tensors.update([node.output[0] for node in self.model.graph.node if node.op_type == "Constant"])
+        self.const_tensors.add('')
+        for node in self.model.graph.node:
+            if node.op_type in ["Shape", "Constant"] or self.is_quantizeLinear(node) \
+                    or self.has_subgraph_in_node(node) or self.is_non_determinstic_node(node):
+                continue
+            if len(node.input) > 0 and all([x in self.const_tensors for x in node.input]):
+                const_nodes.append(node)
+                self.const_tensors.update(node.output)
+        return copy.deepcopy(const_nodes)
+
+    def forward_const_nodes(self, const_nodes):
+        # running the whole model needs static input shapes, so nodes that
+        # can not be evaluated alone are left to ConstantFolding
+        self.build_const_index()
+        values = {}
+        res = OrderedDict()
+        for node in const_nodes:
+            outputs = self.forward_single_node(node, values)
+            if outputs is not None:
+                values.update(outputs)
+                res.update(outputs)
+        return res
+
+    def run(self):
+        while self.folding(infer_shapes=False):
+            pass
+        return self.model
+
+
 class OuterNode(object):
 
     def __init__(self, is_tensor=False, tensor_value=None, attr_name=None):
@@ -442,18 +672,36 @@ class ReForm(object):
             info.name: [i.dim_value for i in info.type.tensor_type.shape.dim if i.dim_value > 0]
             for info in self.shape_info
         }
-        self.weight_tensor = [x.name for x in self.weight]
-        self.node_tensor = [node.output[0] for node in self.nodes if node.op_type == "Constant"]
+        self.build_index()
         # stores output node name mapping from src to dst of replace subgraphs
         self.node_name_mapping = {}
 
-    def get_tensor_value(self, name):
-        for n in self.nodes:
-            if name == n.output[0] and n.op_type == 'Constant':
-                return onnx.numpy_helper.to_array(n.attribute[0].t)
+    def build_index(self):
+        # lookups used while matching, rebuilt whenever the graph is rewritten
+        self.weight_map = {}
         for w in self.weight:
-            if name == w.name:
-                return onnx.numpy_helper.to_array(w).astype(np.float32)
+            self.weight_map.setdefault(w.name, w)
+        self.const_map = {}
+        self.node_outputs = set()
+        # non Constant nodes in graph order, and their positions by op_type
+        self.pattern_nodes = []
+        self.op_type_index = defaultdict(list)
+        for node in self.nodes:
+            if len(node.output) > 0:
+                self.node_outputs.add(node.output[0])
+            if node.op_type == 'Constant':
+                self.const_map.setdefault(node.output[0], node)
+                continue
+            self.op_type_index[node.op_type].append(len(self.pattern_nodes))
+            self.pattern_nodes.append(node)
+        self.weight_tensor = set(self.weight_map)
+        self.node_tensor = set(self.const_map)
+
+    def get_tensor_value(self, name):
+        if name in self.const_map:
+            return onnx.numpy_helper.to_array(self.const_map[name].attribute[0].t)
+        if name in self.weight_map:
+            return onnx.numpy_helper.to_array(self.weight_map[name]).astype(np.float32)
 
     def find_tensor(self, name):
         if name in self.node_tensor or name in self.weight_tensor:
@@ -466,12 +714,10 @@ class ReForm(object):
                 return idx, n
 
     def get_input_shape(self, name):
-        for n in self.nodes:
-            if name == n.output[0]:
-                return self.shape_info[name]
-        for w in self.weight:
-            if name == w.name:
-                return list(w.dims)
+        if name in self.node_outputs:
+            return self.shape_info[name]
+        if name in self.weight_map:
+            return list(self.weight_map[name].dims)
 
     def constraint(self, node, mode):
         if mode == 'broadcast' and len(node.input) == 2:
@@ -605,37 +851,28 @@ class ReForm(object):
 
     def match_pattern(self, reform_info):
         name = reform_info.name
-        pnodeIdx = 0
         matched_patterns = []
-        unused_nodes = []
         pattern = reform_info.src_nodes
         patternLens = len(pattern)
-        for node in self.nodes:
-            matched = False
-            if node.op_type == 'Constant':
+        nodes = self.pattern_nodes
+        # a pattern matches consecutive non Constant nodes, so only nodes with the
+        # op_type of its first node can start a match. A failed match restarts at the
+        # node that failed, a complete one right after its last node.
+        next_start = 0
+        for start in self.op_type_index.get(pattern[0].op_type, []):
+            if start < next_start:
                 continue
-            if node.op_type == pattern[pnodeIdx].op_type:
-                matched = self.match_node(node, pattern[pnodeIdx])
-            if matched:
-                pnodeIdx += 1
+            self.reset_outer_node(pattern)
+            unused_nodes = []
+            for pnode, node in zip(pattern, nodes[start:start + patternLens]):
+                if node.op_type != pnode.op_type or not self.match_node(node, pnode):
+                    break
                 unused_nodes.append(node)
-                if pnodeIdx == patternLens:
-                    newNodes = copy.deepcopy(reform_info.dst_nodes)
-                    matched_patterns.append(ReformInfo(name, unused_nodes, newNodes))
-                    pnodeIdx = 0
-                    unused_nodes = []
-                    self.reset_outer_node(pattern)
-            else:
-                pnodeIdx = 0
-                unused_nodes = []
-                self.reset_outer_node(pattern)
-                if node.op_type == pattern[0].op_type:
-                    matched = self.match_node(node, pattern[0])
-                if matched:
-                    pnodeIdx += 1
-                    unused_nodes.append(node)
-                else:
-                    self.reset_outer_node(pattern)
+            if len(unused_nodes) == patternLens:
+                newNodes = copy.deepcopy(reform_info.dst_nodes)
+                matched_patterns.append(ReformInfo(name, unused_nodes, newNodes))
+            next_start = start + max(len(unused_nodes), 1)
+        self.reset_outer_node(pattern)
         return matched_patterns
 
     def reset_outer_node(self, pattern):
@@ -648,11 +885,15 @@ class ReForm(object):
     def replace_pattern(self, matched_pattern):
         # Recently we assume that subgraph to be replace has only one output
         # TODO: implement for multi-output cases
+        if len(matched_pattern) == 0:
+            return
+        position = {node.output[0]: i for i, node in enumerate(self.nodes) if len(node.output) > 0}
+        replacements = []
         for reform_info in matched_pattern:
             src_nodes = reform_info.src_nodes
             dst_nodes = reform_info.dst_nodes
             last_node = src_nodes[-1]
-            insert_idx, _ = self.get_node(last_node.output[0])
+            new_onnx_nodes = []
             out = last_node.output
             for i, new_node in enumerate(dst_nodes):
                 if i == len(dst_nodes) - 1:
@@ -676,8 +917,7 @@ class ReForm(object):
                                                               value=onnx.helper.make_tensor(
                                                                   "value", onnx.TensorProto.FLOAT,
                                                                   tensor_value.shape, tensor_value))
-                        self.nodes.insert(insert_idx, new_onnx_node)
-                        insert_idx += 1
+                        new_onnx_nodes.append(new_onnx_node)
                         inode.output.extend(new_onnx_node.output)
                     _input.append(inode.output[0])
                 # insert new pattern node
@@ -686,42 +926,47 @@ class ReForm(object):
                                                  inputs=_input,
                                                  outputs=_output,
                                                  **new_node.get_attr())
-                self.nodes.insert(insert_idx, new_node)
-                insert_idx += 1
+                new_onnx_nodes.append(new_node)
             node_name = _output[0]
             src_oname = "{}_{}".format(node_name, src_nodes[-1].op_type)
             dst_oname = "{}_{}".format(node_name, dst_nodes[-1].op_type)
             assert (src_oname not in self.node_name_mapping)
             self.node_name_mapping[src_oname] = dst_oname
-            # clear up
-            for node in src_nodes:
-                self.nodes.remove(node)
-            self.remove_unused_tensor()
+            replacements.append(([position[node.output[0]] for node in src_nodes], new_onnx_nodes))
             # print("[ONNX OPT] RULE <<{}>> applied \n".format(reform_info.name))
+        # new nodes go in front of the last matched node, then the matched nodes are
+        # removed. Matches do not overlap, going from the back keeps positions valid.
+        for src_indices, new_onnx_nodes in reversed(replacements):
+            insert_idx = src_indices[-1]
+            for new_node in new_onnx_nodes:
+                self.nodes.insert(insert_idx, new_node)
+                insert_idx += 1
+            del self.nodes[insert_idx]
+            for idx in sorted(src_indices[:-1], reverse=True):
+                del self.nodes[idx]
+        self.remove_unused_tensor()
 
     def remove_unused_tensor(self):
         # purging redundancy tensor
-        all_input = []
-        all_node = [n for n in self.nodes]
-        for n in all_node:
-            all_input.extend(n.input)
+        all_input = set()
+        for n in self.nodes:
+            all_input.update(n.input)
         unused_weight = []
         unused_node = []
-        for w in self.weight:
+        for i, w in enumerate(self.weight):
             if w.name in all_input:
                 continue
-            unused_weight.append(w)
-        for n in self.nodes:
+            unused_weight.append(i)
+        for i, n in enumerate(self.nodes):
             if n.op_type != "Constant" or n.output[0] in all_input:
                 continue
-            unused_node.append(n)
-        for w in unused_weight:
-            self.weight.remove(w)
-        for n in unused_node:
-            self.nodes.remove(n)
+            unused_node.append(i)
+        for i in reversed(unused_weight):
+            del self.weight[i]
+        for i in reversed(unused_node):
+            del self.nodes[i]
         # update
-        self.weight_tensor = [x.name for x in self.weight]
-        self.node_tensor = [node.output[0] for node in self.nodes if node.op_type == "Constant"]
+        self.build_index()
 
     def remove_duplicate(self):
         # same op_type and inputs different output_name
@@ -859,14 +1104,15 @@ class ReForm(object):
 
 
     def graph_opt(self):
-        replaced = False
-        for reform_info in self.reform_info_list:
-            matched_pattern = self.match_pattern(reform_info)
-            if len(matched_pattern) > 0:
-                replaced = True
-            self.replace_pattern(matched_pattern)
-        if replaced:
-            self.graph_opt()
+        self.build_index()
+        replaced = True
+        while replaced:
+            replaced = False
+            for reform_info in self.reform_info_list:
+                matched_pattern = self.match_pattern(reform_info)
+                if len(matched_pattern) > 0:
+                    replaced = True
+                self.replace_pattern(matched_pattern)
 
     def __call__(self, reform_info_list):
         self.reform_info_list = reform_info_list
@@ -8,6 +8,9 @@ import math
 from tqdm import tqdm
 import gc
 import copy
+import shutil
+import tempfile
+from collections import OrderedDict
 from scipy.special import expit
 
 from datetime import datetime
@@ -19,7 +22,7 @@ from multiprocessing import Lock
 import pymlir
 pymlir.set_mem_mode("value_mem")
 from utils.mlir_parser import MlirParser
-from utils.preprocess import preprocess
+from utils.preprocess import preprocess, preprocess_image_batches
 from calibration.data_selector import DataSelector
 
 import torch
@@ -33,6 +36,11 @@ LEARNING_WEIGHT_OPERATION = [
     'top.Conv', 'top.MatMul'#
 ]
 
+# bytes of the im2col rows built at a time for the gptq hessian
+IM2COL_BLOCK_BYTES = 1 << 26
+# columns of one hessian tile computed by a thread
+HESSIAN_TILE = 512
+
 def r_show(op, alpha, weight):
     '''
     import matplotlib.pyplot as plt
@@ -167,6 +175,99 @@ class logging:
             self.log_file.close()
 
 
+class activation_store:
+    # tensors of every sample by name; when they outgrow max_bytes the least
+    # recently used ones are spilled to memory-mapped files in the work dir,
+    # and the next sample of a spilled tensor is read ahead in background
+    def __init__(self, max_bytes, num_sample=0):
+        self.max_bytes = max_bytes
+        self.num_sample = num_sample
+        self.nbytes = 0
+        self.tensors = OrderedDict()  # name -> list of samples, or memmap of all samples
+        self.filled = {}
+        self.files = {}
+        self.num_files = 0
+        self.spill_dir = None
+        self.prefetched = {}  # (name, idx) -> AsyncResult
+        self.prefetch_pool = ThreadPool(1)
+
+    def __contains__(self, name):
+        return name in self.tensors
+
+    def __iter__(self):
+        return iter(list(self.tensors))
+
+    def append(self, name, value):
+        if name not in self.tensors:
+            self.tensors[name] = []
+            self.filled[name] = 0
+        self.tensors.move_to_end(name)
+        t = self.tensors[name]
+        if isinstance(t, list):
+            t.append(value)
+            self.nbytes += value.nbytes
+        else:
+            t[self.filled[name]] = value
+        self.filled[name] += 1
+        self.evict()
+
+    def evict(self):
+        for name in list(self.tensors):
+            if self.nbytes <= self.max_bytes:
+                break
+            if isinstance(self.tensors[name], list):
+                self.spill(name)
+
+    def spill(self, name):
+        t = self.tensors[name]
+        if len(t) == 0 or any(v.shape != t[0].shape or v.dtype != t[0].dtype for v in t):
+            return
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='ref_tensors_', dir=os.getcwd())
+        file = os.path.join(self.spill_dir, '{}.npy'.format(self.num_files))
+        self.num_files += 1
+        mm = np.lib.format.open_memmap(file, mode='w+', dtype=t[0].dtype,
+                                       shape=(max(self.num_sample, len(t)), ) + t[0].shape)
+        for i, v in enumerate(t):
+            mm[i] = v
+        self.nbytes -= sum(v.nbytes for v in t)
+        self.tensors[name] = mm
+        self.files[name] = file
+        loger.logging(f'spill {name} to {file}')
+
+    def get(self, name, idx):
+        t = self.tensors[name]
+        self.tensors.move_to_end(name)
+        if isinstance(t, list):
+            return t[idx]
+        res = self.prefetched.pop((name, idx), None)
+        value = res.get() if res is not None else np.array(t[idx])
+        # samples are walked in order, possibly over several passes
+        next_idx = (idx + 1) % self.filled[name]
+        if (name, next_idx) not in self.prefetched:
+            self.prefetched[(name, next_idx)] = self.prefetch_pool.apply_async(np.array, (t[next_idx], ))
+        return value
+
+    def __delitem__(self, name):
+        t = self.tensors.pop(name)
+        del self.filled[name]
+        for key in [k for k in self.prefetched if k[0] == name]:
+            del self.prefetched[key]
+        if isinstance(t, list):
+            self.nbytes -= sum(v.nbytes for v in t)
+        else:
+            del t
+            os.remove(self.files.pop(name))
+
+    def close(self):
+        self.prefetch_pool.terminate()
+        self.tensors.clear()
+        self.prefetched.clear()
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
+
 class learning_inputs:
     def __init__(self, parser, args):
         self.dataset = args.dataset
@@ -175,12 +276,11 @@ class learning_inputs:
         self.input_num = parser.get_input_num()
         self.num_sample = 0
         self.parser = parser
-        self.ref_activations = {}
+        self.input_names = [op.name for op in parser.inputs]
+        self.ref_activations = activation_store(args.mem_budget << 20)
 
     def prepare(self, input_num):
-        tune_idx = 0
-        self.ref_activations[tune_idx] = {}
-        input_names = [op.name for op in self.parser.inputs]
+        input_names = self.input_names
         ds = DataSelector(self.dataset, input_num, self.data_list)
         ppa_list = []
         if ds.all_image:
@@ -193,8 +293,10 @@ class learning_inputs:
                 for i in range(self.batch_size - n):
                     ds.data_list.append(ds.data_list[-1])
             self.num_sample = len(ds.data_list) // self.batch_size
+            self.ref_activations.num_sample = self.num_sample
             batched_idx = 0
             batched_inputs = self.input_num * ['']
+            image_inputs = preprocess_image_batches(ppa_list, ds.data_list, self.batch_size)
             for data in ds.data_list:
                 inputs = data.split(',')
                 inputs = [s.strip() for s in inputs]
@@ -203,38 +305,27 @@ class learning_inputs:
                 for i, input in enumerate(input_names):
                     batched_inputs[i] += '{},'.format(inputs[i])
                     if batched_idx == self.batch_size:
-                        x = ppa_list[i].run(batched_inputs[i][:-1])
-                        count = self.parser.get_user_count_by_op_name(input)
-                        self.ref_activations[tune_idx][input] = [x, count]
+                        x = image_inputs[i][batched_inputs[i][:-1]]
+                        self.ref_activations.append(input, x)
                 if batched_idx == self.batch_size:
-                    tune_idx += 1
                     batched_idx = 0
                     batched_inputs = self.input_num * ['']
-                    self.ref_activations[tune_idx] = {}
         elif ds.all_npy:
             self.num_sample = len(ds.data_list)
-            self.input_data_buffer = [[] for i in range(self.num_sample)]
+            self.ref_activations.num_sample = self.num_sample
             for data in ds.data_list:
                 inputs = data.split(',')
                 inputs = [s.strip() for s in inputs]
                 assert (len(inputs) == self.input_num)
                 for name, npy in zip(input_names, inputs):
-                    x = np.load(npy)
-                    count = self.parser.get_user_count_by_op_name(name)
-                    self.ref_activations[tune_idx][name] = [x, count]
-                tune_idx += 1
-                self.ref_activations[tune_idx] = {}
+                    self.ref_activations.append(name, np.load(npy))
         elif ds.all_npz:
             self.num_sample = len(ds.data_list)
-            self.input_data_buffer = [[] for i in range(self.num_sample)]
-            input_names = [op.name for op in self.parser.inputs]
+            self.ref_activations.num_sample = self.num_sample
             for data in ds.data_list:
                 npz = np.load(data)
                 for name in input_names:
-                    count = self.parser.get_user_count_by_op_name(name)
-                    self.ref_activations[tune_idx][name] = [npz[name], count]
-                tune_idx += 1
-                self.ref_activations[tune_idx] = {}
+                    self.ref_activations.append(name, npz[name])
         else:
             raise RuntimeError("dataset is incorrect")
         return self.num_sample
@@ -247,7 +338,12 @@ class ref_tensors:
         self.epoch_samples = inputs.num_sample
         self.ops = {}
         self.ops_cnt = {}
-        self.ops_buffer = {}
+        # shares the memory budget with the net inputs, drop what a previous
+        # learner left behind
+        self.ops_buffer = inputs.ref_activations
+        for op in self.ops_buffer:
+            if op not in inputs.input_names:
+                del self.ops_buffer[op]
         self.init()
 
     def add_name(self, ops):
@@ -276,39 +372,31 @@ class ref_tensors:
             print(f"requested idx out of range {idx} vs {self.epoch_samples}")
         #if already buffered return the buffer
         if op in self.ops_buffer:
-            return self.ops_buffer[op][idx]
-        elif op in self.net_inputs.ref_activations[0]:
-            return self.net_inputs.ref_activations[idx][op][0]
+            return self.ops_buffer.get(op, idx)
 
         #if not bufferred, generate all samples
         inputs = self.parser.get_pre_op_by_op_name(op)
         for in_ in inputs:
-            if in_ not in self.ops_buffer and in_ not in self.net_inputs.ref_activations[0]:
+            if in_ not in self.ops_buffer:
                 loger.logging(f'recursive get {in_}')
                 self.get(in_, idx, quant, symetric)
                 self.ops_cnt[in_] = self.ops[in_]
         for l in range(self.epoch_samples):
             for in_ in inputs:
                 if in_ in self.ops_buffer:
-                    self.module.set_tensor(in_, self.ops_buffer[in_][l])
-                elif in_ in self.net_inputs.ref_activations[0]:
-                    self.module.set_tensor(in_, self.net_inputs.ref_activations[l][in_][0])
-                outputs = self.module.invoke_at(op)
-                for out_ in self.parser.get_outputs_by_op_name(op):
-                    if out_ in self.ops and self.ops[out_] > 0:
-                        if out_ in self.ops_buffer:
-                            self.ops_buffer[out_].append(self.module.get_tensor(out_).copy())
-                        else:
-                            self.ops_buffer[out_] = []
-                            self.ops_buffer[out_].append(self.module.get_tensor(out_).copy())
-                    if l == 0:
-                        loger.logging(f'adding {out_} cnt {self.ops[out_]}')
+                    self.module.set_tensor(in_, self.ops_buffer.get(in_, l))
+            outputs = self.module.invoke_at(op)
+            for out_ in self.parser.get_outputs_by_op_name(op):
+                if out_ in self.ops and self.ops[out_] > 0:
+                    self.ops_buffer.append(out_, self.module.get_tensor(out_).copy())
+                if l == 0:
+                    loger.logging(f'adding {out_} cnt {self.ops[out_]}')
         for out_ in self.parser.get_outputs_by_op_name(op):
             if out_ in self.ops and self.ops[out_] > 0:
                 loger.logging(f'setting {out_} {self.ops[out_]}')
                 self.ops_cnt[out_] = self.ops[out_]
         for in_ in inputs:
-            if in_ in self.ops_buffer:
+            if in_ in self.ops_buffer and in_ not in self.net_inputs.input_names:
                 self.ops_cnt[in_] -= 1
                 if self.ops_cnt[in_] == 0:
                     del self.ops_buffer[in_]
@@ -316,10 +404,10 @@ class ref_tensors:
         if op not in self.ops_buffer:
             print(f'{op} not in ref tensors!')
             sys.exit(1)
-        return self.ops_buffer[op][idx]
+        return self.ops_buffer.get(op, idx)
 
     def consumed_tensor(self, op):  # must call when loop over epoch of using the tensor is done
-        if op in self.net_inputs.ref_activations[0]:
+        if op in self.net_inputs.input_names:
             return
         if op not in self.ops_buffer:
             print(f"{op} not in buffer when mark used!")
@@ -485,6 +573,50 @@ class LearningGptqWeight:
             q = np.clip(np.round(x / self.scale) +self.zero, 0, self.maxq)
             return self.scale * (q - self.zero)
 
+    class HessianAccumulator():
+        # H = 2/n * sum(x^T x) over the im2col rows x of n samples, inputs are
+        # summed in batches and their rows streamed in float32 blocks, each
+        # block updating the upper triangle tiles of the sum on the thread pool
+        def __init__(self, columns, blocks, batch=1):
+            self.sum = np.zeros((columns, columns))
+            self.blocks = blocks  # input -> float32 im2col row blocks
+            self.batch = batch
+            self.samples = 0
+            self.pending = []
+            self.tiles = [(i, min(i + HESSIAN_TILE, columns)) for i in range(0, columns, HESSIAN_TILE)]
+            self.pairs = [(a, b) for a in range(len(self.tiles)) for b in range(a, len(self.tiles))]
+
+        def add(self, input, in_num):
+            self.pending.append(input)
+            self.samples += in_num
+            if len(self.pending) >= self.batch:
+                self.flush()
+
+        def update_tile(self, x, pair):
+            (i0, i1), (j0, j1) = self.tiles[pair[0]], self.tiles[pair[1]]
+            self.sum[i0:i1, j0:j1] += np.matmul(x[:, i0:i1].T, x[:, j0:j1])
+
+        def flush(self):
+            if len(self.pending) == 0:
+                return
+            inputs = self.pending
+            if len(inputs) > 1 and all(x.shape == inputs[0].shape for x in inputs):
+                inputs = [np.concatenate(inputs, axis=0)]
+            self.pending = []
+            for input in inputs:
+                for x in self.blocks(input):
+                    if len(self.pairs) == 1:
+                        self.update_tile(x, self.pairs[0])
+                    else:
+                        pool.map(lambda pair: self.update_tile(x, pair), self.pairs)
+
+        def hessian(self):
+            self.flush()
+            if self.samples == 0:
+                return np.zeros_like(self.sum)
+            upper = np.triu(self.sum)
+            return (upper + np.triu(upper, 1).T) * (2 / self.samples)
+
     def __init__(self, args):
         self.scales = None
         self.finetune_layers = []
@@ -497,7 +629,6 @@ class LearningGptqWeight:
         self.input_num = self.parser.get_input_num()  # number of net inputs
         self.mini_batch = args.mini_batch
         self.num_sample = 0
-        self.samples = {}
         self.epoch = args.epoch
         self.ref_tensors = None
         self.pre_loss = {}
@@ -570,7 +701,7 @@ class LearningGptqWeight:
             quanter = self.GptqQuantizer(shape, bits=bitwidth, perchannel=False, sym=True, mse=False)
         quanter.find_params(W, weight=True)
 
-        H = torch.Tensor(self.H[op])
+        H = torch.Tensor(self.H[op].hessian())
         dead = torch.diag(H) == 0
         H[dead, dead] = 1
         W[:, dead] = 0
@@ -700,6 +831,46 @@ class LearningGptqWeight:
         s = [int(x) for x in s]
         return s
 
+    def conv_input_blocks(self, op, input):
+        # im2col rows of the conv input, ordered as torch.nn.Unfold columns,
+        # built for a few output rows at a time
+        op_ = self.parser.get_op_by_op_name(op)
+        if op_ == None:
+            print(f'error find op {op}')
+            sys.exit(1)
+        k_shape = self.shape_str_to_list(op_.attrs['kernel_shape'])
+        dia = self.shape_str_to_list(op_.attrs['dilations'])
+        pads = self.shape_str_to_list(op_.attrs['pads'])
+        strides = self.shape_str_to_list(op_.attrs['strides'])
+        if len(k_shape) != 2 or input.ndim != 4:
+            print("not support!")
+            sys.exit(1)
+        if len(pads) == 2:
+            pads = pads + pads
+        n, c, h, w = input.shape
+        kh, kw = k_shape
+        x = np.pad(input.astype(np.float32), ((0, 0), (0, 0), (pads[0], pads[2]), (pads[1], pads[3])))
+        oh = (h + pads[0] + pads[2] - dia[0] * (kh - 1) - 1) // strides[0] + 1
+        ow = (w + pads[1] + pads[3] - dia[1] * (kw - 1) - 1) // strides[1] + 1
+        step = max(1, IM2COL_BLOCK_BYTES // (n * ow * c * kh * kw * 4))
+        for r0 in range(0, oh, step):
+            rows = min(step, oh - r0)
+            cols = np.empty((n, rows, ow, c, kh, kw), dtype=np.float32)
+            for i in range(kh):
+                for j in range(kw):
+                    y0 = r0 * strides[0] + i * dia[0]
+                    x0 = j * dia[1]
+                    patch = x[:, :, y0:y0 + (rows - 1) * strides[0] + 1:strides[0],
+                              x0:x0 + (ow - 1) * strides[1] + 1:strides[1]]
+                    cols[:, :, :, :, i, j] = patch.transpose(0, 2, 3, 1)
+            yield cols.reshape(n * rows * ow, c * kh * kw)
+
+    def matmul_input_blocks(self, input):
+        x = input.reshape(-1, input.shape[-1])
+        step = max(1, IM2COL_BLOCK_BYTES // (x.shape[1] * 4))
+        for r0 in range(0, x.shape[0], step):
+            yield x[r0:r0 + step].astype(np.float32)
+
     def update_H(self, op, input, output):
         shape = input.shape
         in_num = shape[0]
@@ -707,40 +878,17 @@ class LearningGptqWeight:
             weight_shape = self.orig_weights[op].shape
             if self.parser.get_op_type_by_op_name(op) == 'top.Conv':
                 weight_shape = self.orig_weights[op].reshape(weight_shape[0],-1).shape
+                blocks = lambda x: self.conv_input_blocks(op, x)
             elif self.parser.get_op_type_by_op_name(op) == 'top.MatMul':
                 weight_shape = self.orig_weights[op].transpose().shape
+                blocks = self.matmul_input_blocks
             else:
                 print('not support!')
                 sys.exit(1)
-            self.H[op] = np.zeros((weight_shape[1],weight_shape[1]))
-            self.samples[op] = 0
+            self.H[op] = self.HessianAccumulator(weight_shape[1], blocks, self.mini_batch)
         else:
             # do the add batch update to H
-            if self.parser.get_op_type_by_op_name(op) == 'top.Conv':
-                op_ = self.parser.get_op_by_op_name(op)
-                if op_ == None:
-                    print(f'error find op {op}')
-                    sys.exit(1)
-                k_shape = self.shape_str_to_list(op_.attrs['kernel_shape'])
-                dia = self.shape_str_to_list(op_.attrs['dilations'])
-                pads = self.shape_str_to_list(op_.attrs['pads'])
-                #group = int(op_.attrs['group'].split(':')[0])
-                if len(pads) == 4:
-                    pads = [pads[0], pads[2]]
-                strides = self.shape_str_to_list(op_.attrs['strides'])
-                ufold = torch.nn.Unfold(tuple(k_shape), dilation=dia, padding = pads, stride=strides)
-                inp = ufold(torch.Tensor(input)).permute([1,0,2]).numpy()
-                #inp = inp.reshape(inp.shape[0]//group,-1)
-                inp = inp.reshape(inp.shape[0],-1)
-            elif self.parser.get_op_type_by_op_name(op) == 'top.MatMul':
-                inp = input.reshape(-1,shape[-1]).transpose()
-            else:
-                print("not support!")
-                sys.exit(1)
-            self.H[op] *= self.samples[op]/(self.samples[op]+in_num)
-            self.samples[op] = self.samples[op]+in_num
-            inp = np.sqrt(2/self.samples[op])*inp
-            self.H[op] += np.matmul(inp, inp.transpose())
+            self.H[op].add(input, in_num)
 
     def learning_one(self, epoch, op, total):
         loger.logging(f"now to learn {op} in epoch {epoch}")
@@ -1738,6 +1886,8 @@ if __name__ == '__main__':
                         help='batch size for learning')
     parser.add_argument('--threads', required=False, type=int, default=4,
                         help='number of working threads')
+    parser.add_argument('--mem_budget', required=False, type=int, default=16384,
+                        help='MB of reference tensors kept in memory, the rest spill to disk')
     parser.add_argument('--momentum', required=False, type=float, default=0.9,
                         help='momentum of learning')
     parser.add_argument('--nesterov', required=False, action='store_true', dest='nesterov',
@@ -1817,5 +1967,6 @@ if __name__ == '__main__':
         weight_searcher.learning()
         del weight_searcher
 
+    all_inputs.ref_activations.close()
     loger.end()
 
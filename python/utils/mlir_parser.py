@@ -9,6 +9,7 @@
 # ==============================================================================
 from typing import List
 from itertools import chain
+from collections import deque
 import sys
 import mlir
 import re
@@ -209,6 +210,22 @@ class MlirParser:
         for op in self.ops:
             if op.type == "top.Input":
                 self.inputs.append(op)
+        self._build_index()
+
+    def _build_index(self):
+        # name -> op, tensor -> producer op, tensor -> consumer ops;
+        # built once so that graph queries do not rescan self.ops
+        self._op_map = {}
+        self._producer_map = {}
+        self._consumer_map = {}
+        for op in self.ops:
+            self._op_map.setdefault(op.name, op)
+            for out in op.outputs or []:
+                self._producer_map.setdefault(out, op)
+            for opd in dict.fromkeys(op.opds):
+                self._consumer_map.setdefault(opd, []).append(op)
+        self._all_pre_ops_cache = {}
+        self._all_next_ops_cache = {}
 
     def get_op_name_list(self):
         return [op.name for op in self.ops]
@@ -226,46 +243,54 @@ class MlirParser:
         return Operation.shape(self.inputs[0].op)[0]
 
     def get_pre_op_by_op_name(self, op_name):
-        op_input_tensor = []
-        for op in self.ops:
-            if op.name == op_name:
-                for opd in op.opds:
-                    if opd in self.get_op_output_name_list():
-                        op_input_tensor.append(opd)
-        return op_input_tensor
+        op = self._op_map.get(op_name)
+        if op is None:
+            return []
+        return [opd for opd in op.opds if opd in self._producer_map]
 
     def get_next_op_by_op_name(self, op_name):
-        op_output_tensor = []
-        for op in self.ops:
-            if op_name in op.opds:
-                if op.name in self.get_op_output_name_list():
-                    op_output_tensor.append(op.name)
-        return op_output_tensor
+        return [
+            op.name
+            for op in self._consumer_map.get(op_name, [])
+            if op.name in self._producer_map
+        ]
 
     def get_all_pre_ops_by_op_name(self, op_name):
-        all_pre_ops = [op_name] + self.get_pre_op_by_op_name(op_name)
-        cur_pre_ops = self.get_pre_op_by_op_name(op_name)
-        while cur_pre_ops:
-            tmp = cur_pre_ops.pop(0)
-            new_pre_ops = self.get_pre_op_by_op_name(tmp)
-            for new_pre_op in new_pre_ops:
-                if new_pre_op not in all_pre_ops:
+        if op_name not in self._all_pre_ops_cache:
+            direct_pre_ops = self.get_pre_op_by_op_name(op_name)
+            all_pre_ops = [op_name] + direct_pre_ops
+            visited = set(all_pre_ops)
+            cur_pre_ops = deque(direct_pre_ops)
+            while cur_pre_ops:
+                tmp = cur_pre_ops.popleft()
+                for new_pre_op in self.get_pre_op_by_op_name(tmp):
+                    if new_pre_op in visited:
+                        continue
+                    visited.add(new_pre_op)
                     cur_pre_ops.append(new_pre_op)
+                    # ops without producers (e.g. graph inputs) are only kept
+                    # when they feed op_name directly
                     if self.get_pre_op_by_op_name(new_pre_op):
                         all_pre_ops.append(new_pre_op)
-        return all_pre_ops
+            self._all_pre_ops_cache[op_name] = all_pre_ops
+        return list(self._all_pre_ops_cache[op_name])
 
     def get_all_next_ops_by_op_name(self, op_name):
-        all_next_ops = [op_name] + self.get_next_op_by_op_name(op_name)
-        cur_next_ops = self.get_next_op_by_op_name(op_name)
-        while cur_next_ops:
-            tmp = cur_next_ops.pop(0)
-            new_next_ops = self.get_next_op_by_op_name(tmp)
-            for new_next_op in new_next_ops:
-                if new_next_op not in all_next_ops:
+        if op_name not in self._all_next_ops_cache:
+            direct_next_ops = self.get_next_op_by_op_name(op_name)
+            all_next_ops = [op_name] + direct_next_ops
+            visited = set(all_next_ops)
+            cur_next_ops = deque(direct_next_ops)
+            while cur_next_ops:
+                tmp = cur_next_ops.popleft()
+                for new_next_op in self.get_next_op_by_op_name(tmp):
+                    if new_next_op in visited:
+                        continue
+                    visited.add(new_next_op)
                     cur_next_ops.append(new_next_op)
                     all_next_ops.append(new_next_op)
-        return all_next_ops
+            self._all_next_ops_cache[op_name] = all_next_ops
+        return list(self._all_next_ops_cache[op_name])
 
     def get_block_ops_by_op_name(self, name_list1, name_list2):
         all_pre_ops = set(self.get_all_pre_ops_by_op_name(name_list2))
@@ -279,41 +304,31 @@ class MlirParser:
         return list(block_ops)
 
     def get_user_count_by_op_name(self, op_name):
-        count = 0
-        for op in self.ops:
-            if op_name in op.opds:
-                count += 1
-        return count
+        return len(self._consumer_map.get(op_name, []))
 
     def get_use_count_by_op_name(self, op_name):
-        count = 0
-        for op in self.ops:
-            count += op.opds.count(op_name)
-        return count
+        return sum(op.opds.count(op_name) for op in self._consumer_map.get(op_name, []))
+
+    def get_producer_by_tensor_name(self, tensor_name):
+        return self._producer_map.get(tensor_name)
+
+    def get_consumers_by_tensor_name(self, tensor_name):
+        return list(self._consumer_map.get(tensor_name, []))
 
     def get_outputs_by_op_name(self, op_name):
-        for op in self.ops:
-            if op.name == op_name:
-                return op.outputs
-        return None
+        op = self._op_map.get(op_name)
+        return op.outputs if op is not None else None
 
     def get_op_by_op_name(self, op_name):
-        for op in self.ops:
-            if op.name == op_name:
-                return op
-        return None
+        return self._op_map.get(op_name)
 
     def get_opds_by_op_name(self, op_name):
-        for op in self.ops:
-            if op.name == op_name:
-                return op.opds
-        return None
+        op = self._op_map.get(op_name)
+        return op.opds if op is not None else None
 
     def get_op_type_by_op_name(self, op_name):
-        for op in self.ops:
-            if op.name == op_name:
-                return op.type
-        return None
+        op = self._op_map.get(op_name)
+        return op.type if op is not None else None
 
     # the func is to get a dict with output names and corresponding shapes
     def get_output_op_names_n_shapes(self):
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# ==============================================================================
+#
+# Copyright (C) 2022 Sophgo Technologies Inc.  All rights reserved.
+#
+# TPU-MLIR is licensed under the 2-Clause BSD License except for the
+# third-party components.
+#
+# ==============================================================================
+
+import zipfile
+import numpy as np
+
+
+class NpzMmap:
+    """
+    Read only npz whose uncompressed members are memory mapped on access,
+    compressed members are decompressed like np.load.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        with zipfile.ZipFile(filename) as zf:
+            self._infos = {
+                info.filename[:-4]: info
+                for info in zf.infolist() if info.filename.endswith('.npy')
+            }
+        self.files = list(self._infos.keys())
+
+    def __contains__(self, name):
+        return name in self._infos
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def keys(self):
+        return self.files
+
+    def _header(self, f, info):
+        # skip the local file header, its extra field may differ from the central one
+        f.seek(info.header_offset + 26)
+        name_len, extra_len = np.frombuffer(f.read(4), dtype='<u2')
+        f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        return shape, fortran_order, dtype, f.tell()
+
+    def nbytes(self, name):
+        # size of the stored npy member, header included
+        return self._infos[name].file_size
+
+    def shape(self, name):
+        info = self._infos[name]
+        if info.compress_type != zipfile.ZIP_STORED:
+            return self[name].shape
+        with open(self.filename, 'rb') as f:
+            return self._header(f, info)[0]
+
+    def __getitem__(self, name):
+        info = self._infos[name]
+        with open(self.filename, 'rb') as f:
+            if info.compress_type == zipfile.ZIP_STORED:
+                shape, fortran_order, dtype, offset = self._header(f, info)
+                if not dtype.hasobject and np.prod(shape) > 0:
+                    return np.memmap(self.filename, dtype=dtype, mode='c', offset=offset,
+                                     shape=shape, order='F' if fortran_order else 'C')
+        with np.load(self.filename) as x:
+            return x[name]
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+
+def load_npz(filename: str):
+    return NpzMmap(filename)
@@ -4,6 +4,8 @@ import numpy as np
 import cv2
 import ast
 import argparse
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from utils.log_setting import setup_logger
 from utils.mlir_parser import *
@@ -53,6 +55,49 @@ customization_format_attributes = {
 # fix bool bug of argparse
 
 
+class ImageBatches:
+    """
+    {batch: tensor} of one input. Batches are preprocessed when first read, together
+    with the following ones up to a window of about num_workers images; the previous
+    window is dropped, so reading batches in order keeps one window in memory.
+    """
+
+    def __init__(self, ppa, batches):
+        self.ppa = ppa
+        self.batches = batches
+        self.index = {}
+        for i, batch in enumerate(batches):
+            self.index.setdefault(batch, i)
+        batch_images = len(batches[0].split(',')) if batches else 1
+        self.window = max(1, ppa.num_workers // batch_images)
+        self.loaded = {}
+
+    def __getitem__(self, batch):
+        if batch not in self.loaded:
+            start = self.index[batch]
+            window = self.batches[start:start + self.window]
+            # release the previous window before decoding the next one
+            self.loaded = {}
+            self.loaded = dict(zip(window, self.ppa.run_list(window)))
+        return self.loaded[batch]
+
+    def __len__(self):
+        return len(self.batches)
+
+
+def preprocess_image_batches(ppa_list, data_list, batch_size):
+    """
+    Split every full batch of data_list into the comma separated image list of each
+    input, which is passed to preprocess.run. Return an ImageBatches for each input.
+    """
+    batches = [[] for _ in ppa_list]
+    for start in range(0, len(data_list) - batch_size + 1, batch_size):
+        rows = [[s.strip() for s in data.split(',')] for data in data_list[start:start + batch_size]]
+        for i in range(len(ppa_list)):
+            batches[i].append(','.join(row[i] for row in rows))
+    return [ImageBatches(ppa, batch) for ppa, batch in zip(ppa_list, batches)]
+
+
 class ImageResizeTool:
     @staticmethod
     def stretch_resize(image, h, w, use_pil_resize=False):
@@ -164,7 +209,10 @@ class preprocess(object):
         self.debug_cmd = debug_cmd
         self.fuse_pre = False
         self.has_pre = False
-        pass
+        # images are decoded by a thread pool, cv2 releases the GIL
+        self.num_workers = int(os.environ.get('PREPROCESS_NUM_WORKERS', min(8, os.cpu_count() or 1)))
+        # resized images are cached by image content and preprocess config if set
+        self.cache_dir = os.environ.get('PREPROCESS_CACHE_DIR', '')
 
     def config(self, resize_dims=None, keep_aspect_ratio=False, keep_ratio_mode = "letterbox",
                customization_format = None, fuse_pre = False, aligned = False,
@@ -378,8 +426,7 @@ class preprocess(object):
         image = None
         image_path = str(input).rstrip()
         if not os.path.exists(image_path):
-            print("{} doesn't existed !!!".format(image_path))
-            exit(1)
+            raise FileNotFoundError("{} doesn't existed !!!".format(image_path))
 
         use_pil_resize = False
         if 'use_pil_resize' in self.debug_cmd:
@@ -429,6 +476,44 @@ class preprocess(object):
             image = np.transpose(image, (2, 0, 1))
         return image, ratio
 
+    def __cache_key(self, image_path):
+        config = [
+            self.resize_dims, self.net_input_dims, self.channel_num, self.keep_aspect_ratio,
+            self.keep_ratio_mode, self.pad_value, self.pad_type, 'use_pil_resize' in self.debug_cmd
+        ]
+        h = hashlib.sha1(str(config).encode())
+        with open(image_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def __load_image_cached(self, input):
+        if not self.cache_dir:
+            return self.__load_image_and_resize(input)
+        image_path = str(input).rstrip()
+        if not os.path.exists(image_path):
+            raise FileNotFoundError("{} doesn't existed !!!".format(image_path))
+        cache_file = os.path.join(self.cache_dir, self.__cache_key(image_path) + '.npz')
+        if os.path.exists(cache_file):
+            try:
+                with np.load(cache_file) as cached:
+                    return cached['image'], float(cached['ratio'])
+            except Exception:
+                pass
+        image, ratio = self.__load_image_and_resize(input)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_file = '{}.{}.tmp.npz'.format(cache_file[:-4], os.getpid())
+        np.savez(tmp_file, image=image, ratio=ratio)
+        os.replace(tmp_file, cache_file)
+        return image, ratio
+
+    def load_images(self, paths):
+        # return [(chw image, ratio)] of paths, decoded concurrently
+        if self.num_workers <= 1 or len(paths) <= 1:
+            return [self.__load_image_cached(path) for path in paths]
+        with ThreadPoolExecutor(min(self.num_workers, len(paths))) as executor:
+            return list(executor.map(self.__load_image_cached, paths))
+
     def get_config(self, attr_type):
         if attr_type == 'ratio':
             return self.ratio_list
@@ -513,15 +598,24 @@ class preprocess(object):
         return x_tmp2
 
     def run(self, input):
+        return self.run_list([input])[0]
+
+    def run_list(self, inputs):
+        # run each comma separated image list of inputs, images of all inputs are decoded together
+        paths = [path for input in inputs for path in input.split(',')]
+        images = self.load_images(paths)
+        outputs = []
+        start = 0
+        for input in inputs:
+            num = len(input.split(','))
+            outputs.append(self.__run_loaded(input, images[start:start + num]))
+            start += num
+        return outputs
+
+    def __run_loaded(self, input, images):
         # load and resize image, the output image is chw format.
-        x_list = []
-        self.ratio_list = []
-        for path in input.split(','):
-            x, ratio = self.__load_image_and_resize(path)
-            x = np.expand_dims(x, axis=0)
-            x_list.append(x)
-            self.ratio_list.append(ratio)
-        x = np.concatenate(x_list, axis=0)
+        self.ratio_list = [ratio for _, ratio in images]
+        x = np.stack([image for image, _ in images], axis=0)
         # take center crop if needed
         if self.resize_dims != self.net_input_dims:
             if self.crop_method == "right":